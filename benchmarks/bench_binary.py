@@ -0,0 +1,98 @@
+# ----------------------------------------- bench_binary.py ---------------------------------------
+# Benchmark of the message serialization for the SMTP transfer.
+#
+# It compares the "as_string()" path used by smtplib's DATA transfer (string generation, encoding
+# back to bytes and dot-stuffing) with the binary path (BytesGenerator and BDAT chunks sliced from
+# a memoryview), reporting the time and the peak memory of each one.
+#
+# Usage:
+#     PYTHONPATH=src python benchmarks/bench_binary.py [--size MB] [--repeat N]
+#
+# -------------------------------------------------------------------------------------------------
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+from argparse import Namespace
+
+from simplemail.binary import message_bytes, use_8bit_bodies
+from simplemail.cli import build_message, set_defaults
+from simplemail.protocol import bdat_commands, quote_data
+
+
+def legacy_transfer(msg):
+    # As smtplib does with a string: CRLF line endings, dot-stuffing and the final "." line
+    return len(quote_data(msg.as_string().encode("ascii")))
+
+
+def binary_transfer(msg):
+    use_8bit_bodies(msg)
+    return sum(len(command) + len(chunk) for command, chunk in bdat_commands(message_bytes(msg)))
+
+
+def measure(function, options, repeat):
+    best = None
+    for _ in range(repeat):
+        msg = build_message(options)
+        start = time.perf_counter()
+        function(msg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    msg = build_message(options)
+    tracemalloc.start()
+    try:
+        function(msg)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the message serialization")
+    parser.add_argument("--size", type=int, default=20, help="attachment size in MB")
+    parser.add_argument("--repeat", type=int, default=5, help="repetitions per path")
+    args = parser.parse_args()
+
+    with tempfile.NamedTemporaryFile(delete=False) as f:
+        f.write(os.urandom(args.size * 1024 * 1024))
+    try:
+        options = set_defaults(
+            Namespace(
+                sender="from@example.com",
+                to=["to@example.com"],
+                cc=None,
+                bcc=None,
+                subject=None,
+                smtp_server=None,
+                smtp_user=None,
+                smtp_password=None,
+                tls=None,
+                ssl=None,
+                content_type="text/plain",
+                charset=None,
+                log_level=None,
+                smtp_debug=None,
+                body=["Relatório em anexo.\n" * 1000],
+                file=[f.name],
+            )
+        )
+        print("%-10s %12s %14s" % ("path", "time (ms)", "peak (MB)"))
+        results = {}
+        for name, function in (("as_string", legacy_transfer), ("binary", binary_transfer)):
+            elapsed, peak = measure(function, options, args.repeat)
+            results[name] = (elapsed, peak)
+            print("%-10s %12.1f %14.1f" % (name, elapsed * 1000, peak / 1024.0 / 1024.0))
+        (legacy_time, legacy_peak), (binary_time, binary_peak) = results.values()
+        print(
+            "binary path: %.1fx faster, %.1f MB less peak memory"
+            % (legacy_time / binary_time, (legacy_peak - binary_peak) / 1024.0 / 1024.0)
+        )
+    finally:
+        os.unlink(f.name)
+
+
+if __name__ == "__main__":
+    main()
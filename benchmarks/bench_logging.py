@@ -0,0 +1,108 @@
+# ---------------------------------------- bench_logging.py ---------------------------------------
+# Benchmark of the logging cost on the sending thread (simplemail.logs).
+#
+# It sends messages one at a time through one SMTP session to the local sink with the logging
+# off (WARNING) and with the INFO and DEBUG records either written by the sending thread (sync) or
+# queued to the background writer (queue), reporting the p50/p99 latency of a send and the
+# messages per second. "--write-delay" adds a delay to each record written, as a slow disk or
+# terminal would.
+#
+# Usage:
+#     PYTHONPATH=src python benchmarks/bench_logging.py [--messages N] [--write-delay MS]
+#
+# -------------------------------------------------------------------------------------------------
+import argparse
+import logging
+import os
+import tempfile
+import time
+from argparse import Namespace
+
+from simplemail import logs
+from simplemail.cli import build_message, set_defaults
+from simplemail.mailer import Mailer
+from simplemail.sink import SMTPSink
+
+
+def slow_down(handler, delay):
+    emit = handler.emit
+
+    def _emit(record):
+        time.sleep(delay)
+        emit(record)
+
+    handler.emit = _emit
+
+
+MODES = (
+    ("off", logging.WARNING, False),
+    ("info", logging.INFO, False),
+    ("info+q", logging.INFO, True),
+    ("debug", logging.DEBUG, False),
+    ("debug+q", logging.DEBUG, True),
+)
+
+
+def run(level, use_queue, address, path, messages, delay):
+    logs.setup_logging(level, log_file=path, use_queue=use_queue)
+    writer = logs._listener.handlers[0] if logs._listener is not None else logs._handler
+    slow_down(writer, delay)
+
+    options = set_defaults(
+        Namespace(
+            sender="from@example.com",
+            to=["to@example.com"],
+            cc=None,
+            bcc=None,
+            subject=None,
+            smtp_server=address,
+            smtp_user=None,
+            smtp_password=None,
+            tls="false",
+            ssl="false",
+            content_type="text/plain",
+            charset=None,
+            log_level=None,
+            smtp_debug=None,
+            body=["Hello"],
+            file=None,
+        )
+    )
+    times = []
+    with Mailer.from_options(options) as mailer:
+        for _ in range(messages):
+            start = time.perf_counter()
+            with logs.message_context():
+                msg = build_message(options)
+                mailer.sendmail(msg["From"], options.to, msg)
+                logging.info('Email sent to: "%s"', msg["To"])
+            times.append(time.perf_counter() - start)
+    total = sum(times)
+    # The queued records are written after the sends
+    logs.stop_logging()
+    times.sort()
+    return times[len(times) // 2], times[int(len(times) * 0.99)], messages / total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the logging cost of a send")
+    parser.add_argument("--messages", type=int, default=500, help="messages per mode")
+    parser.add_argument("--write-delay", type=float, default=0.2, help="delay per record in ms")
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".log")
+    os.close(fd)
+    try:
+        with SMTPSink(keep_messages=False) as sink:
+            print("%-8s %10s %10s %12s" % ("logging", "p50 (ms)", "p99 (ms)", "messages/s"))
+            for name, level, use_queue in MODES:
+                p50, p99, rate = run(
+                    level, use_queue, sink.address, path, args.messages, args.write_delay / 1000
+                )
+                print("%-8s %10.2f %10.2f %12.0f" % (name, p50 * 1000, p99 * 1000, rate))
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# --------------------------------------- bench_recipients.py -------------------------------------
+# Benchmark of the recipient processing (simplemail.recipients).
+#
+# It writes a synthetic address list with duplicates (in different case) and invalid addresses,
+# and compares reading it as is (the raw list sent before the recipient processing), a naive
+# normalization with "email.utils.parseaddr" and "process_recipients", reporting the time, the
+# addresses per second, the peak memory and the recipients kept by each one.
+#
+# Usage:
+#     PYTHONPATH=src python benchmarks/bench_recipients.py [--addresses N] [--duplicates F]
+#
+# -------------------------------------------------------------------------------------------------
+import argparse
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+from argparse import Namespace
+from email.utils import parseaddr
+
+from simplemail.recipients import iter_address_file, process_recipients
+
+
+def write_addresses(path, count, duplicates, invalid):
+    rng = random.Random(0)
+    unique = int(count * (1 - duplicates))
+    with open(path, "w") as f:
+        for i in range(count):
+            if rng.random() < invalid:
+                f.write("user%d.example.com\n" % i)
+            elif i >= unique:
+                n = rng.randrange(unique)
+                f.write(("User%d@Example.com\n" if n % 2 else "user%d@example.com\n") % n)
+            else:
+                f.write("user%d@example.com\n" % i)
+
+
+def raw_list(path):
+    with open(path, "r") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def naive_normalization(path):
+    seen, addresses = set(), []
+    for line in iter_address_file(path):
+        address = parseaddr(line)[1]
+        if "@" in address and address.lower() not in seen:
+            seen.add(address.lower())
+            addresses.append(line)
+    return addresses
+
+
+def recipient_processing(path):
+    options = Namespace(to=[], cc=None, bcc=None, to_file=None, bcc_file=path)
+    process_recipients(options)
+    return options.bcc
+
+
+def measure(function, path):
+    start = time.perf_counter()
+    kept = len(function(path))
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    try:
+        function(path)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return elapsed, peak, kept
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the recipient processing")
+    parser.add_argument("--addresses", type=int, default=1000000, help="addresses in the list")
+    parser.add_argument("--duplicates", type=float, default=0.2, help="fraction of duplicates")
+    parser.add_argument("--invalid", type=float, default=0.01, help="fraction of invalid ones")
+    args = parser.parse_args()
+
+    fd, path = tempfile.mkstemp(suffix=".txt")
+    os.close(fd)
+    try:
+        write_addresses(path, args.addresses, args.duplicates, args.invalid)
+        modes = (
+            ("raw list", raw_list),
+            ("parseaddr", naive_normalization),
+            ("recipients", recipient_processing),
+        )
+        print(
+            "%-12s %10s %14s %12s %10s" % ("mode", "time (s)", "addresses/s", "peak (MB)", "kept")
+        )
+        for name, function in modes:
+            elapsed, peak, kept = measure(function, path)
+            print(
+                "%-12s %10.2f %14.0f %12.1f %10d"
+                % (name, elapsed, args.addresses / elapsed, peak / 2**20, kept)
+            )
+    finally:
+        os.unlink(path)
+
+
+if __name__ == "__main__":
+    main()
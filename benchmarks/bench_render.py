@@ -0,0 +1,105 @@
+# ----------------------------------------- bench_render.py ---------------------------------------
+# Benchmark of the offline rendering (simplemail.render).
+#
+# It renders a batch of messages, optionally with an attachment, to each output format with one
+# process and with "--processes N" worker processes, reporting the messages per second and the MB
+# written per second. The "build" rows don't write anything: they measure the message
+# construction by itself.
+#
+# Usage:
+#     PYTHONPATH=src python benchmarks/bench_render.py [--messages N] [--attachment KB]
+#                                                      [--processes N] [--sync-every N]
+#
+# -------------------------------------------------------------------------------------------------
+import argparse
+import os
+import shutil
+import tempfile
+import time
+from argparse import Namespace
+from unittest.mock import patch
+
+from simplemail import render
+from simplemail.cli import set_defaults
+
+
+class NullWriter(render.OutputWriter):
+    def _write(self, from_addr, header, data):
+        self.bytes += len(header) + len(data)
+
+
+def make_options(output, attachment, processes, sync_every):
+    return set_defaults(
+        Namespace(
+            sender="from@example.com",
+            to=["to@example.com"],
+            cc=None,
+            bcc=None,
+            subject="Render benchmark",
+            smtp_server=None,
+            smtp_user=None,
+            smtp_password=None,
+            tls=None,
+            ssl=None,
+            content_type="text/html",
+            charset=None,
+            log_level=None,
+            smtp_debug=None,
+            body=["<p>Relatório de %s</p>\n" % time.strftime("%Y-%m-%d") * 50],
+            file=[attachment] if attachment else None,
+            output=output,
+            output_sync=sync_every,
+            processes=processes,
+        )
+    )
+
+
+def run(kind, directory, attachment, messages, processes, sync_every):
+    target = os.path.join(directory, kind)
+    options = make_options("%s:%s" % (kind, target), attachment, processes, sync_every)
+    jobs = [{"to": "user%d@example.com" % i} for i in range(messages)]
+    writers = []
+
+    def _open(options, open_output=render.open_output):
+        writer = NullWriter("") if kind == "build" else open_output(options)
+        writers.append(writer)
+        return writer
+
+    with patch.object(render, "open_output", _open):
+        start = time.perf_counter()
+        render.render_jobs(options, jobs, processes)
+        elapsed = time.perf_counter() - start
+    return messages / elapsed, writers[0].bytes / elapsed / 1024.0 / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the offline rendering")
+    parser.add_argument("--messages", type=int, default=1000, help="messages per run")
+    parser.add_argument("--attachment", type=int, default=0, help="attachment size in KB")
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1, help="processes")
+    parser.add_argument("--sync-every", type=int, default=render.DEFAULT_SYNC_EVERY)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp()
+    attachment = None
+    if args.attachment:
+        attachment = os.path.join(directory, "attachment.bin")
+        with open(attachment, "wb") as f:
+            f.write(os.urandom(args.attachment * 1024))
+    try:
+        print("%-8s %9s %12s %8s" % ("output", "processes", "messages/s", "MB/s"))
+        for kind in ["build"] + render.OUTPUT_KINDS:
+            for processes in sorted({1, args.processes}):
+                rate, throughput = run(
+                    kind, directory, attachment, args.messages, processes, args.sync_every
+                )
+                print("%-8s %9d %12.0f %8.1f" % (kind, processes, rate, throughput))
+                shutil.rmtree(os.path.join(directory, kind), ignore_errors=True)
+                if kind == "mbox":
+                    os.unlink(os.path.join(directory, kind))
+    finally:
+        shutil.rmtree(directory)
+
+
+if __name__ == "__main__":
+    main()
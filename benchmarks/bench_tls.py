@@ -0,0 +1,93 @@
+# ------------------------------------------ bench_tls.py -----------------------------------------
+# Benchmark of the TLS handshakes of the SMTP connections.
+#
+# It opens connections with STARTTLS (or implicit TLS) to the local SMTP sink, comparing smtplib's
+# default (a new SSL context per connection), a shared SSL context and a shared SSL context which
+# resumes the TLS session (simplemail.tls), reporting the time to connect and secure each one.
+#
+# Usage:
+#     PYTHONPATH=src python benchmarks/bench_tls.py [--connections N] [--tls starttls|ssl]
+#
+# -------------------------------------------------------------------------------------------------
+import argparse
+import smtplib
+import statistics
+import time
+
+from simplemail import tls
+from simplemail.sink import SMTPSink
+
+
+def smtplib_default(host, port, implicit):
+    if implicit:
+        return smtplib.SMTP_SSL(host, port)
+    server = smtplib.SMTP(host, port)
+    server.starttls()
+    return server
+
+
+def shared_context(host, port, implicit):
+    context = tls.ssl_context()
+    if implicit:
+        return smtplib.SMTP_SSL(host, port, context=context)
+    server = smtplib.SMTP(host, port)
+    server.starttls(context=context)
+    return server
+
+
+def resumed_session(host, port, implicit):
+    context = tls.resuming_context(host, port)
+    if implicit:
+        server = smtplib.SMTP_SSL(host, port, context=context)
+    else:
+        server = smtplib.SMTP(host, port)
+        server.starttls(context=context)
+    server.ehlo()
+    context.save_session()
+    return server
+
+
+def measure(function, address, implicit, connections):
+    host, port = address.split(":")
+    times = []
+    reused = 0
+    for _ in range(connections):
+        start = time.perf_counter()
+        server = function(host, int(port), implicit)
+        server.ehlo_or_helo_if_needed()
+        times.append(time.perf_counter() - start)
+        reused += server.sock.session_reused
+        server.quit()
+    return times, reused
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the TLS handshakes")
+    parser.add_argument("--connections", type=int, default=200, help="connections per mode")
+    parser.add_argument("--tls", choices=["starttls", "ssl"], default="starttls")
+    args = parser.parse_args()
+
+    modes = (
+        ("smtplib default", smtplib_default),
+        ("shared context", shared_context),
+        ("resumed session", resumed_session),
+    )
+    print("%-16s %10s %10s %10s" % ("mode", "p50 (ms)", "mean (ms)", "resumed"))
+    with SMTPSink(tls=args.tls) as sink:
+        results = {}
+        for name, function in modes:
+            times, reused = measure(function, sink.address, args.tls == "ssl", args.connections)
+            results[name] = statistics.mean(times)
+            print(
+                "%-16s %10.2f %10.2f %10d"
+                % (name, statistics.median(times) * 1000, results[name] * 1000, reused)
+            )
+    baseline = results["smtplib default"]
+    print(
+        "resumed sessions: %.1fx faster connections than smtplib's default"
+        % (baseline / results["resumed session"])
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+# ------------------------------------------ __init__.py ------------------------------------------
+# The library API (see simplemail.mailer) is imported on first use, so the command line doesn't
+# pay for it
+#
+# -------------------------------------------------------------------------------------------------
+LAZY_ATTRIBUTES = {"Mailer": "simplemail.mailer", "PreparedMessage": "simplemail.mailer"}
+
+__all__ = list(LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in LAZY_ATTRIBUTES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    import importlib
+
+    return getattr(importlib.import_module(LAZY_ATTRIBUTES[name]), name)
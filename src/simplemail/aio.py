@@ -0,0 +1,452 @@
+# --------------------------------------------- aio.py --------------------------------------------
+# An asyncio delivery engine for simplemail.
+#
+# It implements the SMTP client side (EHLO, STARTTLS, implicit TLS, AUTH, MAIL/RCPT/DATA, RSET and
+# QUIT) with asyncio streams, so many messages can be sent concurrently from a single thread.
+#
+# The same options Namespace used by "send_email" is accepted, thus the configuration loaded by
+# "load_configuration" works without changes. The SMTP errors are reported with the exceptions
+# from "smtplib".
+#
+# STARTTLS over asyncio streams requires Python 3.11 or newer.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import asyncio
+import base64
+import logging
+import smtplib
+import socket
+import ssl
+from email.message import Message
+
+from simplemail import timing, tls
+from simplemail.batch import job_options
+from simplemail.binary import message_bytes, use_8bit_bodies
+from simplemail.cli import parse_server, prepare_message
+from simplemail.partcache import with_part_cache
+from simplemail.protocol import (
+    CRLF,
+    SERVICE_NOT_AVAILABLE,
+    bdat_commands,
+    check_envelope_replies,
+    envelope_commands,
+    quote_data,
+)
+from simplemail.ratelimit import is_throttled, with_rate_limiter
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: AsyncSMTP
+# A single SMTP connection over asyncio streams
+#
+class AsyncSMTP:
+    def __init__(self, host, port, timeout=60):
+        self.host = host
+        self.port = int(port)
+        self.timeout = timeout
+        self.reader = None
+        self.writer = None
+        self.esmtp_features = {}
+        self.sent = 0
+
+    async def connect(self, use_ssl=False, context=None):
+        ssl_context = (context or ssl.create_default_context()) if use_ssl else None
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port, ssl=ssl_context), self.timeout
+        )
+        code, msg = await self.getreply()
+        if code != 220:
+            self.close()
+            raise smtplib.SMTPConnectError(code, msg)
+        return code, msg
+
+    async def getreply(self):
+        lines = []
+        while True:
+            try:
+                line = await asyncio.wait_for(self.reader.readline(), self.timeout)
+            except (OSError, asyncio.TimeoutError) as e:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("Connection lost: %s" % e)
+            if not line:
+                self.close()
+                raise smtplib.SMTPServerDisconnected("Connection unexpectedly closed")
+            lines.append(line[4:].strip(b" \t\r\n"))
+            if line[3:4] != b"-":
+                break
+        try:
+            code = int(line[:3])
+        except ValueError:
+            code = -1
+        return code, b"\n".join(lines)
+
+    async def write(self, data):
+        if self.writer is None:
+            raise smtplib.SMTPServerDisconnected("please run connect() first")
+        self.writer.write(data)
+        try:
+            await self.writer.drain()
+        except OSError as e:
+            self.close()
+            raise smtplib.SMTPServerDisconnected("Connection lost: %s" % e)
+
+    async def docmd(self, cmd, args=""):
+        await self.write(("%s %s" % (cmd, args)).strip().encode("ascii") + CRLF)
+        return await self.getreply()
+
+    async def ehlo(self, name=None):
+        name = name or socket.gethostname()
+        code, msg = await self.docmd("EHLO", name)
+        if code != 250:
+            code, msg = await self.docmd("HELO", name)
+            if code != 250:
+                raise smtplib.SMTPHeloError(code, msg)
+            return code, msg
+        self.esmtp_features = {}
+        for line in msg.decode("latin-1").split("\n")[1:]:
+            feature, _, params = line.partition(" ")
+            self.esmtp_features[feature.lower()] = params.strip()
+        return code, msg
+
+    def has_extn(self, opt):
+        return opt.lower() in self.esmtp_features
+
+    async def starttls(self, context=None):
+        if not self.has_extn("starttls"):
+            raise smtplib.SMTPNotSupportedError("STARTTLS extension not supported by server.")
+        if not hasattr(self.writer, "start_tls"):
+            raise smtplib.SMTPNotSupportedError(
+                "STARTTLS with asyncio requires Python 3.11 or newer"
+            )
+        code, msg = await self.docmd("STARTTLS")
+        if code != 220:
+            raise smtplib.SMTPResponseException(code, msg)
+        await self.writer.start_tls(
+            context or ssl.create_default_context(), server_hostname=self.host
+        )
+        # The extensions must be discovered again over the secure channel
+        return await self.ehlo()
+
+    async def login(self, user, password):
+        if not self.has_extn("auth"):
+            raise smtplib.SMTPNotSupportedError("SMTP AUTH extension not supported by server.")
+        mechanisms = self.esmtp_features["auth"].upper().split()
+        if "PLAIN" in mechanisms:
+            token = base64.b64encode(("\0%s\0%s" % (user, password)).encode("utf-8"))
+            code, msg = await self.docmd("AUTH", "PLAIN " + token.decode("ascii"))
+        elif "LOGIN" in mechanisms:
+            token = base64.b64encode(user.encode("utf-8"))
+            code, msg = await self.docmd("AUTH", "LOGIN " + token.decode("ascii"))
+            if code == 334:
+                code, msg = await self.docmd(
+                    base64.b64encode(password.encode("utf-8")).decode("ascii")
+                )
+        else:
+            raise smtplib.SMTPException("No suitable authentication method found.")
+        if code not in (235, 503):
+            raise smtplib.SMTPAuthenticationError(code, msg)
+        return code, msg
+
+    # -- It sends the message, signed by the DKIM signer if any (see simplemail.dkim)
+    async def sendmail(self, from_addr, to_addrs, msg, signer=None):
+        body = None
+        if isinstance(msg, Message):
+            with timing.phase("build"):
+                if self.has_extn("8bitmime") and use_8bit_bodies(msg):
+                    body = "8BITMIME"
+                msg = message_bytes(msg)
+        elif isinstance(msg, str):
+            msg = msg.encode("ascii")
+        streaming = hasattr(msg, "iter_chunks")
+        header = b""
+        if signer is not None:
+            # Only the DKIM-Signature header is generated, it's sent before the message
+            with timing.phase("dkim"):
+                header = msg.signature(signer) if streaming else signer.signature(msg)
+        size = msg.size() if streaming else len(msg)
+        if size is not None:
+            size += len(header)
+        # The streaming messages are already dot-stuffed, thus they are always sent with DATA
+        chunking = self.has_extn("chunking") and not streaming
+
+        options = ["size=%d" % size] if size is not None and self.has_extn("size") else []
+        options += ["BODY=%s" % body] if body else []
+        with timing.phase("envelope"):
+            if self.has_extn("pipelining"):
+                refused = await self._envelope_pipelined(from_addr, to_addrs, options, not chunking)
+            else:
+                refused = await self._envelope(from_addr, to_addrs, options, not chunking)
+
+        with timing.phase("data"):
+            if chunking:
+                for command, chunk in bdat_commands(msg, header=header):
+                    await self.write(command)
+                    await self.write(chunk)
+                    await self._finish_data()
+            else:
+                if header:
+                    await self.write(header)
+                await self._write_content(msg)
+                await self._finish_data()
+        self.sent += 1
+        timing.count(size or 0, len(to_addrs) - len(refused))
+        return refused
+
+    async def _envelope(self, from_addr, to_addrs, options, data):
+        mail = "FROM:%s%s" % (
+            smtplib.quoteaddr(from_addr),
+            "".join(" " + option for option in options),
+        )
+        code, resp = await self.docmd("MAIL", mail)
+        if code != 250:
+            await self._abort(code)
+            raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+
+        refused = {}
+        for rcpt in to_addrs:
+            code, resp = await self.docmd("RCPT", "TO:%s" % smtplib.quoteaddr(rcpt))
+            if code not in (250, 251):
+                refused[rcpt] = (code, resp)
+            if code == SERVICE_NOT_AVAILABLE:
+                self.close()
+                raise smtplib.SMTPRecipientsRefused(refused)
+        if len(refused) == len(to_addrs):
+            await self.rset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if not data:
+            return refused
+
+        code, resp = await self.docmd("DATA")
+        if code != 354:
+            await self._abort(code)
+            raise smtplib.SMTPDataError(code, resp)
+        return refused
+
+    async def _envelope_pipelined(self, from_addr, to_addrs, options, data):
+        await self.write(envelope_commands(from_addr, to_addrs, options, data))
+        replies = [await self.getreply() for _ in range(len(to_addrs) + (2 if data else 1))]
+        try:
+            return check_envelope_replies(from_addr, to_addrs, replies, data)
+        except smtplib.SMTPException:
+            if any(code == SERVICE_NOT_AVAILABLE for code, _ in replies):
+                self.close()
+            else:
+                # The server may have accepted DATA even without valid recipients
+                if data and replies[-1][0] == 354:
+                    await self.write(b"." + CRLF)
+                    await self.getreply()
+                await self.rset()
+            raise
+
+    async def _finish_data(self):
+        code, resp = await self.getreply()
+        if code != 250:
+            await self._abort(code)
+            raise smtplib.SMTPDataError(code, resp)
+        return code, resp
+
+    async def _write_content(self, msg):
+        if hasattr(msg, "iter_chunks"):
+            for chunk in msg.iter_chunks():
+                await self.write(chunk)
+        else:
+            await self.write(quote_data(msg))
+
+    async def _abort(self, code):
+        if code == SERVICE_NOT_AVAILABLE:
+            self.close()
+        else:
+            await self.rset()
+
+    async def rset(self):
+        return await self.docmd("RSET")
+
+    async def noop(self):
+        return await self.docmd("NOOP")
+
+    async def quit(self):
+        try:
+            return await self.docmd("QUIT")
+        finally:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+# -- Class: AsyncMailer
+# It delivers messages through up to "concurrency" AsyncSMTP connections, which are reused and
+# reconnected when the server drops them or after "max_messages" messages
+#
+class AsyncMailer:
+    def __init__(self, options, concurrency=4, max_messages=0, ssl_context=None):
+        if concurrency < 1:
+            raise ValueError("The concurrency must be at least 1")
+        self.options = options
+        self.concurrency = concurrency
+        self.max_messages = max_messages
+        # As with smtplib (see connect), the server is only verified with a CA file
+        self.ssl_context = ssl_context or tls.ssl_context(options)
+        self.host, self.port, self.use_tls, self.use_ssl = parse_server(options)
+        self.limiter = getattr(with_rate_limiter(options), "rate_limiter", None)
+        # The DKIM signer, shared with the other sessions of the process (see simplemail.dkim)
+        self.signer = None
+        if getattr(options, "dkim_domain", None):
+            from simplemail import dkim
+
+            self.signer = dkim.signer(options)
+        self._idle = []
+        self._semaphore = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def _open(self):
+        logging.debug(
+            "Connecting to SMTP server: HOST: %s | PORT: %s | TLS: %s",
+            self.host,
+            self.port,
+            self.use_tls,
+        )
+        conn = AsyncSMTP(self.host, self.port)
+        with timing.phase("connect"):
+            await conn.connect(use_ssl=self.use_ssl, context=self.ssl_context)
+        try:
+            await conn.ehlo()
+            if self.use_tls:
+                with timing.phase("tls"):
+                    await conn.starttls(self.ssl_context)
+            with timing.phase("auth"):
+                await conn.login(self.options.smtp_user, self.options.smtp_password)
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    # -- It sends the message within the rate limits, retrying it more slowly while the server
+    # replies with temporary errors (see simplemail.ratelimit)
+    async def sendmail(self, from_addr, to_addrs, msg):
+        if self.limiter is None:
+            return await self._sendmail_reconnecting(from_addr, to_addrs, msg)
+        for attempt in range(self.limiter.max_retries + 1):
+            with timing.phase("wait"):
+                await asyncio.sleep(self.limiter.reserve(len(to_addrs)))
+            try:
+                refused = await self._sendmail_reconnecting(from_addr, to_addrs, msg)
+            except smtplib.SMTPException as e:
+                if not is_throttled(e) or attempt == self.limiter.max_retries:
+                    raise
+                logging.warning('Temporary error: "%s" - retrying more slowly', e)
+                self.limiter.throttle()
+                continue
+            if any(400 <= code < 500 for code, _ in (refused or {}).values()):
+                self.limiter.throttle()
+            else:
+                self.limiter.accepted()
+            return refused
+
+    async def _sendmail_reconnecting(self, from_addr, to_addrs, msg):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            conn = self._idle.pop() if self._idle else None
+            try:
+                refused = await self._sendmail(conn, from_addr, to_addrs, msg)
+            except smtplib.SMTPServerDisconnected as e:
+                logging.warning('Connection with server lost: "%s" - reconnecting', e)
+            except smtplib.SMTPResponseException as e:
+                if e.smtp_code != SERVICE_NOT_AVAILABLE:
+                    raise
+                logging.warning('Server closed the session: "%s" - reconnecting', e)
+            else:
+                return refused
+            return await self._sendmail(None, from_addr, to_addrs, msg)
+
+    async def _sendmail(self, conn, from_addr, to_addrs, msg):
+        if conn is None:
+            conn = await self._open()
+        elif conn.sent:
+            with timing.phase("rset"):
+                await conn.rset()
+        try:
+            refused = await conn.sendmail(from_addr, to_addrs, msg, self.signer)
+        except smtplib.SMTPException:
+            if conn.writer is not None:
+                self._idle.append(conn)
+            raise
+        if self.max_messages and conn.sent >= self.max_messages:
+            with timing.phase("quit"):
+                await conn.quit()
+        else:
+            self._idle.append(conn)
+        return refused
+
+    # -- It builds and sends the message described by an options Namespace
+    async def send_options(self, options):
+        with timing.measure():
+            with timing.phase("build"):
+                msg, payload = prepare_message(options)
+            to_addrs = options.to + options.cc + options.bcc
+            return await self.sendmail(msg["From"], to_addrs, payload)
+
+    # -- It sends many jobs (the same dicts used by the batch mode) concurrently. The result of
+    # each job, in order, is the dict of refused recipients or the exception raised
+    async def send_many(self, jobs):
+        results = []
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        options = with_part_cache(self.options)
+
+        async def _worker():
+            while True:
+                item = await queue.get()
+                if item is None:
+                    return
+                index, job = item
+                try:
+                    results[index] = await self.send_options(job_options(options, job))
+                except Exception as e:
+                    logging.error('Failed to process the e-mail request #%d:  "%s"', index + 1, e)
+                    results[index] = e
+
+        workers = [asyncio.ensure_future(_worker()) for _ in range(self.concurrency)]
+        try:
+            for index, job in enumerate(jobs):
+                results.append(None)
+                await queue.put((index, job))
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+        return results
+
+    async def close(self):
+        idle, self._idle = self._idle, []
+        for conn in idle:
+            try:
+                await conn.quit()
+            except (smtplib.SMTPException, OSError):
+                conn.close()
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: send_email_async
+# The asyncio counterpart of "send_email"
+#
+async def send_email_async(options):
+    try:
+        async with AsyncMailer(options, concurrency=1) as mailer:
+            await mailer.send_options(options)
+        logging.info('Email sent to: "%s"', ", ".join(options.to))
+    except Exception as e:
+        logging.error('Failed to process the e-mail request:  "%s"', e)
+        return 1
+    return 0
@@ -0,0 +1,167 @@
+# ------------------------------------------- batch.py --------------------------------------------
+# Batch sending for simplemail.
+#
+# It reads many message specifications from a JSON Lines file (or the standard input) and delivers
+# all of them through a single reused SMTP session.
+#
+# Each line of the jobs file is a JSON object which may contain the following keys. Missing keys
+# fallback to the values received as arguments/configuration:
+#     - sender: String
+#     - to, cc, bcc: String or list of strings
+#     - subject: String
+#     - message: String with the body or the path of a file with it
+#     - attachments: List of file paths
+#     - content_type: String
+#     - charset: String
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import copy
+import json
+import logging
+import sys
+
+from simplemail import timing
+from simplemail.cli import STDIN, prepare_message
+from simplemail.logs import message_context
+from simplemail.partcache import with_part_cache
+from simplemail.ratelimit import with_rate_limiter
+from simplemail.recipients import process_recipients
+from simplemail.session import SMTPSession
+
+# Mapping between the job keys and the options attributes
+JOB_FIELDS = {
+    "sender": "sender",
+    "to": "to",
+    "cc": "cc",
+    "bcc": "bcc",
+    "subject": "subject",
+    "message": "body",
+    "attachments": "file",
+    "content_type": "content_type",
+    "charset": "charset",
+}
+LIST_FIELDS = ["to", "cc", "bcc", "body", "file"]
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: read_jobs
+# A generator which yields the jobs (dict) from a JSON Lines file, or from the standard input when
+# the path is "-". The lines are read as the jobs are consumed, so a stream of jobs is sent as it
+# arrives and the senders slow down the reading (see send_pooled)
+#
+def read_jobs(path):
+    if path == STDIN:
+        for job in parse_jobs(sys.stdin, "<stdin>"):
+            yield job
+        return
+    with open(path, "r") as f:
+        for job in parse_jobs(f, path):
+            yield job
+
+
+# -- Function: parse_jobs
+# A generator which yields the jobs (dict) of the JSON Lines read from "lines"
+#
+def parse_jobs(lines, name):
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            job = json.loads(line)
+        except ValueError as e:
+            raise ValueError('Invalid job at line %d of "%s": %s' % (lineno, name, e))
+        if not isinstance(job, dict):
+            raise ValueError('Invalid job at line %d of "%s": not an object' % (lineno, name))
+        yield job
+
+
+# -- Function: job_options
+# It returns a copy of the base options overridden by the values of a job
+#
+def job_options(options, job):
+    unknown = set(job) - set(JOB_FIELDS)
+    if unknown:
+        raise ValueError("Unknown job key(s): %s" % ", ".join(sorted(unknown)))
+
+    job_opts = copy.copy(options)
+    for key, value in job.items():
+        attr = JOB_FIELDS[key]
+        if attr in LIST_FIELDS and isinstance(value, str):
+            value = [value]
+        setattr(job_opts, attr, value)
+    process_recipients(job_opts, read_files=False)
+
+    if not job_opts.sender or not job_opts.to:
+        raise ValueError("The job must have a sender and at least one recipient")
+    return job_opts
+
+
+# -- Function: send_job
+# It builds and sends the message of one job using the given "sendmail" callable. It returns
+# whether the message was sent or not
+#
+def send_job(sendmail, options, index, job):
+    with message_context():
+        try:
+            with timing.measure():
+                with timing.phase("build"):
+                    job_opts = job_options(options, job)
+                    msg, payload = prepare_message(job_opts)
+                logging.debug("Sending e-mail #%d", index)
+                sendmail(msg["From"], job_opts.to + job_opts.cc + job_opts.bcc, payload)
+            logging.info('Email #%d sent to: "%s"', index, msg["To"])
+        except Exception as e:
+            logging.error('Failed to process the e-mail request #%d:  "%s"', index, e)
+            return False
+    return True
+
+
+# -- Function: send_batch
+# It sends all the jobs through one SMTP session. It returns 0 when all messages were sent
+# successfully and 1 otherwise
+#
+def send_batch(options, jobs):
+    options = with_rate_limiter(with_part_cache(options))
+    sent = failed = 0
+    max_messages = getattr(options, "max_per_connection", None) or 0
+    with SMTPSession(options, max_messages=max_messages) as session:
+        for index, job in enumerate(jobs, 1):
+            if send_job(session.sendmail, options, index, job):
+                sent += 1
+            else:
+                failed += 1
+    logging.info("Batch finished: %d sent, %d failed", sent, failed)
+    if getattr(options, "part_cache", None) is not None:
+        logging.info(options.part_cache.summary())
+    return 1 if failed else 0
+
+
+# -- Function: send_batch_file
+# It sends all the jobs of a JSON Lines file, through one SMTP session or through a pool of
+# sessions when more than one worker is requested. With more than one process the messages are
+# built by worker processes (see simplemail.processes). With "--output" they're written to disk
+# instead (see simplemail.render)
+#
+def send_batch_file(options, path):
+    workers = getattr(options, "workers", None) or 1
+    processes = getattr(options, "processes", None) or 1
+    try:
+        if getattr(options, "output", None):
+            from simplemail.render import render_jobs
+
+            return render_jobs(options, read_jobs(path), processes)
+        if processes > 1:
+            from simplemail.processes import send_multiprocess
+
+            return send_multiprocess(options, read_jobs(path), processes, workers)
+        if workers > 1:
+            from simplemail.pool import send_pooled
+
+            return send_pooled(options, read_jobs(path), workers)
+        return send_batch(options, read_jobs(path))
+    except (OSError, ValueError) as e:
+        logging.error('Failed to read the batch file "%s": %s', path, e)
+        return 1
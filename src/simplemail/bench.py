@@ -0,0 +1,313 @@
+# -------------------------------------------- bench.py -------------------------------------------
+# Benchmark suite for simplemail ("simplemail-bench").
+#
+# Each scenario sends messages to a local in-process SMTP sink (see simplemail.sink), with the
+# configured reply latency and TLS mode, and reports the throughput (messages/s), the p50/p99
+# latency of each message and the peak RSS of the process. The scenarios run in separate
+# processes, so the peak RSS of each one isn't hidden by the previous ones.
+#
+# The scenarios are:
+#     - single: One "send_email" per message, each one with its own connection
+#     - recipients: The same, with many recipients per message
+#     - attachment: The same, with a large attachment (1/10 of the messages)
+#     - attachment-stream: The same, streaming the attachment (--stream)
+#     - batch: One SMTP session for all messages (--batch)
+#     - pool: A pool of sessions used by concurrent workers (--batch --workers N)
+#     - async: The asyncio mailer with N concurrent connections
+#
+# The results are written as JSON, to track regressions over time.
+#
+# Usage:
+#     simplemail-bench [--scenarios LIST] [--messages N] [--latency MS] [--tls MODE] [-o FILE]
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
+
+from simplemail.cli import send_email, set_defaults
+from simplemail.sink import TLS_MODES, SMTPSink, sink_certificate
+
+SCENARIOS = [
+    "single",
+    "recipients",
+    "attachment",
+    "attachment-stream",
+    "batch",
+    "pool",
+    "async",
+]
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: percentile
+# The nearest-rank percentile of the values
+#
+def percentile(values, percent):
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, -(-len(ordered) * percent // 100))
+    return ordered[int(rank) - 1]
+
+
+# -- Function: peak_rss_kb
+# The peak resident set size of the process in KiB, or None when it isn't available
+#
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB and macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def _options(args, sink, workdir):
+    options = Namespace(
+        sender="bench@example.com",
+        to=["rcpt@example.com"],
+        cc=None,
+        bcc=None,
+        subject="simplemail benchmark",
+        smtp_server=sink.address,
+        smtp_user="bench",
+        smtp_password="bench",
+        tls="true" if args.tls == "starttls" else "false",
+        ssl="true" if args.tls == "ssl" else "false",
+        content_type="text/plain",
+        charset="utf-8",
+        log_level=None,
+        log_file=None,
+        smtp_debug=None,
+        body=["Hello from simplemail-bench\n" * 20],
+        file=None,
+        config_file=None,
+        # The benchmark measures direct connections, even when a broker is running
+        broker_socket=os.path.join(workdir, "no-broker.sock"),
+    )
+    return set_defaults(options)
+
+
+def _attachment(args, workdir):
+    path = os.path.join(workdir, "attachment.bin")
+    if not os.path.exists(path):
+        with open(path, "wb") as f:
+            for _ in range(int(args.attachment_size * 1024)):
+                f.write(os.urandom(1024))
+    return path
+
+
+def _timed(function, *params):
+    start = time.perf_counter()
+    ok = function(*params)
+    return time.perf_counter() - start, ok
+
+
+def _send_each(options, count):
+    return [_timed(lambda: send_email(options) == 0) for _ in range(count)]
+
+
+def _job(index):
+    return {"to": "rcpt%d@example.com" % index}
+
+
+def run_single(args, options, workdir):
+    return _send_each(options, args.messages)
+
+
+def run_recipients(args, options, workdir):
+    options.to = ["rcpt%d@example.com" % i for i in range(args.recipients)]
+    return _send_each(options, args.messages)
+
+
+def run_attachment(args, options, workdir):
+    options.file = [_attachment(args, workdir)]
+    return _send_each(options, max(1, args.messages // 10))
+
+
+def run_attachment_stream(args, options, workdir):
+    options.stream = True
+    return run_attachment(args, options, workdir)
+
+
+def run_batch(args, options, workdir):
+    from simplemail.batch import send_job
+    from simplemail.session import SMTPSession
+
+    with SMTPSession(options) as session:
+        return [
+            _timed(send_job, session.sendmail, options, i, _job(i)) for i in range(args.messages)
+        ]
+
+
+def run_pool(args, options, workdir):
+    from simplemail.batch import send_job
+    from simplemail.pool import SMTPConnectionPool
+
+    with SMTPConnectionPool(options, max_size=args.workers) as pool:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            futures = [
+                executor.submit(_timed, send_job, pool.sendmail, options, i, _job(i))
+                for i in range(args.messages)
+            ]
+            return [future.result() for future in futures]
+
+
+def run_async(args, options, workdir):
+    import ssl
+
+    from simplemail.aio import AsyncMailer
+    from simplemail.batch import job_options
+
+    async def _send(mailer, index):
+        start = time.perf_counter()
+        try:
+            await mailer.send_options(job_options(options, _job(index)))
+        except Exception as e:
+            logging.error("Message #%d failed: %s", index, e)
+            return time.perf_counter() - start, False
+        return time.perf_counter() - start, True
+
+    async def _main():
+        # The sink's self-signed certificate is verified, as a real relay's would be
+        context = ssl.create_default_context(cafile=sink_certificate())
+        async with AsyncMailer(options, concurrency=args.workers, ssl_context=context) as mailer:
+            return await asyncio.gather(*[_send(mailer, i) for i in range(args.messages)])
+
+    return list(asyncio.run(_main()))
+
+
+# -- Function: run_scenario
+# It runs one scenario against a new sink and returns its results
+#
+def run_scenario(args, name):
+    runner = globals()["run_" + name.replace("-", "_")]
+    with tempfile.TemporaryDirectory() as workdir:
+        with SMTPSink(latency=args.latency / 1000.0, tls=args.tls, keep_messages=False) as sink:
+            options = _options(args, sink, workdir)
+            start = time.perf_counter()
+            timings = runner(args, options, workdir)
+            elapsed = time.perf_counter() - start
+            received = sink.received
+
+    latencies = [seconds * 1000 for seconds, _ in timings]
+    return {
+        "scenario": name,
+        "messages": len(timings),
+        "failed": sum(1 for _, ok in timings if not ok),
+        "received": received,
+        "seconds": round(elapsed, 4),
+        "messages_per_second": round(len(timings) / elapsed, 2) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 50), 3) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 3) if latencies else None,
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def _run_subprocess(argv, name):
+    from simplemail import __file__ as package_file
+
+    env = dict(os.environ)
+    src = os.path.dirname(os.path.dirname(os.path.abspath(package_file)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    command = [sys.executable, "-m", "simplemail.bench"] + list(argv) + ["--run", name]
+    proc = subprocess.run(command, env=env, capture_output=True, text=True)
+    if proc.returncode != 0:
+        raise RuntimeError("Scenario %s failed: %s" % (name, proc.stderr.strip()))
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = argparse.ArgumentParser(description="Benchmark simplemail against a local SMTP sink")
+    parser.add_argument(
+        "--scenarios",
+        default=",".join(SCENARIOS),
+        help="Comma separated scenarios to run. Default = all (%s)" % ", ".join(SCENARIOS),
+    )
+    parser.add_argument("--messages", type=int, default=100, help="Messages per scenario")
+    parser.add_argument("--recipients", type=int, default=100, help="Recipients per message")
+    parser.add_argument(
+        "--attachment-size", type=float, default=10, help="The attachment size in MB"
+    )
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent connections")
+    parser.add_argument(
+        "--latency", type=float, default=0, help="The sink delay before accepting a message (ms)"
+    )
+    parser.add_argument(
+        "--tls", choices=["none", "starttls", "ssl"], default="none", help="The sink TLS mode"
+    )
+    parser.add_argument("-o", "--output", metavar="FILE", help="The JSON results file")
+    parser.add_argument(
+        "--in-process", action="store_true", help="Run every scenario in this same process"
+    )
+    parser.add_argument("--run", metavar="SCENARIO", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.tls = None if args.tls == "none" else args.tls
+    assert args.tls in TLS_MODES
+    logging.basicConfig(format="%(asctime)s [%(levelname)s]: %(message)s", level=logging.WARNING)
+
+    # Child process of a single scenario
+    if args.run:
+        print(json.dumps(run_scenario(args, args.run)))
+        return 0
+
+    names = [name.strip() for name in args.scenarios.split(",") if name.strip()]
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        parser.error("unknown scenario(s): %s" % ", ".join(unknown))
+
+    results = []
+    for name in names:
+        result = run_scenario(args, name) if args.in_process else _run_subprocess(argv, name)
+        results.append(result)
+        print(
+            "%-18s %8.1f msg/s   p50 %8.2f ms   p99 %8.2f ms   peak RSS %s KiB"
+            % (
+                name,
+                result["messages_per_second"] or 0,
+                result["p50_ms"] or 0,
+                result["p99_ms"] or 0,
+                result["peak_rss_kb"],
+            ),
+            file=sys.stderr,
+        )
+
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            "messages": args.messages,
+            "recipients": args.recipients,
+            "attachment_size_mb": args.attachment_size,
+            "workers": args.workers,
+            "latency_ms": args.latency,
+            "tls": args.tls or "none",
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    return 1 if any(result["failed"] for result in results) else 0
+
+
+# ------------------------------------------- Main ------------------------------------------------
+if __name__ == "__main__":
+    sys.exit(main())
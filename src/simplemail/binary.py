@@ -0,0 +1,56 @@
+# ------------------------------------------- binary.py -------------------------------------------
+# Binary message generation for simplemail.
+#
+# The message is generated directly as bytes with "email.generator.BytesGenerator", instead of
+# converting it to a string with "as_string()" and encoding it back. When the server accepts
+# 8BITMIME the text bodies are sent as 8bit, without the base64 blow-up.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import io
+from email import policy
+from email.charset import Charset
+from email.generator import BytesGenerator
+
+SMTP_POLICY = policy.compat32.clone(linesep="\r\n")
+# RFC 5321 line length limit, without CRLF
+MAX_LINE_LENGTH = 998
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: message_bytes
+# It generates the message as bytes with CRLF line endings. A memoryview over the generated
+# buffer is returned to avoid one more copy of the whole message
+#
+def message_bytes(msg):
+    fp = io.BytesIO()
+    BytesGenerator(fp, mangle_from_=False, policy=SMTP_POLICY).flatten(msg)
+    return fp.getbuffer()
+
+
+# -- Function: use_8bit_bodies
+# It converts the base64/quoted-printable text parts of the message to 8bit. It returns whether
+# any part was converted, thus the message must be sent with BODY=8BITMIME
+#
+def use_8bit_bodies(msg):
+    converted = False
+    for part in msg.walk():
+        if part.get_content_maintype() != "text" or part.is_multipart():
+            continue
+        if part.get("Content-Transfer-Encoding", "").lower() not in ("base64", "quoted-printable"):
+            continue
+        charset = part.get_content_charset() or "us-ascii"
+        raw = part.get_payload(decode=True)
+        if max(len(line) for line in raw.splitlines() or [b""]) > MAX_LINE_LENGTH:
+            continue
+        try:
+            text = raw.decode(charset)
+        except (LookupError, UnicodeDecodeError):
+            continue
+        eight_bit = Charset(charset)
+        eight_bit.body_encoding = None
+        del part["Content-Transfer-Encoding"]
+        part.set_payload(text, eight_bit)
+        converted = converted or part["Content-Transfer-Encoding"] == "8bit"
+    return converted
@@ -0,0 +1,269 @@
+# ------------------------------------------- broker.py -------------------------------------------
+# A local SMTP connection broker for simplemail.
+#
+# "simplemail --broker" keeps warm, authenticated SMTP sessions with the configured server and
+# listens on a Unix domain socket. The CLI invocations which find the socket hand the message
+# bytes and the envelope to the broker instead of connecting, authenticating and negotiating TLS
+# with the server themselves. When the broker isn't running they connect directly, as usual.
+#
+# The requests are a JSON line with the envelope and the size of the message, followed by the
+# message bytes. The reply is a JSON line with the refused recipients or the error. The broker
+# only accepts messages sent with its own settings (see "BROKER_SETTINGS": the server, the user,
+# the DKIM signature, the envelope size and the rate limits), otherwise the client connects
+# directly.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import json
+import logging
+import os
+import signal
+import socket
+import socketserver
+import threading
+
+from simplemail.cli import broker_socket_path
+from simplemail.logs import message_context
+
+DEFAULT_WORKERS = 2
+# Idle sessions are checked and reconnected every KEEPALIVE_INTERVAL seconds
+KEEPALIVE_INTERVAL = 60
+MAX_HEADER_SIZE = 1024 * 1024
+# The options applied by the sessions of the broker, which must match those of the client
+BROKER_SETTINGS = [
+    "smtp_server",
+    "smtp_user",
+    "dkim_domain",
+    "dkim_selector",
+    "dkim_key",
+    "dkim_headers",
+    "dkim_canonicalization",
+    "max_recipients",
+    "messages_per_second",
+    "recipients_per_minute",
+]
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: BrokerUnavailable
+# The broker isn't running or it can't deliver the messages of these options. The message wasn't
+# handed to the broker, so it can be sent directly
+#
+class BrokerUnavailable(Exception):
+    pass
+
+
+# -- Class: BrokerError
+# The broker failed to deliver the message
+#
+class BrokerError(Exception):
+    pass
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        while True:
+            line = self.rfile.readline(MAX_HEADER_SIZE)
+            if not line:
+                return
+            try:
+                request = json.loads(line.decode("utf-8"))
+                data = self.rfile.read(request["size"])
+            except (ValueError, KeyError, TypeError) as e:
+                self._reply({"status": "error", "error": "Invalid request: %s" % e})
+                return
+            self._reply(self.server.broker.submit(request, data))
+
+    def _reply(self, reply):
+        self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+# -- Class: SMTPBroker
+# The broker process: a pool of SMTP sessions served through a Unix domain socket
+#
+class SMTPBroker:
+    def __init__(self, options, path=None, workers=None):
+        self.path = socket_path(options) if path is None else path
+        self.workers = workers or getattr(options, "workers", None) or DEFAULT_WORKERS
+        self.options, self.pool = self._open_pool(options)
+        self.sent = 0
+        self._server = None
+
+    def _open_pool(self, options):
+        from simplemail.pool import SMTPConnectionPool
+        from simplemail.ratelimit import with_rate_limiter
+
+        options = with_rate_limiter(options)
+        max_messages = getattr(options, "max_per_connection", None) or 0
+        pool = SMTPConnectionPool(
+            options, max_size=self.workers, idle_timeout=float("inf"), max_messages=max_messages
+        )
+        return options, pool
+
+    # -- It switches to new options, e.g. after the configuration file changed. The sessions in
+    # use finish their message with the previous ones
+    def reload(self, options):
+        previous = self.pool
+        self.options, self.pool = self._open_pool(options)
+        previous.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    # -- It delivers the message of a request and returns the reply
+    def submit(self, request, data):
+        if request.get("settings") != broker_settings(self.options):
+            return {"status": "unavailable", "error": "The broker uses other settings"}
+        with message_context():
+            try:
+                refused = self.pool.sendmail(request["from"], request["to"], data)
+            except Exception as e:
+                logging.error('Failed to deliver the message: "%s"', e)
+                return {"status": "error", "error": str(e)}
+            self.sent += 1
+            logging.info('Email sent to: "%s"', ", ".join(request["to"]))
+        refused = {rcpt: [code, str(resp)] for rcpt, (code, resp) in (refused or {}).items()}
+        return {"status": "sent", "refused": refused}
+
+    # -- It keeps at least one session connected, so the next message doesn't wait for it
+    def keepalive(self):
+        try:
+            with self.pool.session(timeout=0) as session:
+                if session.server is None:
+                    logging.debug("Connecting a warm SMTP session")
+                    session.connect()
+        except TimeoutError:
+            pass
+        except Exception as e:
+            logging.warning('Failed to connect to the SMTP server: "%s"', e)
+
+    def start(self):
+        if os.path.exists(self.path):
+            if broker_running(self.path):
+                raise RuntimeError('Another broker is listening on "%s"' % self.path)
+            os.unlink(self.path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # Only the owner can submit messages through the authenticated sessions
+        umask = os.umask(0o177)
+        try:
+            self._server = _Server(self.path, _Handler)
+        finally:
+            os.umask(umask)
+        self._server.broker = self
+        threading.Thread(target=self._server.serve_forever, args=(0.1,), daemon=True).start()
+        logging.info('Broker listening on "%s"', self.path)
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        self.pool.close()
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: socket_path
+# The path of the broker socket for the given options
+#
+def socket_path(options):
+    return broker_socket_path(options)
+
+
+# -- Function: broker_settings
+# The settings of the options which the broker must share with the client (see "BROKER_SETTINGS"),
+# as sent in the requests. The unset ones are None
+#
+def broker_settings(options):
+    return {name: getattr(options, name, None) or None for name in BROKER_SETTINGS}
+
+
+# -- Function: broker_running
+# Whether a broker is listening on the socket
+#
+def broker_running(path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(path)
+    except OSError:
+        return False
+    return True
+
+
+# -- Function: send_via_broker
+# It hands the message bytes to the broker. It returns the refused recipients, raises
+# BrokerUnavailable when the message can be sent directly instead or BrokerError when the broker
+# failed to deliver it
+#
+def send_via_broker(options, from_addr, to_addrs, data, timeout=None):
+    path = socket_path(options)
+    if not hasattr(socket, "AF_UNIX") or not os.path.exists(path):
+        raise BrokerUnavailable("No broker listening on %s" % path)
+    header = {
+        "settings": broker_settings(options),
+        "from": from_addr,
+        "to": list(to_addrs),
+        "size": len(data),
+    }
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+        except OSError as e:
+            raise BrokerUnavailable("Failed to connect to the broker: %s" % e)
+        sock.sendall(json.dumps(header).encode("utf-8") + b"\n")
+        sock.sendall(data)
+        with sock.makefile("rb") as f:
+            line = f.readline(MAX_HEADER_SIZE)
+    finally:
+        sock.close()
+    if not line:
+        raise BrokerError("The broker closed the connection before replying")
+
+    reply = json.loads(line.decode("utf-8"))
+    if reply["status"] == "unavailable":
+        raise BrokerUnavailable(reply["error"])
+    if reply["status"] != "sent":
+        raise BrokerError(reply["error"])
+    return {rcpt: tuple(value) for rcpt, value in reply["refused"].items()}
+
+
+# -- Function: run_broker
+# It runs the broker until stopped (SIGTERM/SIGINT or the "stop" event)
+#
+def run_broker(options, stop=None, path=None):
+    stop = stop or threading.Event()
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stop.set())
+    try:
+        broker = SMTPBroker(options, path)
+        broker.start()
+    except (OSError, RuntimeError) as e:
+        logging.error("Failed to start the broker: %s", e)
+        return 1
+    watcher = getattr(options, "config_watcher", None)
+    try:
+        broker.keepalive()
+        while not stop.wait(KEEPALIVE_INTERVAL):
+            reloaded = watcher.poll() if watcher is not None else None
+            if reloaded is not None:
+                broker.reload(reloaded)
+            broker.keepalive()
+    finally:
+        broker.stop()
+        logging.info("Broker stopped after sending %d messages", broker.sent)
+    return 0
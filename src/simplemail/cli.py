@@ -28,17 +28,17 @@
 # -------------------------------------------------------------------------------------------------
 
 # ------------------------------------------ Imports ----------------------------------------------
+# Only the light modules are imported here, so "--help" and the argument errors are fast. The
+# heavy ones (smtplib, email.*, configparser and the simplemail submodules) are imported by the
+# functions which need them
 import argparse
-import configparser
+import codecs
 import logging
 import os
-import smtplib
 import sys
-from email.mime.application import MIMEApplication
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from email.utils import COMMASPACE, formatdate
-from os.path import basename
+
+# Modules available as attributes of this module but imported on first use (see __getattr__)
+LAZY_MODULES = ["smtplib", "configparser", "protocol"]
 
 DEFAULT_PORTS = [
     {"port": "25", "tls": False, "ssl": False},
@@ -47,111 +47,239 @@ DEFAULT_PORTS = [
     {"port": "2525", "tls": True, "ssl": False},
 ]
 
+# The Unix socket of the --broker (see simplemail.broker)
+DEFAULT_BROKER_SOCKET = os.path.join("~", ".simplemail", "broker.sock")
+
+# The name of the standard input for the message body and the jobs file
+STDIN = "-"
+STDIN_CHUNK_SIZE = 64 * 1024
+
+# The message body read from the standard input (see read_stdin)
+_stdin_body = None
+
 
 # ----------------------------------------- Functions ---------------------------------------------
-# -- Function: sendEmail
-# A function to send an e-mail using the arguments received as parameters
+# -- Function: __getattr__
+# It imports the lazy modules on first access, e.g. "simplemail.cli.smtplib"
 #
-def send_email(options):
-    try:
-        msg = MIMEMultipart()
-        msg["From"] = options.sender
-        msg["To"] = COMMASPACE.join(options.to)
-        msg["cc"] = COMMASPACE.join(options.cc) if options.cc else ""
-        msg["bcc"] = COMMASPACE.join(options.bcc) if options.bcc else ""
-        msg["Date"] = formatdate(localtime=True)
-        msg["Subject"] = options.subject
-        options.cc = [] if not options.cc else options.cc
-        options.bcc = [] if not options.bcc else options.bcc
+def __getattr__(name):
+    if name not in LAZY_MODULES:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    import importlib
+
+    module = "simplemail." + name if name == "protocol" else name
+    return importlib.import_module(module)
+
+
+# -- Function: body_from_stdin
+# Whether the message body must be read from the standard input ("-m -")
+#
+def body_from_stdin(options):
+    return "".join(options.body or []) == STDIN
 
+
+# -- Function: read_stdin
+# It reads the whole standard input in chunks, decoding each one with the given charset, so the
+# input isn't held both as bytes and as text. The input is read only once, the next calls return
+# the same text
+#
+def read_stdin(charset):
+    global _stdin_body
+    if _stdin_body is None:
+        decoder = codecs.getincrementaldecoder(charset)()
+        parts = []
+        while True:
+            chunk = sys.stdin.buffer.read(STDIN_CHUNK_SIZE)
+            parts.append(decoder.decode(chunk, final=not chunk))
+            if not chunk:
+                break
+        _stdin_body = "".join(parts)
+    return _stdin_body
+
+
+# -- Function: read_body
+# It returns the message body, which can be the text itself, the path of a file with it or "-" to
+# read it from the standard input
+#
+def read_body(options):
+    if body_from_stdin(options):
+        return read_stdin(options.charset)
+    # Check if the message is a file
+    body = str("".join(options.body or []))
+    if os.path.isfile(body):
+        with open(body, "r") as f:
+            body = f.read()
+    return body
+
+
+# -- Function: build_message
+# It builds the MIME message from the options received as parameters. The attachments can be
+# left out to be streamed later (see simplemail.streaming)
+#
+def build_message(options, attach_files=True):
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+    from email.utils import COMMASPACE, formatdate
+
+    msg = MIMEMultipart()
+    msg["From"] = options.sender
+    msg["To"] = COMMASPACE.join(options.to)
+    msg["cc"] = COMMASPACE.join(options.cc) if options.cc else ""
+    msg["bcc"] = COMMASPACE.join(options.bcc) if options.bcc else ""
+    msg["Date"] = formatdate(localtime=True)
+    msg["Subject"] = options.subject
+    options.cc = [] if not options.cc else options.cc
+    options.bcc = [] if not options.bcc else options.bcc
+
+    # The headers are looked up only when they are logged
+    if logging.root.isEnabledFor(logging.DEBUG):
         logging.debug("Initializing the e-mail sending with the following parameters:")
-        logging.debug("    - msg['From'] = %s" % msg["From"])
-        logging.debug("    - msg['To'] = %s" % msg["To"])
-        logging.debug("    - msg['cc'] = %s" % msg["cc"])
-        logging.debug("    - msg['bcc'] = %s" % msg["bcc"])
-        logging.debug("    - msg['Date'] = %s" % msg["Date"])
-        logging.debug("    - msg['Subject'] = %s" % msg["Subject"])
-
-        # Message body
-        logging.debug("Processing the e-mail body:")
-        logging.debug("    - content_type: %s" % options.content_type)
-        logging.debug("    - charset: %s" % options.charset)
-
-        # Check if the message is a file
-        body = str("".join(options.body))
-        if os.path.isfile(body):
-            f = open(body, "r")
-            body = "".join(f.readlines())
-            f.close()
-
-        msg.attach(
-            MIMEText(body, options.content_type.replace("text/", ""), _charset=options.charset)
-        )
+        logging.debug("    - msg['From'] = %s", msg["From"])
+        logging.debug("    - msg['To'] = %s", msg["To"])
+        logging.debug("    - msg['cc'] = %s", msg["cc"])
+        logging.debug("    - msg['bcc'] = %s", msg["bcc"])
+        logging.debug("    - msg['Date'] = %s", msg["Date"])
+        logging.debug("    - msg['Subject'] = %s", msg["Subject"])
+
+    # Message body
+    logging.debug("Processing the e-mail body:")
+    logging.debug("    - content_type: %s", options.content_type)
+    logging.debug("    - charset: %s", options.charset)
+
+    body = read_body(options)
+    msg.attach(MIMEText(body, options.content_type.replace("text/", ""), _charset=options.charset))
+
+    # Process attachements. The batches share a cache of encoded attachments (see partcache)
+    part_cache = getattr(options, "part_cache", None)
+    for f in (options.file or []) if attach_files else []:
+        logging.debug('Attaching the file "%s"', f)
+        if part_cache is not None:
+            part = part_cache.attachment(f)
+        else:
+            from email.mime.application import MIMEApplication
 
-        # Process attachements
-        for f in options.file or []:
-            logging.debug('Attaching the file "%s"' % f)
             with open(f, "rb") as fil:
-                part = MIMEApplication(fil.read(), Name=basename(f))
-            # After the file is closed
-            part["Content-Disposition"] = 'attachment; filename="%s"' % basename(f)
-            msg.attach(part)
-
-        logging.debug("Connecting to SMTP server:")
-
-        # Parse host and port
-        smtp_address = options.smtp_server.split(":")
-        smtp_host = smtp_address[0]
-        smtp_port = smtp_address[1] if len(smtp_address) > 1 else "25"
-
-        # Decides the use of SSL/TLS
-        use_tls = True if options.tls.lower().find("true") != -1 else False
-        use_tls = (
-            check_ports_mapping(smtp_port, "tls")
-            if options.tls.lower().find("auto") != -1
-            else use_tls
-        )
-        use_ssl = True if options.ssl.lower().find("true") != -1 else False
-        use_ssl = (
-            check_ports_mapping(smtp_port, "ssl")
-            if options.ssl.lower().find("auto") != -1
-            else use_ssl
-        )
+                part = MIMEApplication(fil.read(), Name=os.path.basename(f))
+        # After the file is closed
+        part["Content-Disposition"] = 'attachment; filename="%s"' % os.path.basename(f)
+        msg.attach(part)
+    return msg
 
-        logging.debug("    - HOST: %s | PORT: %s | TLS: %s" % (smtp_host, smtp_port, str(use_tls)))
 
-        # Initializes the SMTP connection
-        server = (
-            smtplib.SMTP_SSL(smtp_host, smtp_port)
-            if use_ssl
-            else smtplib.SMTP(smtp_host, smtp_port)
-        )
+# -- Function: parse_server
+# It parses the SMTP "host:port" and decides the use of SSL/TLS
+#
+def parse_server(options):
+    smtp_address = options.smtp_server.split(":")
+    smtp_host = smtp_address[0]
+    smtp_port = smtp_address[1] if len(smtp_address) > 1 else "25"
+
+    # Decides the use of SSL/TLS
+    use_tls = True if options.tls.lower().find("true") != -1 else False
+    use_tls = (
+        check_ports_mapping(smtp_port, "tls") if options.tls.lower().find("auto") != -1 else use_tls
+    )
+    use_ssl = True if options.ssl.lower().find("true") != -1 else False
+    use_ssl = (
+        check_ports_mapping(smtp_port, "ssl") if options.ssl.lower().find("auto") != -1 else use_ssl
+    )
+    return smtp_host, smtp_port, use_tls, use_ssl
 
-        # Set the DEBUG level for SMTP if required
-        if options.smtp_debug.lower().find("true") != -1:
-            server.set_debuglevel(True)
 
-        if use_tls:
-            logging.debug("    - starting TLS communication")
-            server.starttls()
+# -- Function: connect
+# It opens an authenticated connection with the SMTP server (see simplemail.mailer)
+#
+def connect(options):
+    mailer = getattr(options, "mailer", None)
+    if mailer is None:
+        from simplemail.mailer import Mailer
 
-        logging.debug(
-            "    - starting login with USERNAME: %s | PASSWORD: %s"
-            % (options.smtp_user, options.smtp_password)
-        )
-        server.login(options.smtp_user, options.smtp_password)
+        mailer = Mailer.from_options(options)
+    return mailer.connect()
 
-        # Send the message
-        logging.debug("Sending e-mail")
-        server.sendmail(msg["From"], options.to + options.cc + options.bcc, msg.as_string())
-        logging.info('Email sent to: "%s"' % msg["To"])
 
-        # Close connectino
-        logging.debug("Closing the connection with server")
-        server.quit()
-    except Exception as e:
-        logging.error('Failed to process the e-mail request:  "%s"' % str(e))
-        return 1
+# -- Function: prepare_message
+# It returns the message and its payload for "protocol.sendmail". When streaming is enabled the
+# payload is a StreamingMessage, otherwise the MIME message itself, which is generated as bytes
+# according to the extensions supported by the server
+#
+def prepare_message(options):
+    if getattr(options, "stream", None):
+        from simplemail.streaming import StreamingMessage
+
+        msg = StreamingMessage(options, use_mmap=bool(getattr(options, "mmap", None)))
+        return msg, msg
+    msg = build_message(options)
+    return msg, msg
+
+
+# -- Function: broker_socket_path
+# The path of the broker socket for the given options
+#
+def broker_socket_path(options):
+    path = getattr(options, "broker_socket", None) or DEFAULT_BROKER_SOCKET
+    return os.path.abspath(os.path.expanduser(path))
+
+
+# -- Function: send_with_broker
+# It hands the message to the broker (see simplemail.broker) when it's running. It returns whether
+# the message was handed, otherwise it must be sent directly
+#
+def send_with_broker(options, msg):
+    # Checked before importing the broker module, which pulls in socketserver and json
+    if not os.path.exists(broker_socket_path(options)):
+        return False
+
+    from simplemail import timing
+    from simplemail.binary import message_bytes
+    from simplemail.broker import BrokerUnavailable, send_via_broker
+
+    to_addrs = options.to + options.cc + options.bcc
+    try:
+        with timing.phase("build"):
+            data = message_bytes(msg)
+        with timing.phase("broker"):
+            send_via_broker(options, msg["From"], to_addrs, data)
+    except BrokerUnavailable as e:
+        logging.debug("Sending without the broker: %s", e)
+        return False
+    logging.info('Email sent through the broker to: "%s"', msg["To"])
+    return True
+
+
+# -- Function: sendEmail
+# A function to send an e-mail using the arguments received as parameters
+#
+def send_email(options):
+    from simplemail import timing
+    from simplemail.logs import message_context
+
+    with message_context():
+        try:
+            with timing.measure():
+                with timing.phase("build"):
+                    msg, payload = prepare_message(options)
+                if not getattr(options, "stream", None) and send_with_broker(options, msg):
+                    return 0
+
+                from simplemail.mailer import Mailer
+
+                # Send the message. Its envelopes can be spread over many sessions (see envelope)
+                logging.debug("Sending e-mail")
+                to_addrs = options.to + options.cc + options.bcc
+                workers = getattr(options, "workers", None) or 1
+                max_recipients = getattr(options, "max_recipients", None) or 0
+                if workers > 1 and 0 < max_recipients < len(to_addrs):
+                    from simplemail.envelope import send_envelopes
+
+                    send_envelopes(options, msg["From"], to_addrs, payload, workers, max_recipients)
+                else:
+                    with Mailer.from_options(options) as mailer:
+                        mailer.sendmail(msg["From"], to_addrs, payload)
+                logging.info('Email sent to: "%s"', msg["To"])
+        except Exception as e:
+            logging.error('Failed to process the e-mail request:  "%s"', e)
+            return 1
     return 0
 
 
@@ -163,90 +291,153 @@ def check_ports_mapping(port, method):
     try:
         res = next(p for p in DEFAULT_PORTS if p["port"] == port)[method]
     except Exception:
-        logging.error('Couldn\'t determine the SSL/TLS behavior for port "%s" - Not mapped' % port)
+        logging.error('Couldn\'t determine the SSL/TLS behavior for port "%s" - Not mapped', port)
     return res
 
 
 # -- Function: load_configuration
 # It retrieves the configuration from external file and override the default options
-# while preserving the values passed as arguments
+# while preserving the values passed as arguments. The parsed file is cached (see
+# simplemail.config)
 #
 def load_configuration(options):
-    config = configparser.ConfigParser()
+    from simplemail.config import read_configuration
+
     try:
-        config.read(options.config_file)
-
-        # SMTP - Mandatory section
-        smtp_section = config["SMTP"]
-        options.smtp_server = (
-            smtp_section["Host"].strip('"') + ":" + smtp_section["Port"].strip('"')
-            if not options.smtp_server
-            else options.smtp_server
+        config = read_configuration(options.config_file, getattr(options, "config_cache", False))
+        apply_configuration(options, config)
+    except Exception as e:
+        print('CRITICAL: Failed to load the configuration file "%s": %s' % (options.config_file, e))
+        sys.exit(1)
+    return options
+
+
+# -- Function: apply_configuration
+# It sets the options not passed as arguments from the parsed configuration file, whose keys are
+# lowercased as in "configparser"
+#
+def apply_configuration(options, config):
+    # SMTP - Mandatory section
+    smtp_section = config["SMTP"]
+    options.smtp_server = (
+        smtp_section["host"] + ":" + smtp_section["port"]
+        if not options.smtp_server
+        else options.smtp_server
+    )
+    if "username" in smtp_section:
+        options.smtp_user = smtp_section["username"] if not options.smtp_user else options.smtp_user
+    if "password" in smtp_section:
+        options.smtp_password = (
+            smtp_section["password"] if not options.smtp_password else options.smtp_password
+        )
+    if "usessl" in smtp_section:
+        options.ssl = smtp_section["usessl"] if not options.ssl else options.ssl
+    if "usetls" in smtp_section:
+        options.tls = smtp_section["usetls"] if not options.tls else options.tls
+    if "cafile" in smtp_section:
+        options.ca_file = (
+            smtp_section["cafile"] if not getattr(options, "ca_file", None) else options.ca_file
+        )
+    if "clientcert" in smtp_section:
+        options.client_cert = (
+            smtp_section["clientcert"]
+            if not getattr(options, "client_cert", None)
+            else options.client_cert
         )
-        if "Username" in smtp_section:
-            options.smtp_user = (
-                smtp_section["Username"].strip('"') if not options.smtp_user else options.smtp_user
+    if "clientkey" in smtp_section:
+        options.client_key = (
+            smtp_section["clientkey"]
+            if not getattr(options, "client_key", None)
+            else options.client_key
+        )
+    if "tlsminversion" in smtp_section:
+        options.tls_min_version = (
+            smtp_section["tlsminversion"]
+            if not getattr(options, "tls_min_version", None)
+            else options.tls_min_version
+        )
+
+    # MESSAGE - Optional section
+    if "MESSAGE" in config:
+        message_section = config["MESSAGE"]
+        options.body = message_section["content"] if not options.body else options.body
+        if "subject" in message_section:
+            options.subject = message_section["subject"] if not options.subject else options.subject
+        if "contenttype" in message_section:
+            options.content_type = (
+                message_section["contenttype"] if not options.content_type else options.content_type
             )
-        if "Password" in smtp_section:
-            options.smtp_password = (
-                smtp_section["Password"].strip('"')
-                if not options.smtp_password
-                else options.smtp_password
+        if "charset" in message_section:
+            options.charset = message_section["charset"] if not options.charset else options.charset
+
+    # LOGGING - Optional section
+    if "LOGGING" in config:
+        logging_section = config["LOGGING"]
+        options.log_level = (
+            logging_section["loglevel"] if not options.log_level else options.log_level
+        )
+        if "logfile" in logging_section:
+            options.log_file = (
+                logging_section["logfile"] if not options.log_file else options.log_file
             )
-        if "UseSSL" in smtp_section:
-            options.ssl = smtp_section["UseSSL"].strip('"') if not options.ssl else options.ssl
-        if "UseTLS" in smtp_section:
-            options.tls = smtp_section["UseTLS"].strip('"') if not options.tls else options.tls
-
-        # MESSAGE - Optional section
-        if "MESSAGE" in config.sections():
-            message_section = config["MESSAGE"]
-            options.body = (
-                message_section["Content"].strip('"') if not options.body else options.body
+        if "logformat" in logging_section:
+            options.log_format = (
+                logging_section["logformat"]
+                if not getattr(options, "log_format", None)
+                else options.log_format
             )
-            if "Subject" in message_section:
-                options.subject = (
-                    message_section["Subject"].strip('"')
-                    if not options.subject
-                    else options.subject
-                )
-            if "ContentType" in message_section:
-                options.content_type = (
-                    message_section["ContentType"].strip('"')
-                    if not options.content_type
-                    else options.content_type
-                )
-            if "Charset" in message_section:
-                options.charset = (
-                    message_section["Charset"].strip('"')
-                    if not options.charset
-                    else options.charset
-                )
-
-        # LOGGING - Optional section
-        if "LOGGING" in config.sections():
-            logging_section = config["LOGGING"]
-            options.log_level = (
-                logging_section["LogLevel"].strip('"')
-                if not options.log_level
-                else options.log_level
+        if "smtpdebug" in logging_section:
+            options.smtp_debug = (
+                logging_section["smtpdebug"] if not options.smtp_debug else options.smtp_debug
             )
-            if "LogFile" in logging_section:
-                options.log_file = (
-                    logging_section["LogFile"].strip('"')
-                    if not options.log_file
-                    else options.log_file
-                )
-            if "SmtpDebug" in logging_section:
-                options.smtp_debug = (
-                    logging_section["SmtpDebug"].strip('"')
-                    if not options.smtp_debug
-                    else options.smtp_debug
-                )
 
-    except Exception as e:
-        print('CRITICAL: Failed to load the configuration file "%s": %s' % (options.config_file, e))
-        sys.exit(1)
+    # LIMITS - Optional section
+    if "LIMITS" in config:
+        limits_section = config["LIMITS"]
+        if "messagespersecond" in limits_section:
+            options.messages_per_second = (
+                float(limits_section["messagespersecond"])
+                if not getattr(options, "messages_per_second", None)
+                else options.messages_per_second
+            )
+        if "recipientsperminute" in limits_section:
+            options.recipients_per_minute = (
+                float(limits_section["recipientsperminute"])
+                if not getattr(options, "recipients_per_minute", None)
+                else options.recipients_per_minute
+            )
+        if "maxrecipients" in limits_section:
+            options.max_recipients = (
+                int(limits_section["maxrecipients"])
+                if not getattr(options, "max_recipients", None)
+                else options.max_recipients
+            )
+
+    # DKIM - Optional section
+    if "DKIM" in config:
+        dkim_section = config["DKIM"]
+        if "domain" in dkim_section:
+            options.dkim_domain = (
+                dkim_section["domain"]
+                if not getattr(options, "dkim_domain", None)
+                else options.dkim_domain
+            )
+        if "selector" in dkim_section:
+            options.dkim_selector = (
+                dkim_section["selector"]
+                if not getattr(options, "dkim_selector", None)
+                else options.dkim_selector
+            )
+        if "privatekey" in dkim_section:
+            options.dkim_key = (
+                dkim_section["privatekey"]
+                if not getattr(options, "dkim_key", None)
+                else options.dkim_key
+            )
+        if "headers" in dkim_section:
+            options.dkim_headers = dkim_section["headers"]
+        if "canonicalization" in dkim_section:
+            options.dkim_canonicalization = dkim_section["canonicalization"]
     return options
 
 
@@ -280,17 +471,22 @@ def main():
         "--sender",
         dest="sender",
         metavar="MAIL_ADDRESS",
-        help="The sender email address",
-        required=True,
+        help="The sender email address. Not required with --batch/--daemon/--broker",
     )
     required.add_argument(
         "-t",
         "--to",
         dest="to",
         metavar="MAIL_ADDRESS",
-        help="The recipient email address(es)",
+        help="The recipient email address(es). "
+        "Not required with --batch/--daemon/--broker/--merge-data",
         nargs="+",
-        required=True,
+    )
+    parser.add_argument(
+        "--to-file",
+        dest="to_file",
+        metavar="FILE",
+        help="A file with more recipient email addresses, one per line",
     )
 
     # Optional arguments
@@ -303,6 +499,13 @@ def main():
         metavar="CONFIG_FILE",
         help="The configuration file in INI format",
     )
+    parser.add_argument(
+        "--config-cache",
+        dest="config_cache",
+        action="store_true",
+        help="Save the parsed configuration file next to it, so it's not parsed again until it "
+        "changes",
+    )
     parser.add_argument(
         "-xu",
         "--smtp_user",
@@ -328,6 +531,12 @@ def main():
         help="The bcc email address(es)",
         nargs="*",
     )
+    parser.add_argument(
+        "--bcc-file",
+        dest="bcc_file",
+        metavar="FILE",
+        help="A file with more bcc email addresses, one per line",
+    )
     parser.add_argument(
         "-u",
         "--subject",
@@ -347,7 +556,8 @@ def main():
         "--message",
         dest="body",
         metavar="MESSAGE",
-        help="The message body. It can also be the path of a file with the message body",
+        help="The message body. It can also be the path of a file with the message body or "
+        '"-" to read it from the standard input',
         nargs="*",
     )
     parser.add_argument(
@@ -365,6 +575,30 @@ def main():
         metavar="<true|false|auto>",
         help="Whether use SSL or not. Default = auto",
     )
+    parser.add_argument(
+        "--ca-file",
+        dest="ca_file",
+        metavar="FILE",
+        help="The CA certificates used to verify the server. Default = not verified",
+    )
+    parser.add_argument(
+        "--client-cert",
+        dest="client_cert",
+        metavar="FILE",
+        help="The client certificate for TLS in PEM format, optionally with its key",
+    )
+    parser.add_argument(
+        "--client-key",
+        dest="client_key",
+        metavar="FILE",
+        help="The private key of --client-cert when it's in another file",
+    )
+    parser.add_argument(
+        "--tls-min-version",
+        dest="tls_min_version",
+        choices=["1.0", "1.1", "1.2", "1.3"],
+        help="The minimum TLS version accepted",
+    )
     parser.add_argument(
         "--content-type",
         dest="content_type",
@@ -389,6 +623,13 @@ def main():
         metavar="FILE",
         help="log into a file instead of using STDOUT.",
     )
+    parser.add_argument(
+        "--log-format",
+        dest="log_format",
+        choices=["text", "json"],
+        help="the log format: text or json (one object per line, with the message IDs). "
+        "Default = text",
+    )
     parser.add_argument(
         "--smtp-debug",
         dest="smtp_debug",
@@ -396,11 +637,234 @@ def main():
         help="whether to enable debugging for SMTP communication. Default = false",
     )
 
+    parser.add_argument(
+        "--batch",
+        "--jobs-from",
+        dest="batch",
+        metavar="JOBS_FILE",
+        help="Send all the messages described in a JSON Lines file through one SMTP session. "
+        'With "-" the jobs are read from the standard input and sent as they arrive',
+    )
+    parser.add_argument(
+        "--max-per-connection",
+        dest="max_per_connection",
+        metavar="N",
+        type=int,
+        help="The maximum number of messages to send before reconnecting. Default = unlimited",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        metavar="N",
+        type=int,
+        help="The concurrent SMTP sessions of --batch (default 1) and --direct (default 8). "
+        "With --max-recipients, the envelopes of one message are sent through N sessions",
+    )
+    parser.add_argument(
+        "--processes",
+        dest="processes",
+        metavar="N",
+        type=int,
+        help="The processes building the messages of --batch and --merge-data. Default = 1",
+    )
+    parser.add_argument(
+        "--stream",
+        dest="stream",
+        action="store_true",
+        help="Stream the attachments to the server instead of loading them in memory",
+    )
+    parser.add_argument(
+        "--mmap",
+        dest="mmap",
+        action="store_true",
+        help="Memory-map the attachments when streaming them",
+    )
+    parser.add_argument(
+        "--enqueue",
+        dest="enqueue",
+        action="store_true",
+        help="Store the message in the outbox to be delivered later by the --daemon process",
+    )
+    parser.add_argument(
+        "--daemon",
+        dest="daemon",
+        action="store_true",
+        help="Deliver the messages of the outbox until stopped",
+    )
+    parser.add_argument(
+        "--spool-dir",
+        dest="spool_dir",
+        metavar="DIR",
+        help="The outbox directory used by --enqueue/--daemon. Default = ~/.simplemail/outbox",
+    )
+    parser.add_argument(
+        "--max-attempts",
+        dest="max_attempts",
+        metavar="N",
+        type=int,
+        help="The delivery attempts before a message is dead-lettered. Default = 5",
+    )
+    parser.add_argument(
+        "--retry-delay",
+        dest="retry_delay",
+        metavar="SECONDS",
+        type=float,
+        help="The delay before the first retry, doubled on each attempt. Default = 60",
+    )
+    parser.add_argument(
+        "--poll-interval",
+        dest="poll_interval",
+        metavar="SECONDS",
+        type=float,
+        help="The interval between checks of the outbox by the --daemon. Default = 5",
+    )
+    parser.add_argument(
+        "--messages-per-second",
+        dest="messages_per_second",
+        metavar="RATE",
+        type=float,
+        help="The maximum messages sent per second to the server. Default = unlimited",
+    )
+    parser.add_argument(
+        "--recipients-per-minute",
+        dest="recipients_per_minute",
+        metavar="RATE",
+        type=float,
+        help="The maximum recipients sent per minute to the server. Default = unlimited",
+    )
+    parser.add_argument(
+        "--max-recipients",
+        dest="max_recipients",
+        metavar="N",
+        type=int,
+        help="The maximum recipients per SMTP transaction. Default = learnt from the server",
+    )
+    parser.add_argument(
+        "--dkim-domain",
+        dest="dkim_domain",
+        metavar="DOMAIN",
+        help="Sign the messages with DKIM for this domain (d=). Requires the selector and the key",
+    )
+    parser.add_argument(
+        "--dkim-selector",
+        dest="dkim_selector",
+        metavar="SELECTOR",
+        help="The DKIM selector (s=) of the public key published in the DNS",
+    )
+    parser.add_argument(
+        "--dkim-key",
+        dest="dkim_key",
+        metavar="PEM_FILE",
+        help="The DKIM private key (RSA for rsa-sha256 or Ed25519 for ed25519-sha256)",
+    )
+    parser.add_argument(
+        "--broker",
+        dest="broker",
+        action="store_true",
+        help="Keep warm SMTP sessions and deliver the messages handed by other invocations",
+    )
+    parser.add_argument(
+        "--broker-socket",
+        dest="broker_socket",
+        metavar="PATH",
+        help="The Unix socket of the --broker. Default = ~/.simplemail/broker.sock",
+    )
+    parser.add_argument(
+        "--direct",
+        dest="direct",
+        action="store_true",
+        help="Deliver to the mail exchangers (MX) of the recipient domains instead of the server",
+    )
+    parser.add_argument(
+        "--resolver",
+        dest="resolver",
+        metavar="HOST[:PORT]",
+        help="The DNS server used by --direct. Default = the first nameserver in resolv.conf",
+    )
+    parser.add_argument(
+        "--mx-map",
+        dest="mx_map",
+        metavar="JSON_FILE",
+        help='Static exchangers for --direct, e.g. {"example.com": ["127.0.0.1:2525"]}',
+    )
+    parser.add_argument(
+        "--domain-concurrency",
+        dest="domain_concurrency",
+        metavar="N",
+        type=int,
+        help="The concurrent connections per domain with --direct. Default = 2",
+    )
+    parser.add_argument(
+        "--attachment-cache-size",
+        dest="attachment_cache_size",
+        metavar="MB",
+        type=float,
+        help="The memory used to encode once the attachments repeated in a batch. Default = 128",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        dest="metrics_file",
+        metavar="FILE",
+        help="Write the timings of each SMTP phase to a file in the Prometheus text format",
+    )
+    parser.add_argument(
+        "--statsd",
+        dest="statsd",
+        metavar="HOST[:PORT]",
+        help="Send the timings of each SMTP phase to a StatsD server over UDP, e.g. localhost:8125",
+    )
+    parser.add_argument(
+        "--merge-data",
+        dest="merge_data",
+        metavar="DATA_FILE",
+        help="Mail merge: send the message and subject templates to each row of a CSV/JSONL file",
+    )
+
+    parser.add_argument(
+        "--output",
+        dest="output",
+        metavar="KIND:PATH",
+        help="Write the messages to disk instead of sending them: maildir:DIR, mbox:FILE or "
+        "eml-dir:DIR",
+    )
+    parser.add_argument(
+        "--output-sync",
+        dest="output_sync",
+        metavar="N",
+        type=int,
+        help="Sync the --output files to disk every N messages, 0 = never. Default = 256",
+    )
+
     # Read the arguments
     options = parser.parse_args()
+    recipients = options.to or options.to_file or options.merge_data
+    bulk = options.batch or options.daemon or options.broker
+    if not bulk and (not options.sender or not recipients):
+        parser.error("the following arguments are required: -f/--sender, -t/--to")
+    if options.batch == STDIN and body_from_stdin(options):
+        parser.error("the standard input can't be read by both --batch/--jobs-from and -m")
+    if options.batch and (options.to_file or options.bcc_file):
+        parser.error(
+            "--to-file and --bcc-file can't be used with --batch: give the jobs' recipients"
+        )
+    if options.batch and (options.processes or 1) > 1 and body_from_stdin(options):
+        parser.error("the --processes workers can't read the body from the standard input (-m -)")
+
+    if options.output:
+        from simplemail.render import parse_output
+
+        try:
+            parse_output(options.output)
+        except ValueError as e:
+            parser.error(str(e))
 
     # Load configuration from file if any
+    watcher = None
     if options.config_file:
+        if options.daemon or options.broker:
+            from simplemail.config import ConfigWatcher
+
+            watcher = ConfigWatcher(options)
         options = load_configuration(options)
 
     # Set default values after "load_configuration" to preserve the original arguments
@@ -418,21 +882,88 @@ def main():
     else:
         log_level = logging.CRITICAL
 
-    if options.log_file:
-        logging.basicConfig(
-            format="%(asctime)s [%(levelname)s]: %(message)s",
-            filename=options.log_file,
-            filemode="a",
-            level=log_level,
-        )
-    else:
-        logging.basicConfig(format="%(asctime)s [%(levelname)s]: %(message)s", level=log_level)
+    # A single message is logged straight to the handler, as logging.basicConfig does. The many
+    # messages of the other modes are logged by a background thread, off the sending threads
+    from simplemail.logs import setup_logging
+
+    setup_logging(
+        log_level,
+        log_file=options.log_file,
+        log_format=options.log_format or "text",
+        use_queue=bool(options.batch or options.daemon or options.broker or options.merge_data),
+        password=options.smtp_password,
+    )
+
+    # Reload the configuration file of the long running processes when it changes
+    if watcher is not None:
+        options.config_watcher = watcher
+
+    # Metrics of the SMTP phases
+    if options.metrics_file or options.statsd:
+        from simplemail.timing import install_exporters
+
+        install_exporters(options)
+
+    # DKIM signing: the private key is loaded once for all the messages of the process
+    if options.dkim_domain:
+        from simplemail.dkim import signer
+
+        try:
+            signer(options)
+        except (OSError, RuntimeError, ValueError) as e:
+            parser.error("can't sign the messages with DKIM: %s" % str(e))
+
+    # Broker process
+    if options.broker:
+        from simplemail.broker import run_broker
+
+        sys.exit(run_broker(options))
+
+    # Outbox delivery
+    if options.daemon:
+        from simplemail.outbox import run_daemon
+
+        sys.exit(run_daemon(options))
+
+    # Batch execution
+    if options.batch:
+        from simplemail.batch import send_batch_file
+
+        sys.exit(send_batch_file(options, options.batch))
+
+    # Mail merge
+    if options.merge_data:
+        from simplemail.merge import send_merge
+
+        sys.exit(send_merge(options, options.merge_data))
+
+    # Recipients: address files, normalization and de-duplication
+    from simplemail.recipients import process_recipients
+
+    try:
+        process_recipients(options)
+    except OSError as e:
+        parser.error("can't read the recipients: %s" % str(e))
+    if not options.to:
+        parser.error("no valid recipient to send the message to")
 
     # Message body check
     if (options.body is None or len(options.body) < 1) and options.file is None:
         parser.error("must specify message body or attachement to send in message")
 
     # Execution
+    if options.output:
+        from simplemail.render import render_email
+
+        sys.exit(render_email(options))
+    if options.enqueue:
+        from simplemail.outbox import enqueue_email
+
+        sys.exit(enqueue_email(options))
+    if options.direct:
+        from simplemail.direct import send_direct
+
+        sys.exit(send_direct(options))
     sys.exit(send_email(options))
 
 
@@ -0,0 +1,150 @@
+# ------------------------------------------- config.py -------------------------------------------
+# Parsed configuration files for simplemail.
+#
+# The INI file is parsed once per process into plain dictionaries ({section: {key: value}}, with
+# the keys lowercased as "configparser" does and the quotes around the values stripped) and kept
+# in memory until its modification time or size change. With "--config-cache" the parsed file is
+# also saved next to it ("<config file>.cache", readable only by its owner as it may hold the
+# SMTP password), so the next invocations skip "configparser" altogether.
+#
+# The long running processes (--daemon and --broker) use a ConfigWatcher to pick up the changes
+# of the file without restarting.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import copy
+import json
+import logging
+import os
+import threading
+
+CACHE_SUFFIX = ".cache"
+
+# The parsed files: path -> (stamp, sections)
+_parsed = {}
+_lock = threading.Lock()
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: ConfigWatcher
+# It reloads the configuration file of a long running process when the file changes.
+#
+# It keeps the original arguments (before "load_configuration"), so the values passed in command
+# line still take precedence over the reloaded file
+#
+class ConfigWatcher:
+    def __init__(self, arguments):
+        self.arguments = copy.copy(arguments)
+        self.path = arguments.config_file
+        self.stamp = file_stamp(self.path)
+
+    # -- It returns the options with the new configuration, or None when the file didn't change
+    # or it can't be loaded
+    def poll(self):
+        from simplemail.cli import apply_configuration, set_defaults
+
+        stamp = file_stamp(self.path)
+        if stamp == self.stamp:
+            return None
+        self.stamp = stamp
+        try:
+            config = read_configuration(self.path, getattr(self.arguments, "config_cache", False))
+            options = apply_configuration(copy.copy(self.arguments), config)
+        except Exception as e:
+            logging.error('Failed to reload the configuration file "%s": %s', self.path, e)
+            return None
+        logging.info('Reloaded the configuration file "%s"', self.path)
+        return set_defaults(options)
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: file_stamp
+# The modification time and size of a file, or None when it doesn't exist
+#
+def file_stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+# -- Function: parse_configuration
+# It parses an INI file into {section: {key: value}}. Missing files are empty, as for
+# "configparser"
+#
+def parse_configuration(path):
+    import configparser
+
+    config = configparser.ConfigParser()
+    config.read(path)
+    return {
+        name: {key: value.strip('"') for key, value in config[name].items()}
+        for name in config.sections()
+    }
+
+
+# -- Function: read_configuration
+# It returns the parsed configuration file, from memory or from the cache file when the file
+# didn't change since it was parsed. The result is shared: it must not be modified
+#
+def read_configuration(path, use_cache_file=False):
+    stamp = file_stamp(path)
+    if stamp is None:
+        return parse_configuration(path)
+    key = os.path.abspath(path)
+    with _lock:
+        cached = _parsed.get(key)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    sections = load_cache_file(path, stamp) if use_cache_file else None
+    if sections is None:
+        sections = parse_configuration(path)
+        if use_cache_file:
+            save_cache_file(path, stamp, sections)
+    with _lock:
+        _parsed[key] = (stamp, sections)
+    return sections
+
+
+# -- Function: load_cache_file
+# It returns the sections saved in the cache file, or None when it's missing or outdated
+#
+def load_cache_file(path, stamp):
+    try:
+        with open(path + CACHE_SUFFIX, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(cache, dict) or cache.get("stamp") != stamp:
+        return None
+    return cache.get("sections")
+
+
+# -- Function: save_cache_file
+# It saves the parsed sections next to the configuration file, replacing the previous cache
+# atomically. Failures are ignored: the cache is an optimization, and nothing is logged because
+# the logging isn't configured yet when the configuration is loaded
+#
+def save_cache_file(path, stamp, sections):
+    tmp = "%s%s.%d.tmp" % (path, CACHE_SUFFIX, os.getpid())
+    try:
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"stamp": stamp, "sections": sections}, f)
+        os.replace(tmp, path + CACHE_SUFFIX)
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+
+
+# -- Function: clear_cache
+# It forgets the configuration files parsed by this process
+#
+def clear_cache():
+    with _lock:
+        _parsed.clear()
@@ -0,0 +1,345 @@
+# ------------------------------------------- direct.py -------------------------------------------
+# Direct delivery (MX) for simplemail.
+#
+# Instead of handing every recipient to the configured relay in one transaction, the recipients
+# are grouped by domain and each group is delivered straight to the mail exchangers (MX) of its
+# domain. The domains are delivered in parallel, with a limit of concurrent connections per
+# domain, so a slow receiving domain doesn't hold up the others.
+#
+# The MX records are resolved with a minimal DNS client (UDP, with TCP fallback for truncated
+# replies) against the system nameserver or the given one, e.g. a local stub resolver. The
+# answers are cached according to their TTL. A static map of domains to hosts can be used instead
+# of DNS, e.g. for testing.
+#
+# Direct delivery uses opportunistic STARTTLS, as done between mail servers: the certificate of
+# the exchanger isn't verified.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import collections
+import json
+import logging
+import random
+import smtplib
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from simplemail import protocol, timing, tls
+from simplemail.binary import message_bytes
+from simplemail.cli import build_message
+
+SMTP_PORT = 25
+DNS_PORT = 53
+DEFAULT_WORKERS = 8
+DEFAULT_DOMAIN_CONCURRENCY = 2
+# Recipients per transaction: RFC 5321 requires servers to accept at least 100
+MAX_RECIPIENTS = 100
+# TTL of the cached answers without MX records
+NEGATIVE_TTL = 300
+DNS_TIMEOUT = 5
+TYPE_MX = 15
+RCODE_NXDOMAIN = 3
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: MXLookupError
+# The domain doesn't exist or it doesn't accept mail
+#
+class MXLookupError(Exception):
+    pass
+
+
+# -- Class: MXResolver
+# A thread-safe resolver of MX records with a TTL cache. "static" maps domains to lists of
+# "host[:port]" and takes precedence over DNS
+#
+class MXResolver:
+    def __init__(self, nameserver=None, static=None, timeout=DNS_TIMEOUT):
+        self.nameserver = parse_address(nameserver, DNS_PORT) if nameserver else None
+        self.static = {k.lower(): v for k, v in (static or {}).items()}
+        self.timeout = timeout
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    # -- The (host, port) of the mail exchangers of the domain, most preferred first
+    def resolve(self, domain):
+        domain = domain.lower().rstrip(".")
+        if domain in self.static:
+            return [parse_address(host, SMTP_PORT) for host in self.static[domain]]
+        with self._lock:
+            cached = self._cache.get(domain)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+        records, ttl = self.query_mx(domain)
+        if not records:
+            # RFC 5321: without MX records the domain itself is the exchanger
+            hosts = [(domain, SMTP_PORT)]
+        elif records == [(0, "")]:
+            raise MXLookupError('The domain "%s" does not accept mail (null MX)' % domain)
+        else:
+            hosts = [(host, SMTP_PORT) for _, host in sorted(records)]
+        with self._lock:
+            self._cache[domain] = (time.monotonic() + ttl, hosts)
+        return hosts
+
+    # -- It queries the MX records. It returns the (preference, host) records and their TTL
+    def query_mx(self, domain):
+        nameserver = self.nameserver or system_nameserver()
+        query_id = random.getrandbits(16)
+        query = dns_query(query_id, domain, TYPE_MX)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.sendto(query, nameserver)
+            while True:
+                reply, _ = sock.recvfrom(65535)
+                if reply[:2] == query[:2]:
+                    break
+        if reply[2] & 0x02:
+            logging.debug("Truncated DNS reply for %s - retrying over TCP", domain)
+            reply = self._query_tcp(nameserver, query)
+        return parse_mx_reply(reply, domain)
+
+    def _query_tcp(self, nameserver, query):
+        with socket.create_connection(nameserver, self.timeout) as sock:
+            sock.sendall(struct.pack("!H", len(query)) + query)
+            with sock.makefile("rb") as f:
+                size = struct.unpack("!H", f.read(2))[0]
+                return f.read(size)
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: parse_address
+# It parses "host[:port]" into (host, port)
+#
+def parse_address(address, default_port):
+    host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+    return host, int(port) if port else default_port
+
+
+# -- Function: system_nameserver
+# The first nameserver of /etc/resolv.conf, or the local one
+#
+def system_nameserver():
+    try:
+        with open("/etc/resolv.conf") as f:
+            for line in f:
+                fields = line.split()
+                if len(fields) > 1 and fields[0] == "nameserver" and ":" not in fields[1]:
+                    return fields[1], DNS_PORT
+    except OSError:
+        pass
+    return "127.0.0.1", DNS_PORT
+
+
+# -- Function: dns_query
+# It builds a DNS query packet with recursion desired
+#
+def dns_query(query_id, name, qtype):
+    header = struct.pack("!HHHHHH", query_id, 0x0100, 1, 0, 0, 0)
+    return header + encode_name(name) + struct.pack("!HH", qtype, 1)
+
+
+def encode_name(name):
+    labels = [label.encode("idna") for label in name.rstrip(".").split(".") if label]
+    return b"".join(struct.pack("!B", len(label)) + label for label in labels) + b"\0"
+
+
+# -- Function: read_name
+# It reads a (possibly compressed) domain name. It returns the name and the offset after it
+#
+def read_name(packet, offset):
+    labels = []
+    end = None
+    for _ in range(128):
+        length = packet[offset]
+        if length & 0xC0 == 0xC0:
+            if end is None:
+                end = offset + 2
+            offset = struct.unpack_from("!H", packet, offset)[0] & 0x3FFF
+        elif length == 0:
+            return ".".join(labels), offset + 1 if end is None else end
+        else:
+            start = offset + 1
+            offset = start + length
+            labels.append(packet[start:offset].decode("ascii").lower())
+    raise ValueError("Invalid DNS name: too many labels or a compression loop")
+
+
+# -- Function: parse_mx_reply
+# It parses a DNS reply. It returns the (preference, host) MX records and the minimum TTL
+#
+def parse_mx_reply(packet, domain):
+    _, flags, qdcount, ancount, _, _ = struct.unpack("!HHHHHH", packet[:12])
+    rcode = flags & 0x000F
+    if rcode == RCODE_NXDOMAIN:
+        raise MXLookupError('The domain "%s" does not exist' % domain)
+    if rcode:
+        raise MXLookupError('DNS lookup of "%s" failed with rcode %d' % (domain, rcode))
+    offset = 12
+    for _ in range(qdcount):
+        offset = read_name(packet, offset)[1] + 4
+
+    records, ttls = [], []
+    for _ in range(ancount):
+        _, offset = read_name(packet, offset)
+        rtype, _, rttl, rdlength = struct.unpack_from("!HHIH", packet, offset)
+        offset += 10
+        if rtype == TYPE_MX:
+            preference = struct.unpack_from("!H", packet, offset)[0]
+            records.append((preference, read_name(packet, offset + 2)[0]))
+            ttls.append(rttl)
+        offset += rdlength
+    return records, min(ttls) if ttls else NEGATIVE_TTL
+
+
+# -- Function: group_by_domain
+# It groups the recipients by (lowercase) domain, keeping their order
+#
+def group_by_domain(recipients):
+    groups = collections.OrderedDict()
+    for rcpt in recipients:
+        domain = rcpt.rpartition("@")[2].strip().rstrip(">").lower()
+        groups.setdefault(domain, []).append(rcpt)
+    return groups
+
+
+# -- Function: deliver_to_domain
+# It delivers the message to some recipients of a domain, trying its exchangers in order of
+# preference. The header, e.g. the DKIM signature, is sent before the message. It returns the
+# refused recipients
+#
+def deliver_to_domain(resolver, domain, from_addr, rcpts, data, timeout=60, header=b""):
+    last_error = None
+    with timing.phase("dns"):
+        exchangers = resolver.resolve(domain)
+    for host, port in exchangers:
+        try:
+            with timing.phase("connect"):
+                server = smtplib.SMTP(host, port, timeout=timeout)
+        except (smtplib.SMTPException, OSError) as e:
+            logging.warning('Exchanger %s:%d of "%s" unreachable: %s', host, port, domain, e)
+            last_error = e
+            continue
+        try:
+            server.ehlo()
+            if server.has_extn("starttls"):
+                context = tls.resuming_context(host, port)
+                with timing.phase("tls"):
+                    server.starttls(context=context)
+                    server.ehlo()
+                context.save_session()
+            return protocol.send_data(server, from_addr, rcpts, data, header=header)
+        except (smtplib.SMTPException, OSError) as e:
+            temporary = isinstance(e, OSError) or 400 <= getattr(e, "smtp_code", 400) < 500
+            if isinstance(e, smtplib.SMTPRecipientsRefused):
+                temporary = all(400 <= code < 500 for code, _ in e.recipients.values())
+            if not temporary:
+                raise
+            logging.warning('Exchanger %s:%d of "%s" failed: %s', host, port, domain, e)
+            last_error = e
+        finally:
+            try:
+                with timing.phase("quit"):
+                    server.quit()
+            except (smtplib.SMTPException, OSError):
+                server.close()
+    raise last_error or MXLookupError('No exchanger for "%s"' % domain)
+
+
+# -- Function: deliver_direct
+# It delivers the message bytes to every recipient through the exchangers of their domains, in
+# parallel. It returns the failed recipients with their errors
+#
+def deliver_direct(
+    resolver,
+    from_addr,
+    recipients,
+    data,
+    workers=DEFAULT_WORKERS,
+    domain_concurrency=DEFAULT_DOMAIN_CONCURRENCY,
+    header=b"",
+):
+    groups = group_by_domain(recipients)
+    limits = {domain: threading.BoundedSemaphore(domain_concurrency) for domain in groups}
+    failed = {}
+    failed_lock = threading.Lock()
+
+    def _deliver(domain, rcpts):
+        with limits[domain]:
+            start = time.monotonic()
+            try:
+                with timing.measure():
+                    refused = deliver_to_domain(
+                        resolver, domain, from_addr, rcpts, data, header=header
+                    )
+            except smtplib.SMTPRecipientsRefused as e:
+                refused = e.recipients
+            except Exception as e:
+                refused = {rcpt: e for rcpt in rcpts}
+        logging.debug(
+            '%d recipient(s) of "%s" done in %.2fs', len(rcpts), domain, time.monotonic() - start
+        )
+        with failed_lock:
+            failed.update(refused or {})
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for domain, rcpts in groups.items():
+            for start in range(0, len(rcpts), MAX_RECIPIENTS):
+                end = start + MAX_RECIPIENTS
+                executor.submit(_deliver, domain, rcpts[start:end])
+    return failed
+
+
+# -- Function: resolver_for
+# It returns the MX resolver configured by the options
+#
+def resolver_for(options):
+    static = None
+    mx_map = getattr(options, "mx_map", None)
+    if mx_map:
+        with open(mx_map, "r") as f:
+            static = json.load(f)
+    return MXResolver(nameserver=getattr(options, "resolver", None), static=static)
+
+
+# -- Function: send_direct
+# It builds the message from the options and delivers it directly to the exchangers of the
+# recipients. It returns 0 when every recipient accepted it and 1 otherwise
+#
+def send_direct(options, resolver=None):
+    try:
+        if resolver is None:
+            resolver = resolver_for(options)
+        msg = build_message(options)
+        data = bytes(message_bytes(msg))
+        header = b""
+        if getattr(options, "dkim_domain", None):
+            from simplemail import dkim
+
+            # Signed once for all the domains
+            header = dkim.signer(options).signature(data)
+        recipients = options.to + options.cc + options.bcc
+        failed = deliver_direct(
+            resolver,
+            msg["From"],
+            recipients,
+            data,
+            workers=getattr(options, "workers", None) or DEFAULT_WORKERS,
+            domain_concurrency=getattr(options, "domain_concurrency", None)
+            or DEFAULT_DOMAIN_CONCURRENCY,
+            header=header,
+        )
+    except Exception as e:
+        logging.error('Failed to process the e-mail request:  "%s"', e)
+        return 1
+    for rcpt, error in failed.items():
+        logging.error('Failed to deliver to "%s": %s', rcpt, error)
+    logging.info(
+        "Email delivered to %d of %d recipient(s)", len(recipients) - len(failed), len(recipients)
+    )
+    return 1 if failed else 0
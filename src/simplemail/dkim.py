@@ -0,0 +1,267 @@
+# --------------------------------------------- dkim.py -------------------------------------------
+# DKIM signing for simplemail (RFC 6376, with ed25519-sha256 from RFC 8463).
+#
+# The messages are signed right before being sent, over the exact bytes written to the server
+# (after the 8bit conversion, see simplemail.binary), as configured in the [DKIM] section of the
+# configuration file or with the "--dkim-*" arguments:
+#     - Domain: The signing domain (d=)
+#     - Selector: The selector of the public key in the DNS (s=)
+#     - PrivateKey: The path of the private key (PEM). An RSA key signs with rsa-sha256 and an
+#       Ed25519 key with ed25519-sha256
+#     - Headers: The headers signed, when present. Default = From, To, Cc, Subject, Date...
+#     - Canonicalization: "relaxed/relaxed" (default), "relaxed/simple", "simple/relaxed" or
+#       "simple/simple"
+#
+# The private key is parsed once per process and parsed again only when the file changes, so a
+# batch signs all its messages with the same key object. The body hash is computed incrementally,
+# over slices of the generated message or over the chunks of a streaming message, and only the
+# DKIM-Signature header is generated: it's sent before the message bytes, which aren't copied.
+#
+# It requires the "cryptography" package (pip install simplemail-python3[dkim]).
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import base64
+import hashlib
+import re
+import threading
+import time
+
+from simplemail.config import file_stamp
+
+try:
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa
+except ImportError:
+    serialization = None
+
+CRLF = b"\r\n"
+DEFAULT_HEADERS = [
+    "From",
+    "To",
+    "Cc",
+    "Subject",
+    "Date",
+    "Message-ID",
+    "Reply-To",
+    "In-Reply-To",
+    "References",
+    "MIME-Version",
+    "Content-Type",
+]
+CANONICALIZATIONS = ["relaxed", "simple"]
+# The bytes hashed at once from a message in memory
+HASH_CHUNK_SIZE = 64 * 1024
+
+_WSP_RE = re.compile(rb"[ \t]+")
+_TRAILING_WSP_RE = re.compile(rb" \r\n")
+_FIELD_RE = re.compile(rb"\r\n(?![ \t])")
+_HEADER_END_RE = re.compile(rb"\r\n\r\n")
+
+# The signers of this process by settings, see "signer"
+_signers = {}
+_lock = threading.Lock()
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: BodyHash
+# The SHA-256 hash of a message body, canonicalized and hashed chunk by chunk. The incomplete
+# last line and the empty lines at the end of the chunks are kept until more content arrives,
+# as the empty lines at the end of the body are not hashed
+#
+class BodyHash:
+    def __init__(self, relaxed=True):
+        self.relaxed = relaxed
+        self.hash = hashlib.sha256()
+        self.hashed = False
+        self.partial = b""
+        self.empty_lines = 0
+
+    def update(self, data):
+        data = self.partial + bytes(data) if self.partial else bytes(data)
+        end = data.rfind(CRLF) + 2
+        if end < 2:
+            self.partial = data
+            return
+        lines, self.partial = data[:end], data[end:]
+        if self.relaxed and (b" " in lines or b"\t" in lines):
+            # Skipped for the lines without spaces, e.g. base64 encoded parts
+            lines = _TRAILING_WSP_RE.sub(CRLF, _WSP_RE.sub(b" ", lines))
+
+        # The empty lines at the end wait for the next non-empty line
+        end = content_end = len(lines)
+        while content_end and lines.endswith(CRLF, 0, content_end):
+            content_end -= 2
+        if content_end == 0:
+            self.empty_lines += end // 2
+            return
+        content_end += 2
+        if self.empty_lines:
+            self.hash.update(CRLF * self.empty_lines)
+        self.hash.update(lines[:content_end])
+        self.hashed = True
+        self.empty_lines = (end - content_end) // 2
+
+    def digest(self):
+        line = self.partial
+        if self.relaxed:
+            line = _WSP_RE.sub(b" ", line).rstrip(b" ")
+        if line:
+            self.hash.update(CRLF * self.empty_lines + line + CRLF)
+            self.hashed = True
+        elif not self.hashed and not self.relaxed:
+            # An empty body is a single CRLF in the simple canonicalization
+            self.hash.update(CRLF)
+        self.partial, self.empty_lines = b"", 0
+        return self.hash.digest()
+
+
+# -- Class: DKIMSigner
+# It signs the messages of one domain and selector with a private key
+#
+class DKIMSigner:
+    def __init__(self, domain, selector, key, headers=None, canonicalization="relaxed/relaxed"):
+        if isinstance(key, rsa.RSAPrivateKey):
+            self.algorithm = "rsa-sha256"
+        elif isinstance(key, ed25519.Ed25519PrivateKey):
+            self.algorithm = "ed25519-sha256"
+        else:
+            raise ValueError("The DKIM key must be an RSA or an Ed25519 private key")
+        header_c, _, body_c = canonicalization.lower().partition("/")
+        body_c = body_c or "simple"
+        if header_c not in CANONICALIZATIONS or body_c not in CANONICALIZATIONS:
+            raise ValueError("Unknown DKIM canonicalization: %s" % canonicalization)
+        self.domain = domain
+        self.selector = selector
+        self.key = key
+        self.headers = [h.strip() for h in headers or DEFAULT_HEADERS if h.strip()]
+        self.canonicalization = "%s/%s" % (header_c, body_c)
+        self.relaxed_headers = header_c == "relaxed"
+        self.relaxed_body = body_c == "relaxed"
+
+    # -- It returns the DKIM-Signature header (bytes, with the final CRLF) of a message given its
+    # header block (with the final CRLF) and the chunks of its body
+    def sign(self, header_block, body_chunks):
+        body_hash = BodyHash(self.relaxed_body)
+        for chunk in body_chunks:
+            body_hash.update(chunk)
+
+        fields = self._signed_fields(header_block)
+        names = b":".join(name for name, _ in fields).decode("ascii")
+        header = (
+            "DKIM-Signature: v=1; a=%s; c=%s; d=%s; s=%s;\r\n\tt=%d; h=%s;\r\n\tbh=%s;\r\n\tb="
+            % (
+                self.algorithm,
+                self.canonicalization,
+                self.domain,
+                self.selector,
+                int(time.time()),
+                names,
+                base64.b64encode(body_hash.digest()).decode("ascii"),
+            )
+        ).encode("ascii")
+
+        signed = b"".join(self._canonical_header(field) for _, field in fields)
+        signed += self._canonical_header(header + CRLF)[: -len(CRLF)]
+        return header + base64.b64encode(self._signature(signed)) + CRLF
+
+    # -- It returns the DKIM-Signature header of the message bytes, to be sent before them
+    def signature(self, data):
+        match = _HEADER_END_RE.search(data)
+        if match is None:
+            raise ValueError("The message to sign has no body")
+        view = memoryview(data)
+        header_end = match.start() + 2
+        return self.sign(bytes(view[:header_end]), _chunks(view, header_end + 2))
+
+    def _signature(self, data):
+        if self.algorithm == "ed25519-sha256":
+            return self.key.sign(hashlib.sha256(data).digest())
+        return self.key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+
+    # It returns the (lowercase name, field) of the headers signed, the last instance first
+    def _signed_fields(self, header_block):
+        fields = {}
+        for field in _FIELD_RE.split(header_block)[:-1]:
+            name = field.split(b":", 1)[0].strip().lower()
+            fields.setdefault(name, []).append(field + CRLF)
+        signed = []
+        for name in self.headers:
+            name = name.lower().encode("ascii")
+            instances = fields.get(name)
+            if instances:
+                signed.append((name, instances.pop()))
+        if b"from" not in (name for name, _ in signed):
+            raise ValueError("The message to sign has no From header")
+        return signed
+
+    def _canonical_header(self, field):
+        if not self.relaxed_headers:
+            return field
+        name, _, value = field.partition(b":")
+        value = _WSP_RE.sub(b" ", value.replace(CRLF, b"")).strip(b" ")
+        return name.strip().lower() + b":" + value + CRLF
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: load_key
+# It parses a PEM private key file
+#
+def load_key(path):
+    if serialization is None:
+        raise RuntimeError(
+            'DKIM signing requires the "cryptography" package '
+            "(pip install simplemail-python3[dkim])"
+        )
+    with open(path, "rb") as f:
+        return serialization.load_pem_private_key(f.read(), password=None)
+
+
+# -- Function: signer
+# The DKIM signer of the options, or None when DKIM isn't configured. The signers are created once
+# per process and created again when the key file changes
+#
+def signer(options):
+    domain = getattr(options, "dkim_domain", None)
+    if not domain:
+        return None
+    selector = getattr(options, "dkim_selector", None)
+    path = getattr(options, "dkim_key", None)
+    if not selector or not path:
+        raise ValueError("DKIM signing requires the domain, the selector and the private key")
+    headers = getattr(options, "dkim_headers", None)
+    if isinstance(headers, str):
+        headers = headers.split(",")
+    canonicalization = getattr(options, "dkim_canonicalization", None) or "relaxed/relaxed"
+
+    settings = (
+        domain,
+        selector,
+        path,
+        tuple(file_stamp(path) or ()),
+        tuple(headers or ()),
+        canonicalization,
+    )
+    with _lock:
+        dkim_signer = _signers.get(settings)
+    if dkim_signer is None:
+        dkim_signer = DKIMSigner(domain, selector, load_key(path), headers, canonicalization)
+        with _lock:
+            dkim_signer = _signers.setdefault(settings, dkim_signer)
+    return dkim_signer
+
+
+# -- Function: clear_cache
+# It forgets the signers of this process
+#
+def clear_cache():
+    with _lock:
+        _signers.clear()
+
+
+# The slices of the view from "start", HASH_CHUNK_SIZE bytes each
+def _chunks(view, start):
+    for offset in range(start, len(view), HASH_CHUNK_SIZE):
+        end = offset + HASH_CHUNK_SIZE
+        yield view[offset:end]
@@ -0,0 +1,219 @@
+# ------------------------------------------ envelope.py ------------------------------------------
+# Envelope splitting for simplemail.
+#
+# The relays cap the recipients of a transaction, usually between 50 and 1000, and reply
+# "452 Too many recipients" to the RCPT TO commands over the limit (RFC 5321, 4.5.3.1.10). The
+# recipients deferred this way are sent the message again in a new transaction of the same
+# connection, until all of them are accepted or refused.
+#
+# The limit is learnt from the first transaction cut short by the server, so the next envelopes
+# (and the next messages of the session) are split in advance. It can also be configured with
+# "--max-recipients" or MaxRecipients in the [LIMITS] section of the configuration file, and then
+# the envelopes of one message can be spread over a pool of sessions (see send_envelopes).
+#
+# A MIME message is serialized only once for all its envelopes (see SerializedMessage).
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import copy
+import logging
+import smtplib
+import threading
+from email.message import Message
+
+from simplemail.binary import message_bytes, use_8bit_bodies
+from simplemail.logs import with_message_id
+from simplemail.protocol import TOO_MANY_RECIPIENTS
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: SerializedMessage
+# A MIME message serialized once, as 7bit and as 8bit when needed, to be sent in many envelopes.
+# It's sent as a PreparedMessage (see simplemail.protocol.send_prepared) and it's thread-safe
+#
+class SerializedMessage:
+    def __init__(self, msg):
+        self.msg = msg
+        self._data = {}
+        self._lock = threading.RLock()
+
+    def __getitem__(self, name):
+        return self.msg[name]
+
+    def as_bytes(self, eight_bit=False):
+        return self._serialized(eight_bit)[0]
+
+    def has_8bit(self):
+        return self._serialized(True)[1]
+
+    def _serialized(self, eight_bit):
+        with self._lock:
+            if eight_bit not in self._data:
+                msg, converted = self.msg, False
+                if eight_bit:
+                    msg = copy.deepcopy(self.msg)
+                    converted = use_8bit_bodies(msg)
+                if eight_bit and not converted:
+                    self._data[True] = self._serialized(False)
+                else:
+                    self._data[eight_bit] = (bytes(message_bytes(msg)), converted)
+            return self._data[eight_bit]
+
+
+# -- Class: EnvelopeResults
+# The results of the envelopes of one message, logged as they are added. The deferred recipients
+# of an envelope are neither accepted nor refused, they are sent in another one
+#
+class EnvelopeResults:
+    def __init__(self):
+        self.envelopes = 0
+        self.accepted = 0
+        self.refused = {}
+        self.error = None
+
+    def add(self, recipients, refused, error=None, deferred=()):
+        self.envelopes += 1
+        accepted = len(recipients) - len(refused) - len(deferred)
+        self.accepted += accepted
+        self.refused.update(refused)
+        if error is not None:
+            self.error = error
+            logging.error('Envelope #%d failed: "%s"', self.envelopes, error)
+        logging.info(
+            "Envelope #%d: %d recipient(s) accepted, %d refused, %d deferred",
+            self.envelopes,
+            accepted,
+            len(refused),
+            len(deferred),
+        )
+
+    # -- It returns the refused recipients of all envelopes. When no recipient was accepted at
+    # all, the error of the last failed envelope is raised
+    def result(self):
+        if not self.accepted and self.error is not None:
+            raise self.error
+        return self.refused
+
+
+# -- Class: EnvelopeSplitter
+# It sends the messages in as many envelopes as required by the recipients limit of the server,
+# configured ("max_recipients", 0 when unknown) or learnt from its replies
+#
+class EnvelopeSplitter:
+    def __init__(self, max_recipients=0):
+        self.max_recipients = max_recipients or 0
+
+    # -- It sends the message with "sendmail(from_addr, to_addrs, msg)" once per envelope. It
+    # returns the refused recipients, as "smtplib.SMTP.sendmail"
+    def sendmail(self, sendmail, from_addr, to_addrs, msg):
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        results = EnvelopeResults()
+        if not self.max_recipients or len(to_addrs) <= self.max_recipients:
+            # A single envelope, unless the server defers some recipients
+            refused = sendmail(from_addr, to_addrs, msg) or {}
+            deferred = deferred_recipients(refused)
+            if not deferred:
+                return refused
+            self._learn(len(to_addrs) - len(refused))
+            results.add(to_addrs, _without(refused, deferred), deferred=deferred)
+            pending = deferred
+        else:
+            pending = list(to_addrs)
+
+        msg = serialized(msg)
+        while pending:
+            size = self.max_recipients
+            envelope, pending = pending[:size], pending[size:]
+            refused, error = send_envelope(sendmail, from_addr, envelope, msg)
+            deferred = deferred_recipients(refused)
+            if deferred and len(refused) < len(envelope):
+                self._learn(len(envelope) - len(refused))
+                refused = _without(refused, deferred)
+                pending = deferred + pending
+            else:
+                deferred = []
+            results.add(envelope, refused, error, deferred)
+        return results.result()
+
+    def _learn(self, accepted):
+        if not self.max_recipients or accepted < self.max_recipients:
+            logging.info("The server accepts up to %d recipients per envelope", accepted)
+            self.max_recipients = accepted
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: serialized
+# The message to be sent in many envelopes: the MIME messages are serialized once, the other
+# payloads (bytes, PreparedMessage, StreamingMessage) are already reusable
+#
+def serialized(msg):
+    return SerializedMessage(msg) if isinstance(msg, Message) else msg
+
+
+# -- Function: split_recipients
+# It splits the recipients in envelopes of up to "size" recipients
+#
+def split_recipients(recipients, size):
+    recipients = list(recipients)
+    if not size:
+        return [recipients]
+    envelopes = []
+    for start in range(0, len(recipients), size):
+        end = start + size
+        envelopes.append(recipients[start:end])
+    return envelopes
+
+
+# -- Function: deferred_recipients
+# The refused recipients which must be sent in another envelope (452 Too many recipients)
+#
+def deferred_recipients(refused):
+    return [rcpt for rcpt, (code, _) in refused.items() if code == TOO_MANY_RECIPIENTS]
+
+
+def _without(refused, recipients):
+    recipients = set(recipients)
+    return {rcpt: reply for rcpt, reply in refused.items() if rcpt not in recipients}
+
+
+# -- Function: send_envelope
+# It sends one envelope and returns its refused recipients and its error, if any. The recipients
+# of a failed envelope are all refused with its error, except when the sender is refused, which
+# fails the other envelopes too and thus is raised
+#
+def send_envelope(sendmail, from_addr, recipients, msg):
+    try:
+        return dict(sendmail(from_addr, recipients, msg) or {}), None
+    except smtplib.SMTPSenderRefused:
+        raise
+    except smtplib.SMTPRecipientsRefused as e:
+        return dict(e.recipients), e
+    except (smtplib.SMTPException, OSError) as e:
+        reply = (getattr(e, "smtp_code", -1), getattr(e, "smtp_error", str(e)))
+        return {rcpt: reply for rcpt in recipients}, e
+
+
+# -- Function: send_envelopes
+# It sends a message in envelopes of up to "max_recipients" recipients, spread over a pool of
+# "workers" SMTP sessions. It returns the refused recipients of all envelopes
+#
+def send_envelopes(options, from_addr, to_addrs, msg, workers, max_recipients):
+    from concurrent.futures import ThreadPoolExecutor
+
+    from simplemail.pool import SMTPConnectionPool
+
+    msg = serialized(msg)
+    results = EnvelopeResults()
+    max_messages = getattr(options, "max_per_connection", None) or 0
+    send = with_message_id(send_envelope)
+    with SMTPConnectionPool(options, max_size=workers, max_messages=max_messages) as pool:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                (envelope, executor.submit(send, pool.sendmail, from_addr, envelope, msg))
+                for envelope in split_recipients(to_addrs, max_recipients)
+            ]
+            for envelope, future in futures:
+                results.add(envelope, *future.result())
+    return results.result()
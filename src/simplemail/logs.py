@@ -0,0 +1,229 @@
+# ------------------------------------------- logs.py ---------------------------------------------
+# Logging setup for simplemail.
+#
+# A single message is logged as "logging.basicConfig" does, straight to the handler. In the batch,
+# daemon and broker modes the records are written by a background thread instead: the threads
+# sending the messages only put them in a queue (logging.handlers.QueueHandler/QueueListener), so a
+# slow log file or terminal doesn't delay the SMTP transactions. The records are formatted lazily,
+# i.e. only when their level is enabled, and:
+#     - Format: "text" (default) or "json", one JSON object per line with the time, the level,
+#       the message and the ID of the message being sent, if any
+#     - Message IDs: The records logged while sending a message carry its ID (see
+#       "message_context"), so the lines of the concurrent messages of a batch can be told apart
+#     - Redaction: The SMTP password (as is and base64 encoded, as sent by AUTH LOGIN) and the
+#       AUTH PLAIN credentials are replaced by "***", including in the SMTP debug output, which
+#       goes through the logging too, as DEBUG records of the "simplemail.smtp" logger (see
+#       smtpdebug)
+#
+# The queue is flushed when the process exits. The processes forked after the setup (e.g. the
+# workers of "--processes") write the records straight to the handlers.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import atexit
+import base64
+import contextlib
+import contextvars
+import itertools
+import logging
+import os
+import re
+import threading
+
+TEXT_FORMAT = "%(asctime)s [%(levelname)s]: %(message)s"
+LOG_FORMATS = ["text", "json"]
+REDACTED = "***"
+
+# The credentials sent with AUTH, but not the mechanisms listed in the EHLO reply
+_AUTH_RE = re.compile(
+    r"((?i:AUTH)\s+(?i:PLAIN|LOGIN|XOAUTH2)\s+)"
+    r"(?![A-Z][A-Z0-9_-]*(?![A-Za-z0-9+/=]))[A-Za-z0-9+/]+=*"
+)
+
+# The ID of the message being sent by this thread/task (see "message_context")
+_message_id = contextvars.ContextVar("simplemail_message_id", default=None)
+_message_ids = itertools.count(1)
+
+# The secrets redacted from the records
+_secrets = set()
+_secrets_lock = threading.Lock()
+
+# The handler installed by "setup_logging" in the root logger and the listener writing the queued
+# records, if any
+_handler = None
+_listener = None
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: MessageIDFilter
+# It adds the ID of the message being sent (or None) to the records, as "message_id". It runs in
+# the thread logging the record
+#
+class MessageIDFilter(logging.Filter):
+    def filter(self, record):
+        record.message_id = _message_id.get()
+        return True
+
+
+# -- Class: RedactingFilter
+# It replaces the secrets and the AUTH credentials in the records by "***". It runs in the
+# background thread when the records are queued
+#
+class RedactingFilter(logging.Filter):
+    def filter(self, record):
+        message = record.getMessage()
+        redacted = _AUTH_RE.sub(r"\1" + REDACTED, message)
+        with _secrets_lock:
+            secrets = list(_secrets)
+        for secret in secrets:
+            if secret in redacted:
+                redacted = redacted.replace(secret, REDACTED)
+        if redacted != message:
+            record.msg, record.args = redacted, None
+        return True
+
+
+# -- Class: JSONFormatter
+# It formats the records as JSON lines
+#
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        message_id = getattr(record, "message_id", None)
+        if message_id is not None:
+            entry["message_id"] = message_id
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        import json
+
+        return json.dumps(entry, ensure_ascii=False)
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: add_secret
+# It redacts a secret, e.g. the SMTP password, from the records logged from now on
+#
+def add_secret(secret):
+    if not secret:
+        return
+    with _secrets_lock:
+        _secrets.add(secret)
+        try:
+            # As sent by AUTH LOGIN
+            _secrets.add(base64.b64encode(secret.encode("utf-8")).decode("ascii"))
+        except UnicodeError:
+            pass
+
+
+# -- Function: next_message_id
+# A new ID for a message, unique within the process
+#
+def next_message_id():
+    return "%x.%d" % (os.getpid(), next(_message_ids))
+
+
+# -- Function: message_context
+# A context manager setting the ID of the message being sent in the records logged within it. A
+# new ID is used when none is given
+#
+@contextlib.contextmanager
+def message_context(message_id=None):
+    token = _message_id.set(message_id or next_message_id())
+    try:
+        yield
+    finally:
+        _message_id.reset(token)
+
+
+# -- Function: with_message_id
+# It wraps a function run by another thread, e.g. by an executor, so its records carry the ID of
+# the message being sent by this thread
+#
+def with_message_id(function):
+    message_id = _message_id.get()
+    if message_id is None:
+        return function
+
+    def _run(*args, **kwargs):
+        with message_context(message_id):
+            return function(*args, **kwargs)
+
+    return _run
+
+
+# -- Function: setup_logging
+# It configures the root logger, as "logging.basicConfig" does, to write the records to the log
+# file or to the standard error in the given format. With "use_queue" the records are written by a
+# background thread
+#
+def setup_logging(level, log_file=None, log_format="text", use_queue=True, password=None):
+    global _handler, _listener
+
+    if log_format not in LOG_FORMATS:
+        raise ValueError("Unknown log format: %s" % log_format)
+    handler = logging.FileHandler(log_file, mode="a") if log_file else logging.StreamHandler()
+    handler.setFormatter(
+        JSONFormatter() if log_format == "json" else logging.Formatter(TEXT_FORMAT)
+    )
+    handler.addFilter(RedactingFilter())
+    add_secret(password)
+
+    # Replaces a previous setup, e.g. when the configuration is reloaded
+    stop_logging()
+    root = logging.getLogger()
+    if _handler is not None:
+        root.removeHandler(_handler)
+        _handler.close()
+    if use_queue:
+        import queue
+        from logging.handlers import QueueHandler, QueueListener
+
+        _listener = QueueListener(queue.SimpleQueue(), handler)
+        _listener.start()
+        _handler = QueueHandler(_listener.queue)
+    else:
+        _handler = handler
+    _handler.addFilter(MessageIDFilter())
+    root.addHandler(_handler)
+    root.setLevel(level)
+    return root
+
+
+# -- Function: stop_logging
+# It writes the queued records and stops the background thread, if any. It's called when the
+# process exits
+#
+def stop_logging():
+    global _listener
+
+    listener, _listener = _listener, None
+    if listener is not None:
+        listener.stop()
+        for handler in listener.handlers:
+            handler.close()
+
+
+# The forked processes don't have the background thread: their records go to the handlers
+def _write_directly():
+    global _handler, _listener
+
+    listener, _listener = _listener, None
+    if listener is None:
+        return
+    root = logging.getLogger()
+    root.removeHandler(_handler)
+    _handler = listener.handlers[0]
+    _handler.addFilter(MessageIDFilter())
+    root.addHandler(_handler)
+
+
+atexit.register(stop_logging)
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_write_directly)
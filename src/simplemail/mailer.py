@@ -0,0 +1,271 @@
+# ------------------------------------------- mailer.py -------------------------------------------
+# Library API of simplemail.
+#
+# Sending from Python code doesn't need to mimic the command line options:
+#     - Mailer: The connection settings, resolved once (host, port, TLS/SSL and credentials). It
+#       keeps an authenticated SMTP session open across its messages until closed
+#     - PreparedMessage: A message whose MIME structure is built and serialized once. Swapping the
+#       recipients ("with_recipients") only generates the headers again
+#
+#     from simplemail import Mailer, PreparedMessage
+#
+#     message = PreparedMessage("from@example.com", subject="News", body="Hello!")
+#     with Mailer("smtp.example.com:587", user="user", password="secret") as mailer:
+#         for rcpt in recipients:
+#             mailer.send(message, to=[rcpt])
+#
+# The command line ("send_email") is a thin wrapper over this module.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import copy
+import logging
+import smtplib
+from argparse import Namespace
+
+from simplemail import timing
+from simplemail.binary import SMTP_POLICY, message_bytes, use_8bit_bodies
+from simplemail.cli import build_message, parse_server
+from simplemail.logs import add_secret
+
+# The headers which change with the recipients
+RECIPIENT_HEADERS = ["to", "cc", "bcc"]
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: PreparedMessage
+# A message built once and sent many times, e.g. to different recipients.
+#
+# The message is serialized on the first send and split in the headers and the rest (the MIME
+# parts). The copies returned by "with_recipients" share the MIME parts and their serialization
+#
+class PreparedMessage:
+    def __init__(
+        self,
+        sender,
+        to=None,
+        subject="(no subject)",
+        body="",
+        cc=None,
+        bcc=None,
+        attachments=None,
+        content_type="text/html",
+        charset="utf-8",
+    ):
+        self.message = build_message(
+            Namespace(
+                sender=sender,
+                to=_as_list(to),
+                cc=_as_list(cc),
+                bcc=_as_list(bcc),
+                subject=subject,
+                body=[body],
+                file=_as_list(attachments),
+                content_type=content_type,
+                charset=charset,
+            )
+        )
+        self.sender = sender
+        self.to, self.cc, self.bcc = _as_list(to), _as_list(cc), _as_list(bcc)
+        # The serialized MIME parts by 8-bit or not, shared by the copies
+        self._parts = {}
+        self._head = None
+
+    # -- It builds the message of the command line options
+    @classmethod
+    def from_options(cls, options):
+        return cls(
+            options.sender,
+            options.to,
+            options.subject,
+            "".join(options.body or []),
+            options.cc,
+            options.bcc,
+            options.file,
+            options.content_type,
+            options.charset,
+        )
+
+    @property
+    def recipients(self):
+        return self.to + self.cc + self.bcc
+
+    # -- It returns a copy of the message for other recipients. The missing ones are kept
+    def with_recipients(self, to=None, cc=None, bcc=None):
+        prepared = copy.copy(self)
+        if to is not None:
+            prepared.to = _as_list(to)
+        if cc is not None:
+            prepared.cc = _as_list(cc)
+        if bcc is not None:
+            prepared.bcc = _as_list(bcc)
+        prepared._head = None
+        return prepared
+
+    # -- It returns the message bytes. With "eight_bit" the text parts are sent as 8bit when
+    # possible, see "has_8bit"
+    def as_bytes(self, eight_bit=False):
+        if self._head is None:
+            self._head = self._headers(self._serialized(False)[0])
+        return self._head + self._serialized(eight_bit)[1]
+
+    # -- Whether the 8-bit version of the message must be sent with BODY=8BITMIME
+    def has_8bit(self):
+        return self._serialized(True)[2]
+
+    # -- It returns the MIME message, its serialized parts (after the headers) and whether its
+    # text parts were converted to 8bit
+    def _serialized(self, eight_bit):
+        if eight_bit not in self._parts:
+            msg, converted = self.message, False
+            if eight_bit:
+                msg = copy.deepcopy(self.message)
+                converted = use_8bit_bodies(msg)
+            if eight_bit and not converted:
+                self._parts[True] = self._serialized(False)
+            else:
+                _, sep, parts = bytes(message_bytes(msg)).partition(b"\r\n\r\n")
+                self._parts[eight_bit] = (msg, sep + parts, converted)
+        return self._parts[eight_bit]
+
+    # -- It generates the headers for the current recipients, folded as BytesGenerator does
+    def _headers(self, msg):
+        head = []
+        for name, value in msg.items():
+            attr = name.lower()
+            if attr in RECIPIENT_HEADERS:
+                value = ", ".join(getattr(self, attr))
+            head.append(SMTP_POLICY.fold_binary(name, value))
+        # The last CRLF is the first one of the separator kept with the parts
+        return b"".join(head)[: -len(b"\r\n")]
+
+
+# -- Class: Mailer
+# An SMTP server with its settings resolved once. The messages are sent through one
+# authenticated session, reconnected when needed, until "close" (or the end of the "with" block)
+#
+class Mailer:
+    def __init__(
+        self,
+        server="localhost:25",
+        user="",
+        password="",
+        tls="auto",
+        ssl="auto",
+        smtp_debug=False,
+        max_messages=0,
+        ca_file=None,
+        client_cert=None,
+        client_key=None,
+        tls_min_version=None,
+    ):
+        self._setup(
+            Namespace(
+                smtp_server=server,
+                smtp_user=user,
+                smtp_password=password,
+                tls=str(tls).lower(),
+                ssl=str(ssl).lower(),
+                smtp_debug=str(smtp_debug).lower(),
+                max_per_connection=max_messages,
+                ca_file=ca_file,
+                client_cert=client_cert,
+                client_key=client_key,
+                tls_min_version=tls_min_version,
+            )
+        )
+
+    # -- It returns the mailer of the command line options, which must have their defaults set
+    @classmethod
+    def from_options(cls, options):
+        mailer = cls.__new__(cls)
+        mailer._setup(copy.copy(options))
+        return mailer
+
+    def _setup(self, options):
+        # The sessions (see simplemail.session) and copies of the options use this mailer
+        options.mailer = self
+        self.options = options
+        self.host, self.port, self.use_tls, self.use_ssl = parse_server(options)
+        self.debug = options.smtp_debug.lower().find("true") != -1
+        # Never written to the logs, including the SMTP debug output
+        add_secret(options.smtp_password)
+        if self.debug:
+            from simplemail.smtpdebug import enable_smtp_debug
+
+            enable_smtp_debug()
+        self.session = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- It opens an authenticated connection with the SMTP server
+    def connect(self):
+        logging.debug("Connecting to SMTP server:")
+        logging.debug("    - HOST: %s | PORT: %s | TLS: %s", self.host, self.port, self.use_tls)
+
+        # The SSL context is shared by the connections and resumes the TLS sessions (see tls)
+        context = None
+        if self.use_ssl or self.use_tls:
+            from simplemail.tls import resuming_context
+
+            context = resuming_context(self.host, self.port, self.options)
+
+        # Initializes the SMTP connection, logging its commands and replies if required
+        smtp_class, ssl_class = smtplib.SMTP, smtplib.SMTP_SSL
+        if self.debug:
+            from simplemail.smtpdebug import DebugSMTP as smtp_class
+            from simplemail.smtpdebug import DebugSMTP_SSL as ssl_class
+
+        with timing.phase("connect"):
+            server = (
+                ssl_class(self.host, self.port, context=context)
+                if self.use_ssl
+                else smtp_class(self.host, self.port)
+            )
+
+        if self.use_tls:
+            logging.debug("    - starting TLS communication")
+            with timing.phase("tls"):
+                server.starttls(context=context)
+
+        logging.debug("    - starting login with USERNAME: %s", self.options.smtp_user)
+        with timing.phase("auth"):
+            server.login(self.options.smtp_user, self.options.smtp_password)
+        if context is not None:
+            context.save_session()
+        return server
+
+    # -- It sends a PreparedMessage, optionally to other recipients. It returns the refused ones
+    def send(self, message, to=None, cc=None, bcc=None):
+        if to is not None or cc is not None or bcc is not None:
+            message = message.with_recipients(to, cc, bcc)
+        return self.sendmail(message.sender, message.recipients, message)
+
+    # -- It sends a message (PreparedMessage, MIME message, StreamingMessage or bytes) with the
+    # given envelope. It returns the refused recipients
+    def sendmail(self, from_addr, to_addrs, msg):
+        if self.session is None:
+            from simplemail.session import SMTPSession
+
+            max_messages = getattr(self.options, "max_per_connection", None) or 0
+            self.session = SMTPSession(self.options, max_messages=max_messages)
+        return self.session.sendmail(from_addr, to_addrs, msg)
+
+    def close(self):
+        if self.session is not None:
+            logging.debug("Closing the connection with server")
+            with timing.phase("quit"):
+                self.session.close()
+            self.session = None
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+def _as_list(value):
+    if not value:
+        return []
+    return [value] if isinstance(value, str) else list(value)
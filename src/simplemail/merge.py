@@ -0,0 +1,179 @@
+# ------------------------------------------- merge.py --------------------------------------------
+# Mail merge for simplemail.
+#
+# The message body and subject are templates with "$name" or "${name}" placeholders ("$$" is a
+# literal "$"), as in "string.Template". Each template is parsed and compiled once and cached,
+# then one message is rendered per row of a CSV file (with a header row) or a JSON Lines file.
+#
+# Each row must have the recipient in the "to" or "email" column. The "cc" and "bcc" columns are
+# optional and the remaining ones are the template variables.
+#
+# The rendered messages are sent as a batch, through one reused SMTP session or through the
+# connection pool when more than one worker is requested, or written to disk with "--output".
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import csv
+import functools
+import json
+import logging
+import time
+from string import Template
+
+from simplemail.batch import send_batch
+from simplemail.cli import read_body
+
+RECIPIENT_COLUMNS = ["to", "email"]
+ENVELOPE_COLUMNS = ["cc", "bcc"]
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: CompiledTemplate
+# A template split once in literal text and placeholders, so rendering is a single join
+#
+class CompiledTemplate:
+    def __init__(self, source):
+        self.source = source
+        self.parts = []
+        self.names = []
+        position = 0
+        for match in Template.pattern.finditer(source):
+            start = match.start()
+            self._literal(source[position:start])
+            position = match.end()
+            name = match.group("named") or match.group("braced")
+            if match.group("escaped") is not None:
+                self._literal("$")
+            elif name is not None:
+                self.parts.append(None)
+                self.names.append(name)
+            else:
+                raise ValueError("Invalid placeholder in the template at position %d" % start)
+        self._literal(source[position:])
+        # The literal parts are fixed: only the placeholder slots change per render
+        self._slots = [i for i, part in enumerate(self.parts) if part is None]
+
+    def _literal(self, text):
+        if text:
+            self.parts.append(text)
+
+    def render(self, variables):
+        parts = list(self.parts)
+        for slot, name in zip(self._slots, self.names):
+            value = variables.get(name)
+            if value is None:
+                raise ValueError('Missing template variable "%s"' % name)
+            parts[slot] = str(value)
+        return "".join(parts)
+
+
+# -- Class: MergeStats
+# Counters of the rendered messages
+#
+class MergeStats:
+    def __init__(self):
+        self.rendered = 0
+        self.failed = 0
+        self.render_time = 0.0
+
+    @property
+    def renders_per_second(self):
+        return self.rendered / self.render_time if self.render_time else 0.0
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: compile_template
+# It compiles the template source, caching the result
+#
+@functools.lru_cache(maxsize=64)
+def compile_template(source):
+    return CompiledTemplate(source)
+
+
+# -- Function: read_rows
+# A generator which yields the variables (dict) of each recipient from a CSV or JSON Lines file
+#
+def read_rows(path):
+    with open(path, "r", newline="") as f:
+        if path.lower().endswith(".csv"):
+            for row in csv.DictReader(f):
+                yield row
+            return
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise ValueError('Invalid row at line %d of "%s": %s' % (lineno, path, e))
+            if not isinstance(row, dict):
+                raise ValueError('Invalid row at line %d of "%s": not an object' % (lineno, path))
+            yield row
+
+
+# -- Function: merge_jobs
+# A generator which yields one batch job per row, with the rendered subject and body. The rows
+# which can't be rendered are logged and skipped
+#
+def merge_jobs(options, rows, stats=None):
+    if stats is None:
+        stats = MergeStats()
+    body = compile_template(read_body(options))
+    subject = compile_template(options.subject)
+    for index, row in enumerate(rows, 1):
+        start = time.perf_counter()
+        try:
+            recipient = next((row[c] for c in RECIPIENT_COLUMNS if row.get(c)), None)
+            if not recipient:
+                raise ValueError("No recipient (%s column)" % "/".join(RECIPIENT_COLUMNS))
+            job = {"to": recipient, "subject": subject.render(row), "message": body.render(row)}
+        except ValueError as e:
+            logging.error("Failed to render the row #%d: %s", index, e)
+            stats.failed += 1
+            continue
+        for column in ENVELOPE_COLUMNS:
+            if row.get(column):
+                job[column] = row[column]
+        stats.rendered += 1
+        stats.render_time += time.perf_counter() - start
+        yield job
+
+
+# -- Function: send_merge
+# It renders and sends one message per row of the data file. It returns 0 when all messages were
+# sent successfully and 1 otherwise
+#
+def send_merge(options, path):
+    stats = MergeStats()
+    workers = getattr(options, "workers", None) or 1
+    processes = getattr(options, "processes", None) or 1
+    start = time.perf_counter()
+    try:
+        jobs = merge_jobs(options, read_rows(path), stats)
+        if getattr(options, "output", None):
+            from simplemail.render import render_jobs
+
+            res = render_jobs(options, jobs, processes)
+        elif processes > 1:
+            from simplemail.processes import send_multiprocess
+
+            res = send_multiprocess(options, jobs, processes, workers)
+        elif workers > 1:
+            from simplemail.pool import send_pooled
+
+            res = send_pooled(options, jobs, workers)
+        else:
+            res = send_batch(options, jobs)
+    except (OSError, ValueError) as e:
+        logging.error('Failed to process the mail merge "%s": %s', path, e)
+        return 1
+    elapsed = time.perf_counter() - start
+    logging.info(
+        "Mail merge: %d messages rendered (%.0f renders/s), %.0f messages/s overall",
+        stats.rendered,
+        stats.renders_per_second,
+        stats.rendered / elapsed if elapsed else 0,
+    )
+    return 1 if stats.failed else res
@@ -0,0 +1,306 @@
+# ------------------------------------------- outbox.py -------------------------------------------
+# A persistent on-disk outbox for simplemail.
+#
+# The messages are spooled in a Maildir-like directory, so "simplemail --enqueue" returns as soon
+# as the message is on disk and a "simplemail --daemon" process delivers them later, through a
+# reused SMTP session, retrying with exponential backoff.
+#
+# The spool directory has the following subdirectories:
+#     - tmp: Files being written. They're moved to "new" with an atomic rename once complete
+#     - new: Messages waiting for delivery
+#     - cur: Messages claimed by a daemon (atomic rename from "new") while being delivered
+#     - failed: Dead letters: messages permanently refused or which reached the maximum attempts
+#
+# Each file has the envelope as a JSON line followed by the message bytes. A message is removed
+# from "cur" right after the server accepts it for all its recipients: the recipients refused with
+# a temporary error (4xx) are retried like a failed message, and the ones refused with a permanent
+# error (5xx) are dead-lettered. The messages left in "cur" by a crashed daemon
+# go back to "new" on startup. Thus a message is never lost and it can only be delivered twice
+# if the daemon crashes between the server reply and the removal of the file. Only one daemon
+# must run per spool directory.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import json
+import logging
+import os
+import signal
+import smtplib
+import threading
+import time
+import uuid
+
+from simplemail.binary import message_bytes
+from simplemail.cli import build_message
+from simplemail.logs import message_context
+from simplemail.ratelimit import with_rate_limiter
+from simplemail.session import SMTPSession
+
+DEFAULT_SPOOL_DIR = os.path.join("~", ".simplemail", "outbox")
+DEFAULT_MAX_ATTEMPTS = 5
+DEFAULT_RETRY_DELAY = 60
+DEFAULT_POLL_INTERVAL = 5
+SUBDIRS = ["tmp", "new", "cur", "failed"]
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: OutboxEntry
+# A message read from the outbox
+#
+class OutboxEntry:
+    def __init__(self, name, envelope, data):
+        self.name = name
+        self.envelope = envelope
+        self.data = data
+
+    @property
+    def sender(self):
+        return self.envelope["from"]
+
+    @property
+    def recipients(self):
+        return self.envelope["to"]
+
+    @property
+    def attempts(self):
+        return self.envelope.get("attempts", 0)
+
+    # -- A copy of the entry for some of its recipients
+    def for_recipients(self, recipients):
+        return OutboxEntry(self.name, dict(self.envelope, to=list(recipients)), self.data)
+
+
+# -- Class: Outbox
+# The spool directory
+#
+class Outbox:
+    def __init__(self, path=DEFAULT_SPOOL_DIR):
+        self.path = os.path.abspath(os.path.expanduser(path))
+        for subdir in SUBDIRS:
+            os.makedirs(os.path.join(self.path, subdir), exist_ok=True)
+
+    def _path(self, subdir, name):
+        return os.path.join(self.path, subdir, name)
+
+    # -- It writes the file in "tmp" and moves it atomically to its destination
+    def _write(self, subdir, name, envelope, data):
+        tmp = self._path("tmp", name)
+        with open(tmp, "wb") as f:
+            f.write(json.dumps(envelope).encode("utf-8") + b"\n")
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._path(subdir, name))
+        self._sync_dir(subdir)
+
+    def _sync_dir(self, subdir):
+        if not hasattr(os, "O_DIRECTORY"):
+            return
+        fd = os.open(os.path.join(self.path, subdir), os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _read(self, subdir, name):
+        with open(self._path(subdir, name), "rb") as f:
+            envelope = json.loads(f.readline().decode("utf-8"))
+            return OutboxEntry(name, envelope, f.read())
+
+    def enqueue(self, from_addr, to_addrs, data):
+        name = "%020d.%d.%s" % (time.time() * 1e6, os.getpid(), uuid.uuid4().hex[:12])
+        envelope = {"from": from_addr, "to": list(to_addrs), "attempts": 0, "next_attempt": 0}
+        self._write("new", name, envelope, bytes(data))
+        return name
+
+    # -- It gives back to "new" the messages left in "cur" by a crashed daemon
+    def recover(self):
+        names = os.listdir(os.path.join(self.path, "cur"))
+        for name in names:
+            os.replace(self._path("cur", name), self._path("new", name))
+        return len(names)
+
+    # -- The names of the messages due for delivery, oldest first
+    def due(self, now=None):
+        now = time.time() if now is None else now
+        names = []
+        for name in sorted(os.listdir(os.path.join(self.path, "new"))):
+            try:
+                with open(self._path("new", name), "rb") as f:
+                    envelope = json.loads(f.readline().decode("utf-8"))
+            except (OSError, ValueError):
+                continue
+            if envelope.get("next_attempt", 0) <= now:
+                names.append(name)
+        return names
+
+    # -- It moves the message to "cur". It returns None when another daemon claimed it first
+    def claim(self, name):
+        try:
+            os.rename(self._path("new", name), self._path("cur", name))
+        except FileNotFoundError:
+            return None
+        return self._read("cur", name)
+
+    def complete(self, entry):
+        os.unlink(self._path("cur", entry.name))
+
+    def retry(self, entry, error, delay):
+        entry.envelope["attempts"] = entry.attempts + 1
+        entry.envelope["next_attempt"] = time.time() + delay
+        entry.envelope["last_error"] = str(error)
+        self._write("new", entry.name, entry.envelope, entry.data)
+        os.unlink(self._path("cur", entry.name))
+
+    # -- With "keep" the message stays in "cur", e.g. when its other recipients are retried, and
+    # its dead letter is named after the attempt, so it's not replaced by a later one
+    def dead_letter(self, entry, error, keep=False):
+        entry.envelope["attempts"] = entry.attempts + 1
+        entry.envelope["last_error"] = str(error)
+        name = "%s.%d" % (entry.name, entry.attempts) if keep else entry.name
+        self._write("failed", name, entry.envelope, entry.data)
+        if not keep:
+            os.unlink(self._path("cur", entry.name))
+
+    def __len__(self):
+        return len(os.listdir(os.path.join(self.path, "new")))
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: is_permanent
+# Whether the SMTP error is permanent (5xx), thus the message must not be retried
+#
+def is_permanent(error):
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(500 <= code < 600 for code, _ in error.recipients.values())
+    return False
+
+
+# -- Function: enqueue_email
+# It builds the message from the options and stores it in the outbox. It returns 0 on success
+# and 1 otherwise
+#
+def enqueue_email(options, outbox=None):
+    try:
+        if outbox is None:
+            outbox = Outbox(getattr(options, "spool_dir", None) or DEFAULT_SPOOL_DIR)
+        msg = build_message(options)
+        name = outbox.enqueue(
+            msg["From"], options.to + options.cc + options.bcc, message_bytes(msg)
+        )
+        logging.info('Email to "%s" queued as %s', msg["To"], name)
+    except Exception as e:
+        logging.error('Failed to queue the e-mail request:  "%s"', e)
+        return 1
+    return 0
+
+
+# -- Function: deliver
+# It delivers the messages due in the outbox through the given SMTP session. It returns the
+# number of messages sent, retried and dead-lettered
+#
+def deliver(
+    outbox, session, max_attempts=DEFAULT_MAX_ATTEMPTS, retry_delay=DEFAULT_RETRY_DELAY, stop=None
+):
+    sent = retried = failed = 0
+    for name in outbox.due():
+        if stop is not None and stop.is_set():
+            break
+        entry = outbox.claim(name)
+        if entry is None:
+            continue
+        with message_context(name):
+            try:
+                refused = session.sendmail(entry.sender, entry.recipients, entry.data) or {}
+            except Exception as e:
+                if is_permanent(e) or entry.attempts + 1 >= max_attempts:
+                    logging.error('Message %s dead-lettered: "%s"', name, e)
+                    outbox.dead_letter(entry, e)
+                    failed += 1
+                else:
+                    delay = retry_delay * 2**entry.attempts
+                    logging.warning('Message %s failed: "%s" - retry in %ds', name, e, delay)
+                    outbox.retry(entry, e, delay)
+                    retried += 1
+                continue
+            if not refused:
+                outbox.complete(entry)
+                logging.info('Message %s sent to: "%s"', name, ", ".join(entry.recipients))
+                sent += 1
+                continue
+
+            accepted = [rcpt for rcpt in entry.recipients if rcpt not in refused]
+            if accepted:
+                logging.info('Message %s sent to: "%s"', name, ", ".join(accepted))
+            # The recipients refused temporarily are retried unless they reached the maximum
+            # attempts, the others are dead-lettered
+            permanent = {rcpt: reply for rcpt, reply in refused.items() if 500 <= reply[0] < 600}
+            temporary = {rcpt: reply for rcpt, reply in refused.items() if rcpt not in permanent}
+            if temporary and entry.attempts + 1 >= max_attempts:
+                permanent.update(temporary)
+                temporary = {}
+            if permanent:
+                error = smtplib.SMTPRecipientsRefused(permanent)
+                logging.error('Message %s dead-lettered for "%s"', name, ", ".join(permanent))
+                outbox.dead_letter(entry.for_recipients(permanent), error, keep=bool(temporary))
+                failed += 1
+            if temporary:
+                error = smtplib.SMTPRecipientsRefused(temporary)
+                delay = retry_delay * 2**entry.attempts
+                logging.warning(
+                    'Message %s refused for "%s": "%s" - retry in %ds',
+                    name,
+                    ", ".join(temporary),
+                    error,
+                    delay,
+                )
+                outbox.retry(entry.for_recipients(temporary), error, delay)
+                retried += 1
+    return sent, retried, failed
+
+
+# -- Function: run_daemon
+# It delivers the outbox messages until stopped (SIGTERM/SIGINT or the "stop" event)
+#
+def run_daemon(options, outbox=None, stop=None, poll_interval=None):
+    if outbox is None:
+        outbox = Outbox(getattr(options, "spool_dir", None) or DEFAULT_SPOOL_DIR)
+    options = with_rate_limiter(options)
+    stop = stop or threading.Event()
+    poll_interval = poll_interval or getattr(options, "poll_interval", None)
+    poll_interval = DEFAULT_POLL_INTERVAL if poll_interval is None else poll_interval
+    max_attempts = getattr(options, "max_attempts", None) or DEFAULT_MAX_ATTEMPTS
+    retry_delay = getattr(options, "retry_delay", None)
+    retry_delay = DEFAULT_RETRY_DELAY if retry_delay is None else retry_delay
+
+    if threading.current_thread() is threading.main_thread():
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, lambda *args: stop.set())
+
+    recovered = outbox.recover()
+    if recovered:
+        logging.warning("Recovered %d message(s) from an interrupted delivery", recovered)
+    logging.info('Delivering the messages from "%s"', outbox.path)
+
+    max_messages = getattr(options, "max_per_connection", None) or 0
+    watcher = getattr(options, "config_watcher", None)
+    session = SMTPSession(options, max_messages=max_messages)
+    try:
+        while not stop.is_set():
+            sent, retried, failed = deliver(outbox, session, max_attempts, retry_delay, stop)
+            if sent or retried or failed:
+                logging.info("%d sent, %d retried, %d failed", sent, retried, failed)
+            elif session.server is not None:
+                # Nothing to do: do not keep the connection open while idle
+                session.close()
+            reloaded = watcher.poll() if watcher is not None else None
+            if reloaded is not None:
+                session.close()
+                session = SMTPSession(with_rate_limiter(reloaded), max_messages=max_messages)
+            stop.wait(poll_interval)
+    finally:
+        session.close()
+    return 0
@@ -0,0 +1,102 @@
+# ------------------------------------------ partcache.py -----------------------------------------
+# Shared MIME parts cache for simplemail.
+#
+# When many messages of a batch carry the same attachment, the file is read and base64 encoded
+# only once. The encoded payload is cached by file path, modification time and size, so a file
+# changed on disk is encoded again, and the following messages get a new MIME part with the
+# cached payload.
+#
+# The cache is bounded by the total size of the encoded payloads, evicting the least recently
+# used ones. It keeps counters of hits, misses and the attachment bytes which were not read and
+# encoded again.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import collections
+import copy
+import logging
+import os
+import threading
+from email.mime.application import MIMEApplication
+from email.mime.base import MIMEBase
+from os.path import basename
+
+DEFAULT_MAX_BYTES = 128 * 1024 * 1024
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: PartCache
+# A thread-safe LRU cache of encoded attachments
+#
+class PartCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    # -- It returns a new MIME part for the file, encoding it only when it's not cached
+    def attachment(self, path):
+        stat = os.stat(path)
+        key = (os.path.realpath(path), stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            payload = self._entries.get(key)
+            if payload is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                self.bytes_saved += stat.st_size
+        if payload is not None:
+            part = MIMEBase("application", "octet-stream", Name=basename(path))
+            part.set_payload(payload)
+            part["Content-Transfer-Encoding"] = "base64"
+            return part
+
+        with open(path, "rb") as f:
+            part = MIMEApplication(f.read(), Name=basename(path))
+        self._store(key, part.get_payload())
+        return part
+
+    def _store(self, key, payload):
+        with self._lock:
+            self.misses += 1
+            if len(payload) > self.max_bytes or key in self._entries:
+                return
+            self._entries[key] = payload
+            self.size += len(payload)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+                logging.debug("Attachment of %d bytes evicted from the cache", len(evicted))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def summary(self):
+        return "Attachment cache: %d hits, %d misses, %d bytes saved" % (
+            self.hits,
+            self.misses,
+            self.bytes_saved,
+        )
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: with_part_cache
+# It returns the options with a cache shared by all the messages built from them, unless they
+# already have one or the cache is disabled (size 0)
+#
+def with_part_cache(options):
+    if getattr(options, "part_cache", None) is not None:
+        return options
+    size = getattr(options, "attachment_cache_size", None)
+    max_bytes = DEFAULT_MAX_BYTES if size is None else int(size * 1024 * 1024)
+    if max_bytes <= 0:
+        return options
+    options = copy.copy(options)
+    options.part_cache = PartCache(max_bytes)
+    return options
@@ -0,0 +1,128 @@
+# -------------------------------------------- pool.py --------------------------------------------
+# A pool of authenticated SMTP sessions for simplemail.
+#
+# It keeps up to "max_size" sessions with the configured server. Sessions are checked (NOOP)
+# before being reused, closed after being idle for longer than "idle_timeout" seconds and
+# reconnected after "max_messages" messages.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import collections
+import contextlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from simplemail.batch import send_job
+from simplemail.partcache import with_part_cache
+from simplemail.ratelimit import with_rate_limiter
+from simplemail.session import SMTPSession
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: SMTPConnectionPool
+# A thread-safe pool of SMTPSession objects
+#
+class SMTPConnectionPool:
+    def __init__(self, options, max_size=4, idle_timeout=60.0, max_messages=0):
+        if max_size < 1:
+            raise ValueError("The pool size must be at least 1")
+        self.options = options
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.max_messages = max_messages
+        self._idle = collections.deque()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    # -- It returns an idle and healthy session or a new one
+    def acquire(self, timeout=None):
+        if self._closed:
+            raise RuntimeError("The connection pool is closed")
+        if not self._slots.acquire(timeout=-1 if timeout is None else timeout):
+            raise TimeoutError("No SMTP session available in the pool")
+        with self._lock:
+            session = self._idle.pop() if self._idle else None
+        if session is None:
+            return SMTPSession(self.options, max_messages=self.max_messages)
+
+        # Sessions are reconnected lazily when used after being closed here
+        if session.server is None:
+            pass
+        elif time.monotonic() - session.last_used > self.idle_timeout:
+            logging.debug("Closing the SMTP session idle for too long")
+            session.close()
+        elif not session.check():
+            logging.debug("Dropping the SMTP session which failed the health check")
+            session.drop()
+        return session
+
+    # -- It gives the session back to the pool
+    def release(self, session):
+        with self._lock:
+            if self._closed:
+                session.close()
+            else:
+                self._idle.append(session)
+        self._slots.release()
+
+    @contextlib.contextmanager
+    def session(self, timeout=None):
+        session = self.acquire(timeout)
+        try:
+            yield session
+        finally:
+            self.release(session)
+
+    def sendmail(self, from_addr, to_addrs, msg):
+        with self.session() as session:
+            return session.sendmail(from_addr, to_addrs, msg)
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, collections.deque()
+        for session in idle:
+            session.close()
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: send_pooled
+# It sends the jobs concurrently with "workers" threads sharing a pool of SMTP sessions. It
+# returns 0 when all messages were sent successfully and 1 otherwise
+#
+def send_pooled(options, jobs, workers):
+    options = with_rate_limiter(with_part_cache(options))
+    max_messages = getattr(options, "max_per_connection", None) or 0
+    # Bounds the jobs in flight so huge job files are not loaded at once
+    in_flight = threading.BoundedSemaphore(workers * 2)
+    results = collections.Counter()
+    results_lock = threading.Lock()
+
+    def _run(index, job):
+        try:
+            sent = send_job(pool.sendmail, options, index, job)
+            with results_lock:
+                results[sent] += 1
+        finally:
+            in_flight.release()
+
+    with SMTPConnectionPool(options, max_size=workers, max_messages=max_messages) as pool:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for index, job in enumerate(jobs, 1):
+                in_flight.acquire()
+                executor.submit(_run, index, job)
+
+    logging.info("Batch finished: %d sent, %d failed", results[True], results[False])
+    if getattr(options, "part_cache", None) is not None:
+        logging.info(options.part_cache.summary())
+    return 1 if results[False] else 0
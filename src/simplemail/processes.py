@@ -0,0 +1,220 @@
+# ------------------------------------------ processes.py -----------------------------------------
+# Multi-process sending for simplemail.
+#
+# Building the messages (reading and base64 encoding the attachments, generating the MIME tree)
+# is CPU-bound, so the threads of "--workers" can't use more than one core for it. With
+# "--processes N" the jobs of a batch or mail merge are built and serialized by N worker
+# processes, while "--workers" threads of this process send them through a pool of SMTP sessions.
+#
+# The messages bigger than SHARED_MEMORY_THRESHOLD are handed back through shared memory
+# ("multiprocessing.shared_memory", Python 3.8+) instead of being pickled through the pipe of the
+# process pool: only the name of the block travels, and the sender copies the bytes out of it
+# once and releases it. The messages are built as 7bit, as their workers don't know whether the
+# server supports 8BITMIME.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import collections
+import copy
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from simplemail import timing
+from simplemail.batch import job_options
+from simplemail.binary import message_bytes
+from simplemail.cli import build_message
+from simplemail.logs import message_context
+from simplemail.partcache import with_part_cache
+from simplemail.pool import SMTPConnectionPool
+from simplemail.ratelimit import with_rate_limiter
+
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+SHARED_MEMORY_THRESHOLD = 64 * 1024
+# The option values sent to the worker processes: the runtime objects stay in this process
+PORTABLE_TYPES = (str, int, float, bool, list, tuple, type(None))
+
+# The options of the worker process (see "init_worker")
+_worker_options = None
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: BuiltMessage
+# A message built by a worker process: its envelope and either its bytes or the shared memory
+# block holding them
+#
+class BuiltMessage:
+    def __init__(self, sender, recipients, to, data, build_time):
+        self.sender = sender
+        self.recipients = recipients
+        self.to = to
+        self.build_time = build_time
+        self.size = len(data)
+        self.data = None
+        self.shm_name = None
+        if shared_memory is not None and self.size >= SHARED_MEMORY_THRESHOLD:
+            self._share(data)
+        else:
+            self.data = bytes(data)
+
+    def _share(self, data):
+        shm = shared_memory.SharedMemory(create=True, size=self.size)
+        try:
+            shm.buf[: self.size] = data
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            raise
+        shm.close()
+        # The process receiving the message releases the block
+        _untrack(shm)
+        self.shm_name = shm.name
+
+    # -- It returns the message bytes, releasing the shared memory block
+    def take(self):
+        if self.shm_name is None:
+            return self.data
+        shm = shared_memory.SharedMemory(name=self.shm_name)
+        try:
+            return bytes(shm.buf[: self.size])
+        finally:
+            shm.close()
+            shm.unlink()
+            self.shm_name = None
+
+    # -- It releases the shared memory block of a message which won't be sent
+    def release(self):
+        if self.shm_name is None:
+            return
+        try:
+            shm = shared_memory.SharedMemory(name=self.shm_name)
+        except FileNotFoundError:
+            pass
+        else:
+            shm.close()
+            shm.unlink()
+        self.shm_name = None
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: portable_options
+# A copy of the options without the runtime objects (rate limiter, caches, mailer...), which
+# can't be sent to other processes
+#
+def portable_options(options):
+    portable = copy.copy(options)
+    for name, value in list(vars(portable).items()):
+        if not isinstance(value, PORTABLE_TYPES):
+            delattr(portable, name)
+    return portable
+
+
+def _untrack(shm):
+    # Before Python 3.13 the creator's resource tracker unlinks the block when it exits
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+
+
+# -- Function: init_worker
+# The initializer of the worker processes building the messages ("initializer" of a
+# ProcessPoolExecutor), given the options from "portable_options"
+#
+def init_worker(options):
+    global _worker_options
+    # Every worker process encodes the attachments repeated by its jobs once
+    _worker_options = with_part_cache(options)
+
+
+# -- Function: build_job
+# It builds and serializes the message of a job in a worker process set up by "init_worker". It
+# returns a BuiltMessage
+#
+def build_job(job):
+    start = time.perf_counter()
+    job_opts = job_options(_worker_options, job)
+    msg = build_message(job_opts)
+    data = message_bytes(msg)
+    return BuiltMessage(
+        msg["From"],
+        job_opts.to + job_opts.cc + job_opts.bcc,
+        msg["To"],
+        data,
+        time.perf_counter() - start,
+    )
+
+
+# -- Function: send_multiprocess
+# It builds the messages of the jobs with "processes" worker processes and sends them with
+# "workers" threads sharing a pool of SMTP sessions. It returns 0 when all messages were sent
+# successfully and 1 otherwise
+#
+def send_multiprocess(options, jobs, processes, workers=1):
+    options = with_rate_limiter(options)
+    max_messages = getattr(options, "max_per_connection", None) or 0
+    # Bounds the messages built but not sent yet, which may hold shared memory
+    in_flight = threading.BoundedSemaphore(processes * 4)
+    results = collections.Counter()
+    results_lock = threading.Lock()
+    # The builds whose message wasn't taken by a sender yet
+    outstanding = set()
+
+    def _send(index, future):
+        with message_context():
+            try:
+                with timing.measure():
+                    built = future.result()
+                    timing.add_phase("build", built.build_time)
+                    data = built.take()
+                    logging.debug("Sending e-mail #%d", index)
+                    pool.sendmail(built.sender, built.recipients, data)
+                logging.info('Email #%d sent to: "%s"', index, built.to)
+                sent = True
+            except Exception as e:
+                logging.error('Failed to process the e-mail request #%d:  "%s"', index, e)
+                sent = False
+            finally:
+                in_flight.release()
+        with results_lock:
+            outstanding.discard(future)
+            results[sent] += 1
+
+    try:
+        with SMTPConnectionPool(options, max_size=workers, max_messages=max_messages) as pool:
+            with ThreadPoolExecutor(max_workers=workers) as senders:
+                with ProcessPoolExecutor(
+                    max_workers=processes,
+                    initializer=init_worker,
+                    initargs=(portable_options(options),),
+                ) as builders:
+                    for index, job in enumerate(jobs, 1):
+                        in_flight.acquire()
+                        try:
+                            future = builders.submit(build_job, job)
+                        except BrokenProcessPool as e:
+                            in_flight.release()
+                            logging.error("The batch was interrupted from e-mail #%d: %s", index, e)
+                            with results_lock:
+                                results[False] += 1
+                            break
+                        with results_lock:
+                            outstanding.add(future)
+                        future.add_done_callback(
+                            lambda future, index=index: senders.submit(_send, index, future)
+                        )
+    finally:
+        # The messages built but not sent, e.g. on interrupt, must not leak their shared memory
+        for future in outstanding:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                future.result().release()
+
+    logging.info("Batch finished: %d sent, %d failed", results[True], results[False])
+    return 1 if results[False] else 0
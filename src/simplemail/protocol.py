@@ -0,0 +1,336 @@
+# ------------------------------------------ protocol.py ------------------------------------------
+# Low level SMTP helpers for simplemail.
+#
+# When the server advertises the PIPELINING extension (RFC 2920) the envelope (MAIL FROM, every
+# RCPT TO and DATA) is written at once and the replies are read back in bulk, instead of waiting
+# a round trip for each command. Servers without PIPELINING use the regular "smtplib" behavior.
+#
+# When the server advertises CHUNKING (RFC 3030) the message bytes are sent with BDAT in fixed
+# size chunks, without the dot-stuffing scan and copy required by DATA.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import logging
+import re
+import smtplib
+from email.message import Message
+
+from simplemail import timing
+from simplemail.binary import message_bytes, use_8bit_bodies
+
+CRLF = b"\r\n"
+SERVICE_NOT_AVAILABLE = 421
+TOO_MANY_RECIPIENTS = 452
+BDAT_CHUNK_SIZE = 1024 * 1024
+_EOL_RE = re.compile(rb"\r\n|\n|\r(?!\n)")
+_PERIOD_RE = re.compile(rb"(?m)^\.")
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: stuff_lines
+# It normalizes the line endings and applies the dot-stuffing for the DATA command
+#
+def stuff_lines(data):
+    return _PERIOD_RE.sub(b"..", _EOL_RE.sub(CRLF, data))
+
+
+# -- Function: quote_data
+# The same as "stuff_lines", but including the final "." line
+#
+def quote_data(data):
+    data = stuff_lines(data)
+    if not data.endswith(CRLF):
+        data += CRLF
+    return data + b"." + CRLF
+
+
+# -- Function: envelope_commands
+# It returns the pipelined envelope: MAIL FROM, one RCPT TO per recipient and DATA (unless the
+# content is sent with BDAT)
+#
+def envelope_commands(from_addr, to_addrs, mail_options=(), data=True):
+    mail = "MAIL FROM:%s" % smtplib.quoteaddr(from_addr)
+    if mail_options:
+        mail += " " + " ".join(mail_options)
+    commands = [mail] + ["RCPT TO:%s" % smtplib.quoteaddr(rcpt) for rcpt in to_addrs]
+    if data:
+        commands.append("DATA")
+    return "".join(command + "\r\n" for command in commands).encode("ascii")
+
+
+# -- Function: check_envelope_replies
+# It checks the replies of a pipelined envelope. It returns the refused recipients or raises the
+# same exceptions as "smtplib.SMTP.sendmail"
+#
+def check_envelope_replies(from_addr, to_addrs, replies, data=True):
+    mail_code, mail_resp = replies[0]
+    data_reply = replies[-1] if data else (354, b"")
+    if mail_code != 250:
+        raise smtplib.SMTPSenderRefused(mail_code, mail_resp, from_addr)
+
+    refused = {}
+    rcpt_end = len(to_addrs) + 1
+    for rcpt, (code, resp) in zip(to_addrs, replies[1:rcpt_end]):
+        if code not in (250, 251):
+            refused[rcpt] = (code, resp)
+    if refused and (len(refused) == len(to_addrs) or data_reply[0] == SERVICE_NOT_AVAILABLE):
+        raise smtplib.SMTPRecipientsRefused(refused)
+    if data_reply[0] != 354:
+        raise smtplib.SMTPDataError(*data_reply)
+    return refused
+
+
+# -- Function: envelope_options
+# The MAIL FROM parameters supported by the server
+#
+def envelope_options(server, size=None, body=None):
+    options = []
+    if size is not None and server.has_extn("size"):
+        options.append("size=%d" % size)
+    if body:
+        options.append("BODY=%s" % body)
+    return options
+
+
+# -- Function: open_data
+# It sends the envelope (pipelined when the server supports it) and the DATA command through an
+# "smtplib.SMTP" connection. It returns the refused recipients once the server is ready to
+# receive the message content. With "data=False" only the envelope is sent, for BDAT
+#
+def open_data(server, from_addr, to_addrs, size=None, body=None, data=True):
+    with timing.phase("envelope"):
+        server.ehlo_or_helo_if_needed()
+        if isinstance(to_addrs, str):
+            to_addrs = [to_addrs]
+        options = envelope_options(server, size, body)
+
+        if "pipelining" not in server.esmtp_features:
+            return _open_data_sequential(server, from_addr, to_addrs, options, data)
+
+        server.send(envelope_commands(from_addr, to_addrs, options, data))
+        replies = [server.getreply() for _ in range(len(to_addrs) + (2 if data else 1))]
+        try:
+            return check_envelope_replies(from_addr, to_addrs, replies, data)
+        except smtplib.SMTPException:
+            if any(code == SERVICE_NOT_AVAILABLE for code, _ in replies):
+                server.close()
+            else:
+                # The server may have accepted DATA even without valid recipients
+                if data and replies[-1][0] == 354:
+                    server.send(b"." + CRLF)
+                    server.getreply()
+                server.rset()
+            raise
+
+
+def _open_data_sequential(server, from_addr, to_addrs, mail_options, data=True):
+    code, resp = server.mail(from_addr, mail_options)
+    if code != 250:
+        _abort(server, code)
+        raise smtplib.SMTPSenderRefused(code, resp, from_addr)
+    refused = {}
+    for position, rcpt in enumerate(to_addrs, 1):
+        code, resp = server.rcpt(rcpt)
+        if code not in (250, 251):
+            refused[rcpt] = (code, resp)
+        if code == SERVICE_NOT_AVAILABLE:
+            server.close()
+            raise smtplib.SMTPRecipientsRefused(refused)
+        if code == TOO_MANY_RECIPIENTS:
+            # The next recipients would be refused too, they are deferred without a round trip
+            refused.update((other, (code, resp)) for other in to_addrs[position:])
+            break
+    if len(refused) == len(to_addrs):
+        server.rset()
+        raise smtplib.SMTPRecipientsRefused(refused)
+    if not data:
+        return refused
+    server.putcmd("data")
+    code, resp = server.getreply()
+    if code != 354:
+        _abort(server, code)
+        raise smtplib.SMTPDataError(code, resp)
+    return refused
+
+
+# -- Function: finish_data
+# It reads the reply of the server after the message content was sent
+#
+def finish_data(server):
+    code, resp = server.getreply()
+    if code != 250:
+        _abort(server, code)
+        raise smtplib.SMTPDataError(code, resp)
+    return code, resp
+
+
+def _abort(server, code):
+    if code == SERVICE_NOT_AVAILABLE:
+        server.close()
+    else:
+        server.rset()
+
+
+# -- Function: sendmail_pipelined
+# It sends a message with a pipelined envelope through an "smtplib.SMTP" connection. The header,
+# e.g. the DKIM signature, is sent before the message
+#
+def sendmail_pipelined(server, from_addr, to_addrs, msg, body=None, header=b""):
+    if isinstance(msg, str):
+        msg = msg.encode("ascii")
+    refused = open_data(server, from_addr, to_addrs, size=len(header) + len(msg), body=body)
+    with timing.phase("data"):
+        if header:
+            server.send(header)
+        server.send(quote_data(msg))
+        finish_data(server)
+    return refused
+
+
+# -- Function: bdat_commands
+# It yields the BDAT commands and the chunks (memoryview, no copies) of the message bytes. The
+# header, e.g. the DKIM signature, goes in the first chunk, right after its command
+#
+def bdat_commands(data, chunk_size=BDAT_CHUNK_SIZE, header=b""):
+    view = memoryview(data)
+    if not len(view):
+        yield b"BDAT %d LAST" % len(header) + CRLF + header, view
+        return
+    for offset in range(0, len(view), chunk_size):
+        end = offset + chunk_size
+        chunk = view[offset:end]
+        last = b" LAST" if end >= len(view) else b""
+        yield b"BDAT %d%s" % (len(header) + len(chunk), last) + CRLF + header, chunk
+        header = b""
+
+
+# -- Function: send_bdat
+# It sends the message bytes with BDAT through an "smtplib.SMTP" connection
+#
+def send_bdat(server, data, chunk_size=BDAT_CHUNK_SIZE, header=b""):
+    for command, chunk in bdat_commands(data, chunk_size, header):
+        server.send(command)
+        server.send(chunk)
+        finish_data(server)
+
+
+# -- Function: send_data
+# It sends the message bytes through an "smtplib.SMTP" connection using the best transfer
+# supported by the server: BDAT with CHUNKING, a pipelined envelope with PIPELINING or the
+# regular "smtplib" DATA transfer. The header, e.g. a DKIM signature computed before, or the
+# signature of the DKIM signer is sent before the message bytes, without copying them
+#
+def send_data(
+    server,
+    from_addr,
+    to_addrs,
+    data,
+    body=None,
+    chunk_size=BDAT_CHUNK_SIZE,
+    signer=None,
+    header=b"",
+):
+    server.ehlo_or_helo_if_needed()
+    if isinstance(data, str):
+        data = _EOL_RE.sub(CRLF, data.encode("ascii"))
+    if signer is not None:
+        # Signed as sent, i.e. after the conversion to 8bit
+        with timing.phase("dkim"):
+            header = signer.signature(data)
+    size = len(header) + len(data)
+
+    if "chunking" in server.esmtp_features:
+        logging.debug("    - sending %d bytes with BDAT", size)
+        refused = open_data(server, from_addr, to_addrs, size=size, body=body, data=False)
+        with timing.phase("data"):
+            send_bdat(server, data, chunk_size, header)
+    elif "pipelining" in server.esmtp_features:
+        logging.debug("    - pipelining the envelope of %d recipient(s)", len(to_addrs))
+        refused = sendmail_pipelined(server, from_addr, to_addrs, data, body, header)
+    elif header:
+        # "smtplib" can't send the header before the message: the envelope is sent sequentially
+        refused = sendmail_pipelined(server, from_addr, to_addrs, data, body, header)
+    else:
+        with timing.phase("data"):
+            refused = server.sendmail(
+                from_addr, to_addrs, data, envelope_options(server, body=body)
+            )
+    timing.count(size, len(to_addrs) - len(refused or {}))
+    return refused
+
+
+# -- Function: send_message
+# It generates the MIME message as bytes, with 8bit bodies when the server supports 8BITMIME,
+# and sends it with "send_data"
+#
+def send_message(server, from_addr, to_addrs, msg, chunk_size=BDAT_CHUNK_SIZE, signer=None):
+    server.ehlo_or_helo_if_needed()
+    body = None
+    with timing.phase("build"):
+        if "8bitmime" in server.esmtp_features and use_8bit_bodies(msg):
+            body = "8BITMIME"
+        data = message_bytes(msg)
+    return send_data(server, from_addr, to_addrs, data, body, chunk_size, signer)
+
+
+# -- Function: send_prepared
+# It sends a PreparedMessage (see simplemail.mailer), whose bytes are generated only once
+#
+def send_prepared(server, from_addr, to_addrs, msg, chunk_size=BDAT_CHUNK_SIZE, signer=None):
+    server.ehlo_or_helo_if_needed()
+    with timing.phase("build"):
+        eight_bit = "8bitmime" in server.esmtp_features and msg.has_8bit()
+        data = msg.as_bytes(eight_bit)
+    body = "8BITMIME" if eight_bit else None
+    return send_data(server, from_addr, to_addrs, data, body, chunk_size, signer)
+
+
+# -- Function: send_stream
+# It sends a message whose content is produced in chunks by "msg.iter_chunks()", which must
+# already be dot-stuffed and terminated, as done by "simplemail.streaming.StreamingMessage". With
+# a DKIM signer, the signature is computed from "msg.signature(signer)" and sent first
+#
+def send_stream(server, from_addr, to_addrs, msg, signer=None):
+    header = b""
+    if signer is not None:
+        with timing.phase("dkim"):
+            header = msg.signature(signer)
+    size = msg.size()
+    if size is not None:
+        size += len(header)
+    refused = open_data(server, from_addr, to_addrs, size=size)
+    size = len(header)
+    with timing.phase("data"):
+        if header:
+            server.send(header)
+        for chunk in msg.iter_chunks():
+            server.send(chunk)
+            size += len(chunk)
+        finish_data(server)
+    timing.count(size, len(to_addrs) - len(refused or {}))
+    return refused
+
+
+# -- Function: sendmail
+# It sends a message through an "smtplib.SMTP" connection, pipelining the envelope when the
+# server supports it, and reports the refused recipients. The message can be a string, bytes, a
+# MIME message, a prepared message or a streaming message. It's signed by the DKIM signer if any
+# (see simplemail.dkim)
+#
+def sendmail(server, from_addr, to_addrs, msg, signer=None):
+    if hasattr(msg, "iter_chunks"):
+        refused = send_stream(server, from_addr, to_addrs, msg, signer)
+    elif isinstance(msg, Message):
+        refused = send_message(server, from_addr, to_addrs, msg, signer=signer)
+    elif hasattr(msg, "has_8bit"):
+        refused = send_prepared(server, from_addr, to_addrs, msg, signer=signer)
+    else:
+        refused = send_data(server, from_addr, to_addrs, msg, signer=signer)
+    for rcpt, (code, resp) in (refused or {}).items():
+        if code == TOO_MANY_RECIPIENTS:
+            # Sent in another envelope by the session (see simplemail.envelope)
+            logging.debug('Recipient "%s" deferred: %s %s', rcpt, code, resp)
+        else:
+            logging.warning('Recipient "%s" refused: %s %s', rcpt, code, resp)
+    return refused
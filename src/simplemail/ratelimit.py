@@ -0,0 +1,164 @@
+# ------------------------------------------ ratelimit.py -----------------------------------------
+# Rate limiting and adaptive throttling for simplemail.
+#
+# The messages and the recipients sent through the relay are limited by token buckets, as
+# configured in the [LIMITS] section of the configuration file:
+#     - MessagesPerSecond: Float. The messages sent per second
+#     - RecipientsPerMinute: Float. The recipients (RCPT TO) sent per minute
+#
+# The limits are adapted to the server (AIMD): the rate is halved whenever the server replies
+# with a temporary error (4xx), e.g. "421 too many messages" or "451 rate limited", and the
+# message is retried after the backoff. Each accepted message raises the rate again, up to the
+# configured one, so the throughput stays close to the quota without getting blocked.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import copy
+import logging
+import smtplib
+import threading
+import time
+
+# The fraction of the configured rate recovered by each accepted message
+RATE_INCREASE = 0.05
+# The lowest fraction of the configured rate after backing off
+MIN_RATE_FACTOR = 1 / 64
+DEFAULT_MAX_RETRIES = 5
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: TokenBucket
+# A thread-safe token bucket refilled at "rate" tokens per second up to "capacity" tokens.
+#
+# Requests bigger than the capacity are allowed, leaving the bucket in debt, so a message with
+# many recipients is delayed instead of being blocked forever.
+#
+class TokenBucket:
+    def __init__(self, rate, capacity=None, clock=time.monotonic):
+        self.rate = float(rate)
+        self.capacity = float(capacity) if capacity else max(1.0, self.rate)
+        self.clock = clock
+        self.tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    # -- It takes the tokens and returns the seconds to wait before using them
+    def reserve(self, tokens=1):
+        with self._lock:
+            now = self.clock()
+            self._refill(now)
+            self.tokens -= tokens
+            return max(0.0, -self.tokens / self.rate)
+
+    # -- It empties the bucket, e.g. after the server refused messages for going too fast
+    def drain(self):
+        with self._lock:
+            self._refill(self.clock())
+            self.tokens = min(self.tokens, 0.0)
+
+    def set_rate(self, rate):
+        with self._lock:
+            self._refill(self.clock())
+            self.rate = float(rate)
+
+
+# -- Class: RateLimiter
+# The messages and recipients limits of a relay, adapted to its temporary errors
+#
+class RateLimiter:
+    def __init__(
+        self,
+        messages_per_second=None,
+        recipients_per_minute=None,
+        max_retries=DEFAULT_MAX_RETRIES,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.messages_per_second = messages_per_second
+        self.recipients_per_minute = recipients_per_minute
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.factor = 1.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+        self.messages = self.recipients = None
+        if messages_per_second:
+            self.messages = TokenBucket(messages_per_second, clock=clock)
+        if recipients_per_minute:
+            self.recipients = TokenBucket(recipients_per_minute / 60.0, clock=clock)
+
+    # -- It takes the tokens for a message and returns the seconds to wait before sending it
+    def reserve(self, recipients=1):
+        delays = [0.0]
+        if self.messages is not None:
+            delays.append(self.messages.reserve(1))
+        if self.recipients is not None:
+            delays.append(self.recipients.reserve(recipients))
+        return max(delays)
+
+    # -- It blocks until the message can be sent
+    def wait(self, recipients=1):
+        delay = self.reserve(recipients)
+        if delay > 0:
+            logging.debug("Rate limit: waiting %.3fs", delay)
+            self.sleep(delay)
+
+    # -- The server accepted a message: speed up towards the configured rate
+    def accepted(self):
+        with self._lock:
+            if self.factor >= 1.0:
+                return
+            self.factor = min(1.0, self.factor + RATE_INCREASE)
+            self._apply()
+
+    # -- The server replied with a temporary error: slow down
+    def throttle(self):
+        with self._lock:
+            self.throttled += 1
+            self.factor = max(MIN_RATE_FACTOR, self.factor / 2)
+            self._apply()
+        for bucket in (self.messages, self.recipients):
+            if bucket is not None:
+                bucket.drain()
+        logging.warning("Server throttling - rate reduced to %.0f%%", self.factor * 100)
+
+    def _apply(self):
+        if self.messages is not None:
+            self.messages.set_rate(self.messages_per_second * self.factor)
+        if self.recipients is not None:
+            self.recipients.set_rate(self.recipients_per_minute / 60.0 * self.factor)
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: is_throttled
+# Whether the SMTP error is temporary (4xx), thus the message can be retried more slowly
+#
+def is_throttled(error):
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return bool(error.recipients) and all(
+            400 <= code < 500 for code, _ in error.recipients.values()
+        )
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    return False
+
+
+# -- Function: with_rate_limiter
+# It returns the options with a rate limiter shared by all the sessions created from them, unless
+# they already have one or no limits are configured
+#
+def with_rate_limiter(options):
+    if getattr(options, "rate_limiter", None) is not None:
+        return options
+    messages = getattr(options, "messages_per_second", None)
+    recipients = getattr(options, "recipients_per_minute", None)
+    if not messages and not recipients:
+        return options
+    options = copy.copy(options)
+    options.rate_limiter = RateLimiter(messages, recipients)
+    return options
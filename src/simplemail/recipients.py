@@ -0,0 +1,134 @@
+# ----------------------------------------- recipients.py -----------------------------------------
+# Recipient processing for simplemail.
+#
+# The recipients of the command line (-t, -cc, -bcc) and of the address files (--to-file,
+# --bcc-file) go through one pass before connecting to the server:
+#     - Normalization: The surrounding spaces are stripped and the address is extracted from the
+#       "Name <address>" form, which is kept as written for the message headers
+#     - Validation: The addresses which aren't a valid "local@domain" (RFC 5321, ASCII only) are
+#       skipped with a warning, instead of costing an RCPT TO round trip each to be refused
+#     - De-duplication: An address is sent once, in the first of to, cc and bcc where it appears.
+#       The addresses are compared ignoring the case
+#
+# The files are streamed line by line and each address is checked against a set, so the time is
+# linear with the number of addresses and the memory used is the unique addresses kept.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import logging
+import re
+
+# RFC 5321 (4.1.2 and 4.5.3.1): dot-atom or quoted local part, domain name or address literal
+_ATOM = r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+"
+_LABEL = r"[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?"
+_ADDRESS_RE = re.compile(
+    r'(?:%s(?:\.%s)*|"(?:[\x20\x21\x23-\x5b\x5d-\x7e]|\\[\x20-\x7e])*")'
+    r"@(?:%s(?:\.%s)*|\[[\x21-\x5a\x5e-\x7e]+\])\Z" % (_ATOM, _ATOM, _LABEL, _LABEL)
+)
+MAX_ADDRESS_LENGTH = 254
+MAX_LOCAL_PART_LENGTH = 64
+# The invalid addresses logged one by one, the rest are only counted
+MAX_LOGGED_INVALID = 20
+
+RECIPIENT_KINDS = ["to", "cc", "bcc"]
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: RecipientSet
+# The unique and valid recipients of a message, by kind (to, cc and bcc), in the order they were
+# added
+#
+class RecipientSet:
+    def __init__(self):
+        self.to = []
+        self.cc = []
+        self.bcc = []
+        self.duplicates = 0
+        self.invalid = 0
+        self._seen = set()
+
+    def __len__(self):
+        return len(self._seen)
+
+    # -- It adds an address of the given kind. It returns whether it was added, i.e. it's valid
+    # and it wasn't added before
+    def add(self, address, kind="to"):
+        address = address.strip()
+        key = address_key(address)
+        if key is None:
+            self.invalid += 1
+            if self.invalid <= MAX_LOGGED_INVALID:
+                logging.warning('Skipping the invalid recipient "%s"', address)
+            return False
+        if key in self._seen:
+            self.duplicates += 1
+            return False
+        self._seen.add(key)
+        getattr(self, kind).append(address)
+        return True
+
+    def update(self, addresses, kind="to"):
+        for address in addresses:
+            self.add(address, kind)
+
+    def summary(self):
+        return "Recipients: %d unique, %d duplicate(s) and %d invalid skipped" % (
+            len(self),
+            self.duplicates,
+            self.invalid,
+        )
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: address_key
+# The normalized address (addr-spec in lowercase) used to detect the duplicates, or None when the
+# address isn't valid. The address can be in the "Name <address>" form
+#
+def address_key(address):
+    if address.endswith(">"):
+        start = address.rfind("<") + 1
+        if not start:
+            return None
+        address = address[start:-1]
+    local = address.rpartition("@")[0]
+    if (
+        len(address) > MAX_ADDRESS_LENGTH
+        or len(local) > MAX_LOCAL_PART_LENGTH
+        or not _ADDRESS_RE.match(address)
+    ):
+        return None
+    key = address.lower()
+    # The same string when it's already in lowercase, not to keep two copies of it
+    return address if key == address else key
+
+
+# -- Function: iter_address_file
+# A generator which yields the addresses of a file, one per line. The blank lines and the
+# comments (#) are skipped
+#
+def iter_address_file(path):
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+
+
+# -- Function: process_recipients
+# It replaces the to/cc/bcc options by their unique and valid addresses, including the ones of the
+# address files ("to_file" and "bcc_file") unless "read_files" is False, and returns the
+# RecipientSet
+#
+def process_recipients(options, read_files=True):
+    recipients = RecipientSet()
+    for kind in RECIPIENT_KINDS:
+        recipients.update(getattr(options, kind, None) or [], kind)
+        path = getattr(options, kind + "_file", None) if read_files else None
+        if path:
+            recipients.update(iter_address_file(path), kind)
+    for kind in RECIPIENT_KINDS:
+        setattr(options, kind, getattr(recipients, kind))
+    if recipients.duplicates or recipients.invalid:
+        logging.info(recipients.summary())
+    return recipients
@@ -0,0 +1,396 @@
+# ------------------------------------------- render.py -------------------------------------------
+# Offline rendering for simplemail.
+#
+# With "--output KIND:PATH" the messages are built as they would be sent, but written to disk
+# instead of being sent, without any SMTP connection. It's meant for load testing, archiving and
+# pre-generating campaigns, and it measures the cost of building the messages by themselves. The
+# targets are:
+#     - maildir:DIR: One file per message, written in "tmp" and moved to "new" once synced
+#     - mbox:FILE: The messages appended to a single file (mboxrd format, ">From " quoting)
+#     - eml-dir:DIR: One ".eml" file per message, with CRLF line endings
+#
+# The files are not synced one by one: "--output-sync N" syncs them every N messages (and at the
+# end), and 0 doesn't sync them at all. The mbox is written through a large buffer. With
+# "--processes N" the messages of a batch or mail merge are built by N worker processes (see
+# simplemail.processes) and written in order by this process. The messages are signed with DKIM
+# when configured.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import abc
+import collections
+import itertools
+import logging
+import os
+import re
+import socket
+import time
+from email.utils import parseaddr
+
+from simplemail import timing
+from simplemail.batch import job_options
+from simplemail.binary import message_bytes
+from simplemail.cli import build_message
+from simplemail.logs import message_context
+from simplemail.partcache import with_part_cache
+
+OUTPUT_KINDS = ["maildir", "mbox", "eml-dir"]
+DEFAULT_SYNC_EVERY = 256
+MBOX_BUFFER_SIZE = 1024 * 1024
+# The files written but not synced yet kept open, at most
+MAX_OPEN_FILES = 512
+
+_CRLF_RE = re.compile(rb"\r\n")
+# mboxrd: the lines starting with "From " behind any number of ">" get one more
+_FROM_RE = re.compile(rb"^(>*From )", re.MULTILINE)
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: OutputWriter
+# The base of the writers of the rendered messages. Like a mailer, it has a "sendmail" method, so
+# it takes the place of the SMTP session
+#
+class OutputWriter(abc.ABC):
+    def __init__(self, path, sync_every=DEFAULT_SYNC_EVERY, signer=None):
+        self.path = os.path.expanduser(path)
+        self.sync_every = sync_every
+        self.signer = signer
+        self.messages = 0
+        self.bytes = 0
+        self.unsynced = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    # -- It writes a message built by "build_message"
+    def sendmail(self, from_addr, to_addrs, msg):
+        if not isinstance(msg, (bytes, bytearray, memoryview)):
+            msg = message_bytes(msg)
+        self.write(from_addr, msg)
+        return {}
+
+    # -- It writes the bytes of a message (with CRLF line endings) and returns its location
+    def write(self, from_addr, data):
+        header = b""
+        if self.signer is not None:
+            with timing.phase("dkim"):
+                header = self.signer.signature(data)
+        with timing.phase("write"):
+            location = self._write(from_addr, header, data)
+        self.messages += 1
+        self.unsynced += 1
+        if self.sync_every and self.unsynced >= self.sync_every:
+            self.sync()
+        return location
+
+    # The header, e.g. the DKIM signature, is written before the message bytes
+    @abc.abstractmethod
+    def _write(self, from_addr, header, data):
+        pass
+
+    # -- It makes the messages written so far durable
+    def sync(self):
+        self.unsynced = 0
+
+    def close(self):
+        self.sync()
+
+
+# -- Class: FilesWriter
+# A writer of one file per message. The files are kept open until they're synced together, then
+# moved to their final name, and their directory is synced once
+#
+class FilesWriter(OutputWriter):
+    def __init__(self, path, sync_every=DEFAULT_SYNC_EVERY, signer=None):
+        super().__init__(path, sync_every, signer)
+        self._pending = []
+        self._names = itertools.count(1)
+        # Unique file names across processes and runs
+        self._start = (int(time.time()), os.getpid())
+
+    def _create(self, tmp, final, *parts):
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        try:
+            for part in parts:
+                view = memoryview(part)
+                while view:
+                    written = os.write(fd, view)
+                    view = view[written:]
+                self.bytes += len(part)
+        except BaseException:
+            os.close(fd)
+            os.unlink(tmp)
+            raise
+        if not self.sync_every:
+            os.close(fd)
+            if tmp != final:
+                os.rename(tmp, final)
+        else:
+            self._pending.append((fd, tmp, final))
+            if len(self._pending) >= MAX_OPEN_FILES:
+                self.sync()
+        return final
+
+    def sync(self):
+        pending, self._pending = self._pending, []
+        directories = set()
+        for fd, tmp, final in pending:
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+            if tmp != final:
+                os.rename(tmp, final)
+            directories.add(os.path.dirname(final))
+        for directory in directories:
+            _sync_dir(directory)
+        super().sync()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            for fd, _, _ in self._pending:
+                os.close(fd)
+            self._pending = []
+
+
+# -- Class: MaildirWriter
+# It delivers the messages to the "new" subdirectory of a Maildir, with LF line endings
+#
+class MaildirWriter(FilesWriter):
+    def __init__(self, path, sync_every=DEFAULT_SYNC_EVERY, signer=None):
+        super().__init__(path, sync_every, signer)
+        for subdir in ("tmp", "new", "cur"):
+            os.makedirs(os.path.join(self.path, subdir), exist_ok=True)
+        self._hostname = socket.gethostname().replace("/", r"\057").replace(":", r"\072")
+
+    def _write(self, from_addr, header, data):
+        name = "%d.P%dQ%d.%s" % (self._start + (next(self._names), self._hostname))
+        tmp = os.path.join(self.path, "tmp", name)
+        final = os.path.join(self.path, "new", name)
+        return self._create(tmp, final, _to_lf(header), _to_lf(data))
+
+
+# -- Class: EMLDirWriter
+# It writes each message to a numbered ".eml" file of a directory, with CRLF line endings
+#
+class EMLDirWriter(FilesWriter):
+    def __init__(self, path, sync_every=DEFAULT_SYNC_EVERY, signer=None):
+        super().__init__(path, sync_every, signer)
+        os.makedirs(self.path, exist_ok=True)
+
+    def _write(self, from_addr, header, data):
+        path = os.path.join(self.path, "%d.P%d.%06d.eml" % (self._start + (next(self._names),)))
+        return self._create(path, path, header, data)
+
+
+# -- Class: MboxWriter
+# It appends the messages to an mbox file (mboxrd), each one after a "From sender date" line, with
+# LF line endings
+#
+class MboxWriter(OutputWriter):
+    def __init__(self, path, sync_every=DEFAULT_SYNC_EVERY, signer=None):
+        super().__init__(path, sync_every, signer)
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "ab", buffering=MBOX_BUFFER_SIZE)
+
+    def _write(self, from_addr, header, data):
+        sender = parseaddr(from_addr or "")[1] or "MAILER-DAEMON"
+        separator = b"From %s %s\n" % (
+            sender.encode("ascii", "replace"),
+            time.asctime(time.gmtime()).encode("ascii"),
+        )
+        body = _FROM_RE.sub(rb">\1", _to_lf(data))
+        # A blank line ends each message
+        end = b"\n" if body.endswith(b"\n") else b"\n\n"
+        header = _to_lf(header)
+        self._file.write(separator)
+        self._file.write(header)
+        self._file.write(body)
+        self._file.write(end)
+        self.bytes += len(separator) + len(header) + len(body) + len(end)
+        return self.path
+
+    def sync(self):
+        self._file.flush()
+        if self.unsynced:
+            os.fsync(self._file.fileno())
+        super().sync()
+
+    def close(self):
+        if self._file.closed:
+            return
+        try:
+            if self.sync_every:
+                self.sync()
+        finally:
+            self._file.close()
+
+
+WRITERS = {"maildir": MaildirWriter, "mbox": MboxWriter, "eml-dir": EMLDirWriter}
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: parse_output
+# It splits an output target ("KIND:PATH") into its kind and its path
+#
+def parse_output(target):
+    kind, sep, path = target.partition(":")
+    if not sep or kind not in OUTPUT_KINDS or not path:
+        kinds = "/".join(OUTPUT_KINDS)
+        raise ValueError('Invalid output "%s": expected %s followed by ":PATH"' % (target, kinds))
+    return kind, path
+
+
+# -- Function: open_output
+# It returns the writer of the "--output" target of the options
+#
+def open_output(options):
+    kind, path = parse_output(options.output)
+    sync_every = getattr(options, "output_sync", None)
+    if sync_every is None:
+        sync_every = DEFAULT_SYNC_EVERY
+    signer = None
+    if getattr(options, "dkim_domain", None):
+        from simplemail import dkim
+
+        signer = dkim.signer(options)
+    return WRITERS[kind](path, sync_every, signer)
+
+
+# -- Function: render_email
+# It builds the message of the options and writes it to the output. It returns 0 when the message
+# was written successfully and 1 otherwise
+#
+def render_email(options):
+    with message_context():
+        try:
+            with open_output(options) as writer, timing.measure():
+                with timing.phase("build"):
+                    msg = build_message(options)
+                location = writer.write(msg["From"], message_bytes(msg))
+            logging.info('Email to "%s" rendered to: %s', msg["To"], location)
+        except Exception as e:
+            logging.error('Failed to render the e-mail:  "%s"', e)
+            return 1
+    return 0
+
+
+# -- Function: render_job
+# It builds the message of one job and writes it. It returns whether it was written or not
+#
+def render_job(writer, options, index, job):
+    with message_context():
+        try:
+            with timing.measure():
+                with timing.phase("build"):
+                    job_opts = job_options(options, job)
+                    msg = build_message(job_opts)
+                    data = message_bytes(msg)
+                location = writer.write(msg["From"], data)
+            logging.debug('Email #%d to "%s" rendered to: %s', index, msg["To"], location)
+        except Exception as e:
+            logging.error('Failed to render the e-mail request #%d:  "%s"', index, e)
+            return False
+    return True
+
+
+# -- Function: render_jobs
+# It builds the messages of the jobs and writes them to the output, in order. With more than one
+# process the messages are built by worker processes. It returns 0 when all messages were
+# written successfully and 1 otherwise
+#
+def render_jobs(options, jobs, processes=1):
+    start = time.perf_counter()
+    with open_output(options) as writer:
+        if processes > 1:
+            rendered, failed, build_time = _render_multiprocess(writer, options, jobs, processes)
+        else:
+            options = with_part_cache(options)
+            rendered = failed = 0
+            for index, job in enumerate(jobs, 1):
+                if render_job(writer, options, index, job):
+                    rendered += 1
+                else:
+                    failed += 1
+            build_time = None
+    elapsed = time.perf_counter() - start
+    logging.info(
+        "Rendering finished: %d rendered, %d failed, %.1f MB in %.2fs (%.0f messages/s)",
+        rendered,
+        failed,
+        writer.bytes / 1024.0 / 1024.0,
+        elapsed,
+        rendered / elapsed if elapsed else 0,
+    )
+    if build_time is not None and rendered:
+        logging.info("Build time per message in the workers: %.2f ms", build_time / rendered * 1000)
+    return 1 if failed else 0
+
+
+# Builds the messages with worker processes, bounding the messages built but not written yet, and
+# writes them in the order of the jobs
+def _render_multiprocess(writer, options, jobs, processes):
+    from concurrent.futures import ProcessPoolExecutor
+
+    from simplemail.processes import build_job, init_worker, portable_options
+
+    rendered = failed = 0
+    build_time = 0.0
+    pending = collections.deque()
+
+    def _write_next():
+        index, future = pending.popleft()
+        with message_context():
+            try:
+                with timing.measure():
+                    built = future.result()
+                    timing.add_phase("build", built.build_time)
+                    writer.write(built.sender, built.take())
+                return True, built.build_time
+            except Exception as e:
+                logging.error('Failed to render the e-mail request #%d:  "%s"', index, e)
+                return False, 0.0
+
+    try:
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=init_worker,
+            initargs=(portable_options(options),),
+        ) as builders:
+            for index, job in enumerate(itertools.chain(jobs, [None]), 1):
+                if job is not None:
+                    pending.append((index, builders.submit(build_job, job)))
+                while pending and (job is None or len(pending) > processes * 4):
+                    ok, seconds = _write_next()
+                    rendered += ok
+                    failed += not ok
+                    build_time += seconds
+    finally:
+        # The messages built but not written, e.g. on a write error, must not leak their shared
+        # memory
+        for _, future in pending:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                future.result().release()
+    return rendered, failed, build_time
+
+
+def _to_lf(data):
+    return _CRLF_RE.sub(b"\n", data)
+
+
+def _sync_dir(path):
+    if not hasattr(os, "O_DIRECTORY"):
+        return
+    fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -0,0 +1,150 @@
+# ------------------------------------------ session.py -------------------------------------------
+# A reusable SMTP session for simplemail.
+#
+# It keeps a single authenticated connection open across several messages, resetting the
+# transaction (RSET) between them and reconnecting when the server drops the connection or
+# refuses to accept more messages on it. The messages with more recipients than the server
+# accepts per transaction are sent in several envelopes (see simplemail.envelope).
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import logging
+import smtplib
+import time
+
+from simplemail import protocol, timing
+from simplemail.cli import connect
+from simplemail.envelope import EnvelopeSplitter
+from simplemail.ratelimit import is_throttled
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: SMTPSession
+# An authenticated SMTP connection which is reused to deliver many messages.
+#
+# The connection is opened on the first message and reopened whenever the server disconnects,
+# replies with 421 or the limit of messages per connection ("max_messages") is reached.
+#
+class SMTPSession:
+    def __init__(self, options, max_messages=0):
+        self.options = options
+        self.max_messages = max_messages
+        # Shared by the sessions of a batch/pool (see simplemail.ratelimit)
+        self.limiter = getattr(options, "rate_limiter", None)
+        # The recipients limit per envelope, learnt by this session when not configured
+        self.envelopes = EnvelopeSplitter(getattr(options, "max_recipients", None) or 0)
+        # The DKIM signer, shared by the sessions of the process (see simplemail.dkim)
+        self.signer = None
+        if getattr(options, "dkim_domain", None):
+            from simplemail import dkim
+
+            self.signer = dkim.signer(options)
+        self.server = None
+        self.sent = 0
+        self.connections = 0
+        self.last_used = time.monotonic()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def connect(self):
+        self.server = connect(self.options)
+        self.sent = 0
+        self.connections += 1
+        return self.server
+
+    def close(self):
+        if self.server is None:
+            return
+        try:
+            self.server.quit()
+        except (smtplib.SMTPException, OSError):
+            self.server.close()
+        self.server = None
+
+    def drop(self):
+        if self.server is None:
+            return
+        try:
+            self.server.close()
+        except OSError:
+            pass
+        self.server = None
+
+    # Health check of the current connection (NOOP)
+    def check(self):
+        if self.server is None:
+            return False
+        try:
+            return self.server.noop()[0] == 250
+        except (smtplib.SMTPException, OSError):
+            return False
+
+    # It sends the message within the rate limits, retrying it more slowly while the server
+    # replies with temporary errors. Each envelope is limited and retried on its own
+    def sendmail(self, from_addr, to_addrs, msg):
+        with timing.measure():
+            return self.envelopes.sendmail(self._sendmail_limited, from_addr, to_addrs, msg)
+
+    def _sendmail_limited(self, from_addr, to_addrs, msg):
+        if self.limiter is None:
+            return self._sendmail_reconnecting(from_addr, to_addrs, msg)
+        for attempt in range(self.limiter.max_retries + 1):
+            with timing.phase("wait"):
+                self.limiter.wait(len(to_addrs))
+            try:
+                refused = self._sendmail_reconnecting(from_addr, to_addrs, msg)
+            except smtplib.SMTPException as e:
+                if not is_throttled(e) or attempt == self.limiter.max_retries:
+                    raise
+                logging.warning('Temporary error: "%s" - retrying more slowly', e)
+                self.limiter.throttle()
+                continue
+            # The recipients over the limit of the envelope are not a sign of throttling
+            codes = [
+                code for code, _ in (refused or {}).values() if code != protocol.TOO_MANY_RECIPIENTS
+            ]
+            if any(400 <= code < 500 for code in codes):
+                self.limiter.throttle()
+            else:
+                self.limiter.accepted()
+            return refused
+
+    def _sendmail_reconnecting(self, from_addr, to_addrs, msg):
+        # Only a connection already open is retried: a failed first connection is an error
+        if self.server is None:
+            self.connect()
+            return self._sendmail(from_addr, to_addrs, msg)
+        try:
+            return self._sendmail(from_addr, to_addrs, msg)
+        except (smtplib.SMTPServerDisconnected, ConnectionError) as e:
+            logging.warning('Connection with server lost: "%s" - reconnecting', e)
+        except smtplib.SMTPResponseException as e:
+            if e.smtp_code != protocol.SERVICE_NOT_AVAILABLE:
+                raise
+            logging.warning('Server closed the session: "%s" - reconnecting', e)
+        except smtplib.SMTPRecipientsRefused as e:
+            if any(code != protocol.SERVICE_NOT_AVAILABLE for code, _ in e.recipients.values()):
+                raise
+            logging.warning("Server closed the session while refusing recipients - reconnecting")
+        self.drop()
+        return self._sendmail(from_addr, to_addrs, msg)
+
+    def _sendmail(self, from_addr, to_addrs, msg):
+        if self.server is None:
+            self.connect()
+        elif self.sent:
+            with timing.phase("rset"):
+                self.server.rset()
+        refused = protocol.sendmail(self.server, from_addr, to_addrs, msg, signer=self.signer)
+        self.sent += 1
+        self.last_used = time.monotonic()
+        if self.max_messages and self.sent >= self.max_messages:
+            logging.debug("Reached %d messages on this connection - closing it", self.sent)
+            with timing.phase("quit"):
+                self.close()
+        return refused
@@ -0,0 +1,303 @@
+# -------------------------------------------- sink.py --------------------------------------------
+# A minimal in-process SMTP server for simplemail's tests and benchmarks.
+#
+# It accepts (or refuses) the messages like a relay would, with configurable extensions, reply
+# latency, a limit of messages per session, a limit of recipients per transaction (452) and TLS,
+# either STARTTLS or implicit TLS. The recipients starting with "reject" are refused with 550 and
+# the ones starting with "defer" with 451.
+#
+# The TLS certificate is a self-signed one for "localhost", generated once per process in a
+# temporary directory (see "sink_certificate") with the "cryptography" package or, without it,
+# the "openssl" command. It's only meant for local testing.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import atexit
+import base64
+import datetime
+import ipaddress
+import os
+import shutil
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+
+TLS_MODES = [None, "starttls", "ssl"]
+CERT_HOSTNAME = "localhost"
+CERT_ADDRESS = "127.0.0.1"
+
+# The certificate generated by "sink_certificate"
+_certificate = None
+_certificate_lock = threading.Lock()
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+class _Handler(socketserver.StreamRequestHandler):
+    # The replies are written line by line: do not wait for the ACKs of the previous ones
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.do_handshake()
+        super().setup()
+        self.sink = self.server.sink
+        self.mail_from = None
+        self.rcpts = []
+        self.chunks = []
+        self.messages = 0
+
+    def reply(self, line):
+        self.wfile.write(line.encode("ascii") + b"\r\n")
+
+    def handle(self):
+        with self.sink.lock:
+            self.sink.connections += 1
+        self.reply("220 sink ESMTP ready")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("ascii").rstrip("\r\n")
+            with self.sink.lock:
+                self.sink.commands.append(command)
+            verb = command.split(" ", 1)[0].upper()
+            handler = getattr(self, "smtp_" + verb, None)
+            if handler is None:
+                self.reply("502 command not implemented")
+            elif handler(command.partition(" ")[2]) is False:
+                return
+
+    def smtp_EHLO(self, arg):
+        lines = ["sink"] + list(self.sink.extensions)
+        if self.sink.tls == "starttls" and not isinstance(self.request, ssl.SSLSocket):
+            lines.append("STARTTLS")
+        for line in lines[:-1]:
+            self.reply("250-" + line)
+        self.reply("250 " + lines[-1])
+
+    def smtp_HELO(self, arg):
+        self.reply("250 sink")
+
+    def smtp_STARTTLS(self, arg):
+        if self.sink.tls != "starttls" or isinstance(self.request, ssl.SSLSocket):
+            self.reply("502 command not implemented")
+            return
+        self.reply("220 ready to start TLS")
+        self.request = self.sink.context.wrap_socket(self.request, server_side=True)
+        self.rfile = self.request.makefile("rb")
+        self.wfile = self.request.makefile("wb", buffering=0)
+        self.mail_from, self.rcpts, self.chunks = None, [], []
+
+    def smtp_AUTH(self, arg):
+        mechanism = arg.split(" ", 1)[0].upper()
+        if mechanism == "LOGIN":
+            self.reply("334 " + base64.b64encode(b"Username:").decode())
+            self.rfile.readline()
+            self.reply("334 " + base64.b64encode(b"Password:").decode())
+            self.rfile.readline()
+        self.reply("235 authenticated")
+
+    def smtp_MAIL(self, arg):
+        if self.sink.max_messages and self.messages >= self.sink.max_messages:
+            self.reply("421 too many messages in this session")
+            return False
+        self.mail_from = arg.split(":", 1)[1].strip().strip("<>").split(">")[0]
+        self.rcpts, self.chunks = [], []
+        self.reply("250 OK")
+
+    def smtp_RCPT(self, arg):
+        rcpt = arg.split(":", 1)[1].strip().strip("<>").split(">")[0]
+        if rcpt.startswith("reject"):
+            self.reply("550 no such user")
+        elif rcpt.startswith("defer"):
+            self.reply("451 4.7.1 try again later")
+        elif self.sink.max_recipients and len(self.rcpts) >= self.sink.max_recipients:
+            self.reply("452 4.5.3 too many recipients")
+        else:
+            self.rcpts.append(rcpt)
+            self.reply("250 OK")
+
+    def smtp_DATA(self, arg):
+        if not self.rcpts:
+            self.reply("554 no valid recipients")
+            return
+        self.reply("354 end data with <CR><LF>.<CR><LF>")
+        lines = []
+        while True:
+            line = self.rfile.readline()
+            if line in (b".\r\n", b""):
+                break
+            lines.append(line[1:] if line.startswith(b".") else line)
+        self._deliver(b"".join(lines))
+
+    def smtp_BDAT(self, arg):
+        size, _, last = arg.partition(" ")
+        self.chunks.append(self.rfile.read(int(size)))
+        if not self.rcpts:
+            self.reply("554 no valid recipients")
+        elif last.upper() == "LAST":
+            self._deliver(b"".join(self.chunks))
+        else:
+            self.reply("250 %s octets received" % size)
+
+    def _deliver(self, data):
+        if self.sink.latency:
+            threading.Event().wait(self.sink.latency)
+        with self.sink.lock:
+            self.sink.received += 1
+            if self.sink.keep_messages:
+                self.sink.messages.append((self.mail_from, list(self.rcpts), data))
+        self.messages += 1
+        self.mail_from, self.rcpts, self.chunks = None, [], []
+        self.reply("250 OK queued")
+
+    def smtp_RSET(self, arg):
+        self.mail_from, self.rcpts, self.chunks = None, [], []
+        self.reply("250 OK")
+
+    def smtp_NOOP(self, arg):
+        self.reply("250 OK")
+
+    def smtp_QUIT(self, arg):
+        self.reply("221 bye")
+        return False
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def get_request(self):
+        sock, address = super().get_request()
+        if self.sink.tls == "ssl":
+            # The handshake is done by the handler thread, not to block the other connections
+            sock = self.sink.context.wrap_socket(
+                sock, server_side=True, do_handshake_on_connect=False
+            )
+        return sock, address
+
+
+# -- Class: SMTPSink
+# The SMTP server, listening on a random local port while used as a context manager. With
+# "keep_messages=False" the messages are only counted (received), e.g. for benchmarks
+#
+class SMTPSink:
+    def __init__(
+        self,
+        extensions=("AUTH PLAIN LOGIN",),
+        latency=0,
+        max_messages=0,
+        tls=None,
+        certfile=None,
+        keep_messages=True,
+        max_recipients=0,
+    ):
+        if tls not in TLS_MODES:
+            raise ValueError("Unknown TLS mode: %s" % tls)
+        self.extensions = extensions
+        self.latency = latency
+        self.max_messages = max_messages
+        self.max_recipients = max_recipients
+        self.tls = tls
+        self.keep_messages = keep_messages
+        self.context = None
+        if tls:
+            self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.context.load_cert_chain(certfile or sink_certificate())
+        self.lock = threading.Lock()
+        self.messages = []
+        self.commands = []
+        self.connections = 0
+        self.received = 0
+        self._server = _Server(("127.0.0.1", 0), _Handler)
+        self._server.sink = self
+
+    @property
+    def address(self):
+        return "%s:%d" % self._server.server_address
+
+    def __enter__(self):
+        threading.Thread(target=self._server.serve_forever, args=(0.05,), daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: sink_certificate
+# The path of the PEM file with the self-signed certificate of the sink and its private key. It's
+# generated on the first call and removed when the process exits
+#
+def sink_certificate():
+    global _certificate
+
+    with _certificate_lock:
+        if _certificate is None:
+            directory = tempfile.mkdtemp(prefix="simplemail-sink-")
+            atexit.register(shutil.rmtree, directory, True)
+            path = os.path.join(directory, "sink.pem")
+            try:
+                data = _generate_with_cryptography()
+            except ImportError:
+                data = _generate_with_openssl(directory)
+            fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            _certificate = path
+    return _certificate
+
+
+def _generate_with_cryptography():
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import ec
+    from cryptography.x509.oid import NameOID
+
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, CERT_HOSTNAME)])
+    now = datetime.datetime.now(datetime.timezone.utc)
+    alt_names = [x509.DNSName(CERT_HOSTNAME), x509.IPAddress(ipaddress.ip_address(CERT_ADDRESS))]
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=30))
+        .add_extension(x509.SubjectAlternativeName(alt_names), critical=False)
+        .add_extension(x509.BasicConstraints(ca=True, path_length=None), critical=True)
+        .sign(key, hashes.SHA256())
+    )
+    return certificate.public_bytes(serialization.Encoding.PEM) + key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption(),
+    )
+
+
+def _generate_with_openssl(directory):
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    command = [
+        "openssl", "req", "-x509", "-nodes", "-days", "30",
+        "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+        "-subj", "/CN=%s" % CERT_HOSTNAME,
+        "-addext", "subjectAltName=DNS:%s,IP:%s" % (CERT_HOSTNAME, CERT_ADDRESS),
+        "-keyout", key, "-out", cert,
+    ]  # fmt: skip
+    try:
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise RuntimeError(
+            "The TLS sink requires the cryptography package or the openssl command: %s" % e
+        )
+    with open(cert, "rb") as f, open(key, "rb") as k:
+        data = f.read() + k.read()
+    os.unlink(cert)
+    os.unlink(key)
+    return data
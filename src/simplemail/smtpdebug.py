@@ -0,0 +1,57 @@
+# ------------------------------------------ smtpdebug.py -----------------------------------------
+# SMTP debug output of simplemail.
+#
+# The commands sent and the replies received are logged as DEBUG records of the "simplemail.smtp"
+# logger, instead of being printed to the standard error as the debug level of smtplib does. So
+# they go through the redaction of the SMTP password and the AUTH credentials (see logs). This
+# module is only imported with "--smtp-debug true".
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import logging
+import smtplib
+
+SMTP_LOGGER = "simplemail.smtp"
+
+# The logger of the SMTP debug output (see "SMTPDebugLogging")
+_smtp_logger = logging.getLogger(SMTP_LOGGER)
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: SMTPDebugLogging
+# A mixin for "smtplib.SMTP" logging the commands sent and the replies received as DEBUG records of
+# the "simplemail.smtp" logger
+#
+class SMTPDebugLogging:
+    def send(self, s):
+        _smtp_logger.debug("SMTP send: %r", s)
+        super().send(s)
+
+    def getreply(self):
+        code, msg = super().getreply()
+        _smtp_logger.debug("SMTP reply: %d %r", code, msg)
+        return code, msg
+
+
+# -- Class: DebugSMTP
+# An "smtplib.SMTP" connection with its commands and replies logged (see "SMTPDebugLogging")
+#
+class DebugSMTP(SMTPDebugLogging, smtplib.SMTP):
+    pass
+
+
+# -- Class: DebugSMTP_SSL
+# An "smtplib.SMTP_SSL" connection with its commands and replies logged (see "SMTPDebugLogging")
+#
+class DebugSMTP_SSL(SMTPDebugLogging, smtplib.SMTP_SSL):
+    pass
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: enable_smtp_debug
+# It logs the SMTP debug output of the "DebugSMTP" connections, even when the level of the root
+# logger is higher than DEBUG (e.g. with "--smtp-debug true" and the default INFO level)
+#
+def enable_smtp_debug():
+    _smtp_logger.setLevel(logging.DEBUG)
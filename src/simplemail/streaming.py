@@ -0,0 +1,175 @@
+# ------------------------------------------ streaming.py -----------------------------------------
+# Streaming MIME generation for simplemail.
+#
+# The headers and the message body are built with the "email" package, as in "build_message", but
+# the attachments are read in chunks, base64 encoded incrementally and written straight into the
+# SMTP DATA stream. The memory used is bounded by the chunk size no matter how big the attachments
+# are. The attachments can optionally be memory-mapped instead of read.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import base64
+import copy
+import mmap
+import os
+import sys
+from email import policy
+from email.mime.base import MIMEBase
+from os.path import basename
+
+from simplemail.cli import body_from_stdin, build_message
+from simplemail.protocol import CRLF, stuff_lines
+
+# Input bytes per chunk: a multiple of 57, so each chunk is encoded in complete 76 chars lines
+CHUNK_SIZE = 57 * 4096
+LINE_INPUT = 57
+SMTP_POLICY = policy.compat32.clone(linesep="\r\n")
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: encoded_size
+# The size of a file with "size" bytes once base64 encoded in lines of 76 chars with CRLF
+#
+def encoded_size(size):
+    lines, rest = divmod(size, LINE_INPUT)
+    return lines * 78 + ((rest + 2) // 3 * 4 + 2 if rest else 0)
+
+
+# -- Function: iter_base64
+# It yields the base64 encoded content of a file, in lines of 76 chars terminated by CRLF, one
+# chunk at time
+#
+def iter_base64(path, chunk_size=CHUNK_SIZE, use_mmap=False):
+    chunk_size -= chunk_size % LINE_INPUT
+    with open(path, "rb") as f:
+        if use_mmap and os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for start in range(0, len(view), chunk_size):
+                        end = start + chunk_size
+                        yield _encode_chunk(view[start:end])
+                finally:
+                    view.release()
+            return
+        for chunk in iter_base64_stream(f, chunk_size):
+            yield chunk
+
+
+# -- Function: iter_base64_stream
+# The same as "iter_base64" for a binary stream, e.g. a pipe. The chunks are filled up before being
+# encoded, as a pipe may return less bytes than requested
+#
+def iter_base64_stream(stream, chunk_size=CHUNK_SIZE):
+    chunk_size -= chunk_size % LINE_INPUT
+    chunk = b""
+    while True:
+        data = stream.read(chunk_size - len(chunk))
+        if data:
+            chunk += data
+            if len(chunk) < chunk_size:
+                continue
+        if chunk:
+            yield _encode_chunk(chunk)
+        if not data:
+            return
+        chunk = b""
+
+
+def _encode_chunk(chunk):
+    return base64.encodebytes(chunk).replace(b"\n", CRLF)
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: StreamingMessage
+# A message whose attachments are streamed from disk. It can be sent with "protocol.sendmail" and
+# its headers are available as in the MIME message, e.g. msg["From"].
+#
+# With "-m -" the body is streamed from the standard input too, base64 encoded as it's read, so its
+# size isn't known in advance
+#
+class StreamingMessage:
+    def __init__(self, options, chunk_size=CHUNK_SIZE, use_mmap=False):
+        self.chunk_size = chunk_size
+        self.use_mmap = use_mmap
+        self.files = list(options.file or [])
+        self.stdin_body = body_from_stdin(options)
+        self.stdin_read = False
+        if self.stdin_body:
+            # The input is read while sending. The recipients are normalized in the options of the
+            # caller, as done by "build_message"
+            options.cc, options.bcc = options.cc or [], options.bcc or []
+            options = copy.copy(options)
+            options.body = []
+        self.msg = build_message(options, attach_files=False)
+        if self.stdin_body:
+            # The body part without content, which is written after its headers
+            body = MIMEBase("text", options.content_type.replace("text/", ""))
+            body.set_param("charset", options.charset)
+            body["Content-Transfer-Encoding"] = "base64"
+            self.msg.set_payload([body])
+
+        # The message with just the body ends with the closing boundary, which is written again
+        # after the streamed attachments
+        content = self.msg.as_bytes(policy=SMTP_POLICY)
+        self.boundary = self.msg.get_boundary().encode("ascii")
+        closing = CRLF + b"--" + self.boundary + b"--" + CRLF
+        # Without dot-stuffing for the DKIM signature, see "signature"
+        self.raw_head = content[: -len(closing)]
+        self.raw_parts = [self._part_header(f) for f in self.files]
+        self.head = stuff_lines(self.raw_head)
+        self.parts = [stuff_lines(header) for header in self.raw_parts]
+
+    def __getitem__(self, name):
+        return self.msg[name]
+
+    def _part_header(self, path):
+        part = MIMEBase("application", "octet-stream", Name=basename(path))
+        part["Content-Transfer-Encoding"] = "base64"
+        part["Content-Disposition"] = 'attachment; filename="%s"' % basename(path)
+        header = part.as_bytes(policy=SMTP_POLICY)
+        return CRLF + b"--" + self.boundary + CRLF + header
+
+    # -- The size of the message content (dot-stuffed), as declared in the SIZE extension. It's
+    # None when the body is read from the standard input
+    def size(self):
+        if self.stdin_body:
+            # Checked before the envelope, e.g. when the recipients are split in many envelopes
+            if self.stdin_read:
+                raise ValueError("The body read from the standard input can only be sent once")
+            return None
+        size = len(self.head) + len(self.boundary) + 8
+        for header, path in zip(self.parts, self.files):
+            size += len(header) + encoded_size(os.path.getsize(path))
+        return size
+
+    # -- The DKIM-Signature header of the message (see simplemail.dkim). The attachments are read
+    # once more to hash the body, as the signature must be sent before the message
+    def signature(self, signer):
+        if self.stdin_body:
+            raise ValueError("The body read from the standard input can't be signed with DKIM")
+        end = self.raw_head.index(CRLF + CRLF) + len(CRLF)
+        return signer.sign(self.raw_head[:end], self._iter_body(end + len(CRLF)))
+
+    # It yields the message body without dot-stuffing, from the "start" offset of the head
+    def _iter_body(self, start):
+        yield memoryview(self.raw_head)[start:]
+        for header, path in zip(self.raw_parts, self.files):
+            yield header
+            for chunk in iter_base64(path, self.chunk_size, self.use_mmap):
+                yield chunk
+        yield CRLF + b"--" + self.boundary + b"--" + CRLF
+
+    # -- It yields the dot-stuffed message content, including the final "." line
+    def iter_chunks(self):
+        yield self.head
+        if self.stdin_body:
+            self.stdin_read = True
+            for chunk in iter_base64_stream(sys.stdin.buffer, self.chunk_size):
+                yield chunk
+        for header, path in zip(self.parts, self.files):
+            yield header
+            for chunk in iter_base64(path, self.chunk_size, self.use_mmap):
+                yield chunk
+        yield CRLF + b"--" + self.boundary + b"--" + CRLF + b"." + CRLF
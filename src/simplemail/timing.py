@@ -0,0 +1,302 @@
+# ------------------------------------------- timing.py -------------------------------------------
+# Per-phase timings of the SMTP deliveries for simplemail.
+#
+# Every delivery of a message is split in phases, measured with a monotonic clock:
+#     - build: The generation of the MIME message and its bytes
+#     - wait: The delay imposed by the rate limits (see simplemail.ratelimit)
+#     - dns: The lookup of the mail exchangers (--direct)
+#     - connect: The TCP connection, including the name resolution and the implicit TLS (SSL)
+#     - tls: The STARTTLS handshake
+#     - auth: The login
+#     - rset: The reset of a reused connection
+#     - envelope: MAIL FROM, RCPT TO and DATA. When the server supports neither PIPELINING nor
+#       CHUNKING the envelope is sent by "smtplib" and measured within "data"
+#     - data: The message content, until the server accepts it
+#     - quit: The end of the connection
+#     - broker: The hand-off to the broker (see simplemail.broker)
+# The connection phases only appear in the deliveries which opened a connection.
+#
+# The timings of each delivery, with the bytes and recipients sent, are logged with the DEBUG
+# level and passed to the hooks registered with "add_hook", e.g. the Prometheus and StatsD
+# exporters below. Without hooks or DEBUG logging nothing is measured.
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import contextlib
+import contextvars
+import logging
+import os
+import threading
+import time
+
+# The callables receiving the Timings of each delivery
+HOOKS = []
+# The upper bounds (seconds) of the Prometheus histogram of the delivery times
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]
+STATSD_PORT = 8125
+
+_current = contextvars.ContextVar("simplemail_timings", default=None)
+_NULL = contextlib.nullcontext()
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: Timings
+# The phases (name: seconds, in order of appearance), bytes and recipients of a delivery
+#
+class Timings:
+    def __init__(self):
+        self.phases = {}
+        self.bytes = 0
+        self.recipients = 0
+        self.ok = True
+        self.error = None
+        self.total = 0.0
+
+    def as_dict(self):
+        return {
+            "phases": dict(self.phases),
+            "bytes": self.bytes,
+            "recipients": self.recipients,
+            "ok": self.ok,
+            "error": self.error,
+            "total": self.total,
+        }
+
+    def __str__(self):
+        phases = ", ".join("%s %.2fms" % (name, s * 1000) for name, s in self.phases.items())
+        return "%s | total %.2fms | %d bytes to %d recipient(s)%s" % (
+            phases or "no phases",
+            self.total * 1000,
+            self.bytes,
+            self.recipients,
+            "" if self.ok else " | failed: %s" % self.error,
+        )
+
+
+class _Phase:
+    __slots__ = ("timings", "name", "start")
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        phases = self.timings.phases
+        phases[self.name] = phases.get(self.name, 0.0) + time.perf_counter() - self.start
+
+
+class _Measure:
+    def __init__(self):
+        self.timings = Timings()
+
+    def __enter__(self):
+        self.token = _current.set(self.timings)
+        self.start = time.perf_counter()
+        return self.timings
+
+    def __exit__(self, exc_type, exc, tb):
+        self.timings.total = time.perf_counter() - self.start
+        _current.reset(self.token)
+        if exc is not None:
+            self.timings.ok = False
+            self.timings.error = str(exc) or exc_type.__name__
+        report(self.timings)
+
+
+# -- Class: PrometheusExporter
+# A hook which writes the metrics of the deliveries to a file in the Prometheus text format, e.g.
+# for the textfile collector of the node exporter. The file is replaced atomically at most once
+# every "interval" seconds, and on "flush"
+#
+class PrometheusExporter:
+    def __init__(self, path, interval=1.0):
+        self.path = path
+        self.interval = interval
+        self.phases = {}
+        self.messages = {"sent": 0, "failed": 0}
+        self.bytes = 0
+        self.recipients = 0
+        self.buckets = [0] * len(BUCKETS)
+        self.seconds = 0.0
+        self._written = 0.0
+        self._lock = threading.Lock()
+
+    def __call__(self, timings):
+        with self._lock:
+            for name, seconds in timings.phases.items():
+                total, count = self.phases.get(name, (0.0, 0))
+                self.phases[name] = (total + seconds, count + 1)
+            self.messages["sent" if timings.ok else "failed"] += 1
+            self.bytes += timings.bytes
+            self.recipients += timings.recipients
+            self.seconds += timings.total
+            for i, bound in enumerate(BUCKETS):
+                if timings.total <= bound:
+                    self.buckets[i] += 1
+            due = time.monotonic() - self._written >= self.interval
+        if due:
+            self.flush()
+
+    def render(self):
+        lines = [
+            "# HELP simplemail_phase_seconds Time spent in each phase of the SMTP deliveries.",
+            "# TYPE simplemail_phase_seconds summary",
+        ]
+        for name, (total, count) in self.phases.items():
+            lines.append('simplemail_phase_seconds_sum{phase="%s"} %.6f' % (name, total))
+            lines.append('simplemail_phase_seconds_count{phase="%s"} %d' % (name, count))
+        lines += [
+            "# HELP simplemail_delivery_seconds Time spent delivering each message.",
+            "# TYPE simplemail_delivery_seconds histogram",
+        ]
+        for bound, count in zip(BUCKETS, self.buckets):
+            lines.append('simplemail_delivery_seconds_bucket{le="%g"} %d' % (bound, count))
+        count = sum(self.messages.values())
+        lines.append('simplemail_delivery_seconds_bucket{le="+Inf"} %d' % count)
+        lines.append("simplemail_delivery_seconds_sum %.6f" % self.seconds)
+        lines.append("simplemail_delivery_seconds_count %d" % count)
+        lines += [
+            "# HELP simplemail_messages_total Messages delivered, by result.",
+            "# TYPE simplemail_messages_total counter",
+        ]
+        for result, count in self.messages.items():
+            lines.append('simplemail_messages_total{result="%s"} %d' % (result, count))
+        lines += [
+            "# HELP simplemail_bytes_total Message bytes sent.",
+            "# TYPE simplemail_bytes_total counter",
+            "simplemail_bytes_total %d" % self.bytes,
+            "# HELP simplemail_recipients_total Recipients sent.",
+            "# TYPE simplemail_recipients_total counter",
+            "simplemail_recipients_total %d" % self.recipients,
+        ]
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        with self._lock:
+            text = self.render()
+            self._written = time.monotonic()
+            tmp = "%s.%d.tmp" % (self.path, os.getpid())
+            try:
+                with open(tmp, "w") as f:
+                    f.write(text)
+                os.replace(tmp, self.path)
+            except OSError as e:
+                logging.warning('Failed to write the metrics file "%s": %s', self.path, e)
+
+
+# -- Class: StatsDExporter
+# A hook which sends the metrics of each delivery to a StatsD server over UDP, in one datagram
+#
+class StatsDExporter:
+    def __init__(self, address="127.0.0.1", prefix="simplemail"):
+        import socket
+
+        host, _, port = address.rpartition(":") if ":" in address else (address, "", "")
+        self.address = (host, int(port) if port else STATSD_PORT)
+        self.prefix = prefix
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def __call__(self, timings):
+        lines = [
+            "%s.phase.%s:%.3f|ms" % (self.prefix, k, v * 1000) for k, v in timings.phases.items()
+        ]
+        lines.append("%s.delivery:%.3f|ms" % (self.prefix, timings.total * 1000))
+        lines.append("%s.messages.%s:1|c" % (self.prefix, "sent" if timings.ok else "failed"))
+        lines.append("%s.bytes:%d|c" % (self.prefix, timings.bytes))
+        lines.append("%s.recipients:%d|c" % (self.prefix, timings.recipients))
+        try:
+            self.sock.sendto("\n".join(lines).encode("ascii"), self.address)
+        except OSError as e:
+            logging.debug("Failed to send the metrics to StatsD: %s", e)
+
+    def flush(self):
+        pass
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: add_hook
+# It registers a callable receiving the Timings of every delivery
+#
+def add_hook(hook):
+    HOOKS.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    if hook in HOOKS:
+        HOOKS.remove(hook)
+
+
+# -- Function: measure
+# A context manager measuring one delivery. It yields its Timings, or None when nothing is
+# measured (no hooks nor DEBUG logging) or when it's nested within another delivery
+#
+def measure():
+    if _current.get() is not None:
+        return _NULL
+    if not HOOKS and not logging.root.isEnabledFor(logging.DEBUG):
+        return _NULL
+    return _Measure()
+
+
+# -- Function: phase
+# A context manager adding the time spent within it to a phase of the current delivery
+#
+def phase(name):
+    timings = _current.get()
+    if timings is None:
+        return _NULL
+    return _Phase(timings, name)
+
+
+# -- Function: add_phase
+# It adds the time of a phase measured elsewhere, e.g. in another process, to the current delivery
+#
+def add_phase(name, seconds):
+    timings = _current.get()
+    if timings is not None:
+        timings.phases[name] = timings.phases.get(name, 0.0) + seconds
+
+
+# -- Function: count
+# It adds the bytes and recipients sent to the current delivery
+#
+def count(size=0, recipients=0):
+    timings = _current.get()
+    if timings is not None:
+        timings.bytes += size
+        timings.recipients += recipients
+
+
+# -- Function: report
+# It logs the timings of a delivery and passes them to the hooks
+#
+def report(timings):
+    logging.debug("Timings: %s", timings)
+    for hook in list(HOOKS):
+        try:
+            hook(timings)
+        except Exception as e:
+            logging.warning("Timing hook %r failed: %s", hook, e)
+
+
+# -- Function: install_exporters
+# It registers the exporters requested by the options (--metrics-file, --statsd), which are
+# flushed when the process exits
+#
+def install_exporters(options):
+    import atexit
+
+    exporters = []
+    if getattr(options, "metrics_file", None):
+        exporters.append(PrometheusExporter(options.metrics_file))
+    if getattr(options, "statsd", None):
+        exporters.append(StatsDExporter(options.statsd))
+    for exporter in exporters:
+        add_hook(exporter)
+        atexit.register(exporter.flush)
+    return exporters
@@ -0,0 +1,139 @@
+# -------------------------------------------- tls.py ---------------------------------------------
+# Shared SSL contexts and TLS session resumption for simplemail.
+#
+# A new SSL context per connection loads the CA bundle and forgets the TLS sessions, so every
+# connection pays a full handshake. Instead one context is created per process for each TLS
+# setting (see below) and the TLS session of the last connection with each server is kept, so the
+# next connections (the reconnections of a batch, pool, daemon or broker) resume it with an
+# abbreviated handshake.
+#
+# The settings come from the options (or the [SMTP] section of the configuration file):
+#     - ca_file (CAFile): The CA certificates used to verify the server. Without it the server
+#       certificate isn't verified, as smtplib does by default, and no CA bundle is loaded
+#     - client_cert / client_key (ClientCert / ClientKey): The client certificate, in PEM format
+#     - tls_min_version (TLSMinVersion): The minimum TLS version: 1.0, 1.1, 1.2 or 1.3
+#
+# -------------------------------------------------------------------------------------------------
+
+# ------------------------------------------ Imports ----------------------------------------------
+import logging
+import ssl
+import threading
+
+TLS_VERSIONS = {
+    "1.0": ssl.TLSVersion.TLSv1,
+    "1.1": ssl.TLSVersion.TLSv1_1,
+    "1.2": ssl.TLSVersion.TLSv1_2,
+    "1.3": ssl.TLSVersion.TLSv1_3,
+}
+
+# The contexts by settings and the last TLS session by (settings, host, port)
+_contexts = {}
+_sessions = {}
+_lock = threading.Lock()
+
+
+# ------------------------------------------ Classes ----------------------------------------------
+# -- Class: ResumingContext
+# A shared SSL context for the connections with one server, which resumes the last TLS session
+# with it. It can be passed as "context" to smtplib (SMTP_SSL and starttls), which only calls
+# "wrap_socket"
+#
+class ResumingContext:
+    def __init__(self, context, key):
+        self.context = context
+        self.key = key
+        self.sock = None
+
+    def __getattr__(self, name):
+        return getattr(self.context, name)
+
+    def wrap_socket(self, sock, server_hostname=None, **kwargs):
+        with _lock:
+            session = _sessions.get(self.key)
+        try:
+            self.sock = self.context.wrap_socket(
+                sock, server_hostname=server_hostname, session=session, **kwargs
+            )
+        except ValueError:
+            # The session can't be used anymore, e.g. it belongs to a replaced context
+            self.sock = self.context.wrap_socket(sock, server_hostname=server_hostname, **kwargs)
+        if self.sock.session_reused:
+            logging.debug("    - resumed the TLS session")
+        return self.sock
+
+    # -- It keeps the session for the next connections. With TLS 1.3 the session tickets arrive
+    # after the handshake, so it must be called once the server replied over the secure channel
+    def save_session(self):
+        session = self.sock.session if self.sock is not None else None
+        if session is not None:
+            with _lock:
+                _sessions[self.key] = session
+
+
+# ----------------------------------------- Functions ---------------------------------------------
+# -- Function: tls_settings
+# The TLS settings of the options
+#
+def tls_settings(options=None, verify=False):
+    return (
+        getattr(options, "ca_file", None),
+        getattr(options, "client_cert", None),
+        getattr(options, "client_key", None),
+        getattr(options, "tls_min_version", None),
+        verify,
+    )
+
+
+# -- Function: create_context
+# It creates the SSL context for the settings. The server is only verified with a CA file or
+# "verify", which uses the default CA bundle
+#
+def create_context(ca_file=None, client_cert=None, client_key=None, min_version=None, verify=False):
+    if ca_file or verify:
+        context = ssl.create_default_context(cafile=ca_file)
+    else:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if client_cert:
+        context.load_cert_chain(client_cert, client_key)
+    if min_version:
+        if min_version not in TLS_VERSIONS:
+            raise ValueError(
+                'Invalid TLS version "%s" - expected one of %s'
+                % (min_version, ", ".join(TLS_VERSIONS))
+            )
+        context.minimum_version = TLS_VERSIONS[min_version]
+    return context
+
+
+# -- Function: ssl_context
+# The SSL context of the process for the TLS settings of the options
+#
+def ssl_context(options=None, verify=False):
+    settings = tls_settings(options, verify)
+    with _lock:
+        context = _contexts.get(settings)
+    if context is None:
+        context = create_context(*settings)
+        with _lock:
+            context = _contexts.setdefault(settings, context)
+    return context
+
+
+# -- Function: resuming_context
+# The SSL context for a connection with "host:port", resuming the last session with the server
+#
+def resuming_context(host, port, options=None, verify=False):
+    settings = tls_settings(options, verify)
+    return ResumingContext(ssl_context(options, verify), (settings, host, str(port)))
+
+
+# -- Function: clear_cache
+# It forgets the SSL contexts and the TLS sessions of this process
+#
+def clear_cache():
+    with _lock:
+        _contexts.clear()
+        _sessions.clear()
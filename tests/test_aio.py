@@ -0,0 +1,141 @@
+import asyncio
+import smtplib
+import ssl
+
+import pytest
+
+from simplemail.aio import AsyncMailer, AsyncSMTP, send_email_async
+from simplemail.sink import SMTPSink
+from tests.test_cli import _ready_options
+
+
+class TestAsyncSMTP:
+    def test_full_transaction(self):
+        async def _run(sink):
+            host, port = sink.address.split(":")
+            conn = AsyncSMTP(host, port)
+            await conn.connect()
+            await conn.ehlo()
+            assert conn.has_extn("auth")
+            await conn.login("user", "secret")
+            refused = await conn.sendmail(
+                "from@example.com", ["a@example.com", "reject@example.com"], "Hi\n.dot\n"
+            )
+            await conn.quit()
+            return refused
+
+        with SMTPSink() as sink:
+            refused = asyncio.run(_run(sink))
+        assert list(refused) == ["reject@example.com"]
+        assert sink.messages == [("from@example.com", ["a@example.com"], b"Hi\r\n.dot\r\n")]
+
+    def test_all_recipients_refused(self):
+        async def _run(sink):
+            host, port = sink.address.split(":")
+            conn = AsyncSMTP(host, port)
+            await conn.connect()
+            await conn.ehlo()
+            try:
+                await conn.sendmail("from@example.com", ["reject@example.com"], "Hi")
+            finally:
+                conn.close()
+
+        with SMTPSink() as sink:
+            with pytest.raises(smtplib.SMTPRecipientsRefused):
+                asyncio.run(_run(sink))
+
+    def test_pipelined_transaction(self):
+        async def _run(sink):
+            host, port = sink.address.split(":")
+            conn = AsyncSMTP(host, port)
+            await conn.connect()
+            await conn.ehlo()
+            assert conn.has_extn("pipelining")
+            rcpts = ["a@example.com", "reject@example.com", "b@example.com"]
+            refused = await conn.sendmail("from@example.com", rcpts, "Hi")
+            await conn.quit()
+            return refused
+
+        with SMTPSink(extensions=("PIPELINING", "AUTH PLAIN")) as sink:
+            refused = asyncio.run(_run(sink))
+        assert list(refused) == ["reject@example.com"]
+        assert sink.messages[0][1] == ["a@example.com", "b@example.com"]
+
+    def test_addresses_with_names(self):
+        async def _run(sink):
+            host, port = sink.address.split(":")
+            conn = AsyncSMTP(host, port)
+            await conn.connect()
+            await conn.ehlo()
+            await conn.sendmail("Sender <from@example.com>", ["Ann <a@example.com>"], "Hi")
+            await conn.quit()
+
+        with SMTPSink() as sink:
+            asyncio.run(_run(sink))
+        assert sink.messages[0][:2] == ("from@example.com", ["a@example.com"])
+
+    def test_starttls_not_supported(self):
+        async def _run(sink):
+            host, port = sink.address.split(":")
+            conn = AsyncSMTP(host, port)
+            await conn.connect()
+            await conn.ehlo()
+            try:
+                await conn.starttls()
+            finally:
+                conn.close()
+
+        with SMTPSink() as sink:
+            with pytest.raises(smtplib.SMTPNotSupportedError):
+                asyncio.run(_run(sink))
+
+
+class TestAsyncMailer:
+    def test_send_many_over_few_connections(self):
+        async def _run(options):
+            async with AsyncMailer(options, concurrency=3) as mailer:
+                jobs = [{"to": "user%d@example.com" % i} for i in range(30)]
+                return await mailer.send_many(jobs)
+
+        with SMTPSink() as sink:
+            results = asyncio.run(_run(_ready_options(sink)))
+        assert results == [{}] * 30
+        assert len(sink.messages) == 30
+        assert sink.connections <= 3
+
+    def test_send_many_reports_failures_in_order(self):
+        async def _run(options):
+            async with AsyncMailer(options, concurrency=2) as mailer:
+                jobs = [{"to": "a@example.com"}, {"to": "reject@example.com"}, {"bogus": 1}]
+                return await mailer.send_many(jobs)
+
+        with SMTPSink() as sink:
+            results = asyncio.run(_run(_ready_options(sink)))
+        assert results[0] == {}
+        assert isinstance(results[1], smtplib.SMTPRecipientsRefused)
+        assert isinstance(results[2], ValueError)
+
+    def test_reconnects_on_session_limit(self):
+        async def _run(options):
+            async with AsyncMailer(options, concurrency=1) as mailer:
+                return await mailer.send_many([{"to": "a@example.com"}] * 5)
+
+        with SMTPSink(max_messages=2) as sink:
+            results = asyncio.run(_run(_ready_options(sink)))
+        assert results == [{}] * 5
+        assert sink.connections == 3
+
+    def test_server_not_verified_by_default(self):
+        with SMTPSink() as sink:
+            mailer = AsyncMailer(_ready_options(sink))
+        # As with send_email: only verified with a CA file
+        assert mailer.ssl_context.verify_mode == ssl.CERT_NONE
+
+    def test_send_email_async(self):
+        with SMTPSink() as sink:
+            assert asyncio.run(send_email_async(_ready_options(sink, cc=["cc@example.com"]))) == 0
+        assert sink.messages[0][1] == ["to@example.com", "cc@example.com"]
+
+    def test_send_email_async_failure(self):
+        options = _ready_options(smtp_server="127.0.0.1:1", ssl="false")
+        assert asyncio.run(send_email_async(options)) == 1
@@ -0,0 +1,189 @@
+import json
+import os
+import smtplib
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from simplemail.batch import job_options, read_jobs, send_batch, send_batch_file
+from simplemail.session import SMTPSession
+from tests.test_cli import _ready_options
+
+
+def _write_jobs(jobs):
+    f = tempfile.NamedTemporaryFile(mode="w", suffix=".jsonl", delete=False)
+    for job in jobs:
+        f.write(json.dumps(job) + "\n")
+    f.close()
+    return f.name
+
+
+# ---------------------------------------------------------------------------
+# read_jobs / job_options
+# ---------------------------------------------------------------------------
+class TestJobs:
+    def test_read_jobs_skips_blank_lines(self):
+        path = _write_jobs([{"to": "a@example.com"}])
+        with open(path, "a") as f:
+            f.write("\n")
+        try:
+            assert list(read_jobs(path)) == [{"to": "a@example.com"}]
+        finally:
+            os.unlink(path)
+
+    def test_read_jobs_invalid_json(self):
+        path = _write_jobs([])
+        with open(path, "w") as f:
+            f.write("{not json\n")
+        try:
+            with pytest.raises(ValueError):
+                list(read_jobs(path))
+        finally:
+            os.unlink(path)
+
+    def test_read_jobs_from_stdin(self, monkeypatch):
+        lines = iter(['{"to": "a@example.com"}\n', "\n", '{"to": "b@example.com"}\n'])
+        read = []
+
+        def _lines():
+            for line in lines:
+                read.append(line)
+                yield line
+
+        monkeypatch.setattr("sys.stdin", _lines())
+        jobs = read_jobs("-")
+        # The lines are read as the jobs are consumed
+        assert next(jobs) == {"to": "a@example.com"}
+        assert len(read) == 1
+        assert list(jobs) == [{"to": "b@example.com"}]
+
+    def test_job_overrides_base_options(self):
+        opts = _ready_options()
+        job_opts = job_options(opts, {"to": "x@example.com", "subject": "Hi", "message": "Body"})
+        assert job_opts.to == ["x@example.com"]
+        assert job_opts.subject == "Hi"
+        assert job_opts.body == ["Body"]
+        assert job_opts.sender == opts.sender
+        assert opts.to == ["to@example.com"]
+
+    def test_job_unknown_key(self):
+        with pytest.raises(ValueError):
+            job_options(_ready_options(), {"foo": "bar"})
+
+    def test_job_without_recipients(self):
+        with pytest.raises(ValueError):
+            job_options(_ready_options(to=None), {"subject": "Hi"})
+
+
+# ---------------------------------------------------------------------------
+# SMTPSession
+# ---------------------------------------------------------------------------
+class TestSMTPSession:
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_reuses_connection_with_rset(self, mock_smtp_cls):
+        mock_server = MagicMock()
+        mock_smtp_cls.return_value = mock_server
+        with SMTPSession(_ready_options()) as session:
+            for _ in range(3):
+                session.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert mock_smtp_cls.call_count == 1
+        assert mock_server.login.call_count == 1
+        assert mock_server.rset.call_count == 2
+        assert mock_server.sendmail.call_count == 3
+        mock_server.quit.assert_called_once()
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_reconnects_after_disconnect(self, mock_smtp_cls):
+        first, second = MagicMock(), MagicMock()
+        first.sendmail.side_effect = [{}, smtplib.SMTPServerDisconnected("gone")]
+        mock_smtp_cls.side_effect = [first, second]
+        with SMTPSession(_ready_options()) as session:
+            session.sendmail("from@example.com", ["to@example.com"], "msg")
+            session.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert session.connections == 2
+        second.login.assert_called_once()
+        second.sendmail.assert_called_once()
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_reconnects_on_421(self, mock_smtp_cls):
+        first, second = MagicMock(), MagicMock()
+        first.sendmail.side_effect = [{}, smtplib.SMTPSenderRefused(421, b"too many", "from")]
+        mock_smtp_cls.side_effect = [first, second]
+        with SMTPSession(_ready_options()) as session:
+            session.sendmail("from@example.com", ["to@example.com"], "msg")
+            session.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert session.connections == 2
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_refused_first_connection_is_raised(self, mock_smtp_cls):
+        mock_smtp_cls.side_effect = ConnectionRefusedError("refused")
+        with SMTPSession(_ready_options()) as session:
+            with pytest.raises(ConnectionRefusedError):
+                session.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert mock_smtp_cls.call_count == 1
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_disconnect_on_a_new_connection_is_raised(self, mock_smtp_cls):
+        mock_server = MagicMock()
+        mock_server.sendmail.side_effect = smtplib.SMTPServerDisconnected("gone")
+        mock_smtp_cls.return_value = mock_server
+        with SMTPSession(_ready_options()) as session:
+            with pytest.raises(smtplib.SMTPServerDisconnected):
+                session.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert session.connections == 1
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_permanent_error_is_raised(self, mock_smtp_cls):
+        mock_server = MagicMock()
+        mock_server.sendmail.side_effect = smtplib.SMTPSenderRefused(550, b"denied", "from")
+        mock_smtp_cls.return_value = mock_server
+        with SMTPSession(_ready_options()) as session:
+            with pytest.raises(smtplib.SMTPSenderRefused):
+                session.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert session.connections == 1
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_max_messages_per_connection(self, mock_smtp_cls):
+        mock_smtp_cls.side_effect = lambda *args: MagicMock()
+        with SMTPSession(_ready_options(), max_messages=2) as session:
+            for _ in range(5):
+                session.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert session.connections == 3
+
+
+# ---------------------------------------------------------------------------
+# send_batch
+# ---------------------------------------------------------------------------
+class TestSendBatch:
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_batch_uses_one_connection(self, mock_smtp_cls):
+        mock_server = MagicMock()
+        mock_smtp_cls.return_value = mock_server
+        jobs = [{"to": "a@example.com"}, {"to": ["b@example.com"], "bcc": "c@example.com"}]
+        assert send_batch(_ready_options(), jobs) == 0
+        assert mock_smtp_cls.call_count == 1
+        assert mock_server.sendmail.call_args_list[1][0][1] == ["b@example.com", "c@example.com"]
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_batch_failure_returns_1(self, mock_smtp_cls):
+        mock_server = MagicMock()
+        mock_server.sendmail.side_effect = [{}, smtplib.SMTPDataError(554, b"rejected"), {}]
+        mock_smtp_cls.return_value = mock_server
+        jobs = [{"to": "a@example.com"}] * 3
+        assert send_batch(_ready_options(), jobs) == 1
+        assert mock_server.sendmail.call_count == 3
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_batch_file(self, mock_smtp_cls):
+        mock_server = MagicMock()
+        mock_smtp_cls.return_value = mock_server
+        path = _write_jobs([{"to": "a@example.com"}, {"to": "b@example.com"}])
+        try:
+            assert send_batch_file(_ready_options(), path) == 0
+        finally:
+            os.unlink(path)
+        assert mock_server.sendmail.call_count == 2
+
+    def test_missing_batch_file(self):
+        assert send_batch_file(_ready_options(), "/nonexistent/jobs.jsonl") == 1
@@ -0,0 +1,47 @@
+import json
+
+import pytest
+
+from simplemail.bench import SCENARIOS, main, percentile
+
+
+# ---------------------------------------------------------------------------
+# percentile
+# ---------------------------------------------------------------------------
+class TestPercentile:
+    def test_nearest_rank(self):
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 99) == 99
+        assert percentile([3.0], 99) == 3.0
+        assert percentile([], 50) is None
+
+
+# ---------------------------------------------------------------------------
+# simplemail-bench
+# ---------------------------------------------------------------------------
+class TestBench:
+    def test_in_process(self, tmp_path):
+        output = tmp_path / "results.json"
+        argv = ["--messages", "4", "--recipients", "3", "--attachment-size", "0.1"]
+        argv += ["--scenarios", ",".join(SCENARIOS), "--in-process", "-o", str(output)]
+        assert main(argv) == 0
+        report = json.loads(output.read_text())
+        assert [r["scenario"] for r in report["results"]] == SCENARIOS
+        for result in report["results"]:
+            assert result["failed"] == 0
+            assert result["received"] == result["messages"]
+            assert result["p50_ms"] <= result["p99_ms"]
+            assert result["messages_per_second"] > 0
+
+    def test_scenario_subprocess_with_tls(self, tmp_path):
+        output = tmp_path / "results.json"
+        argv = ["--messages", "2", "--scenarios", "batch", "--tls", "ssl", "-o", str(output)]
+        assert main(argv) == 0
+        result = json.loads(output.read_text())["results"][0]
+        assert result["received"] == 2
+        assert result["peak_rss_kb"] > 0
+
+    def test_unknown_scenario(self):
+        with pytest.raises(SystemExit):
+            main(["--scenarios", "nope"])
@@ -0,0 +1,85 @@
+import asyncio
+import email
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+
+from simplemail.aio import AsyncMailer
+from simplemail.binary import message_bytes, use_8bit_bodies
+from simplemail.cli import build_message, send_email
+from simplemail.protocol import bdat_commands
+from simplemail.sink import SMTPSink
+from tests.test_cli import _ready_options
+
+BODY = "Olá, mundo!\n.linha com ponto\n"
+
+
+class TestMessageBytes:
+    def test_crlf_line_endings(self):
+        data = bytes(message_bytes(build_message(_ready_options())))
+        assert b"\r\n" in data
+        assert b"\n" not in data.replace(b"\r\n", b"")
+
+    def test_use_8bit_bodies(self):
+        msg = MIMEMultipart()
+        msg.attach(MIMEText(BODY, "plain", _charset="utf-8"))
+        assert use_8bit_bodies(msg) is True
+        data = bytes(message_bytes(msg))
+        assert b"Content-Transfer-Encoding: 8bit" in data
+        assert BODY.replace("\n", "\r\n").encode("utf-8") in data
+
+    def test_ascii_body_is_not_marked_8bit(self):
+        msg = MIMEText("plain ascii", "plain", _charset="utf-8")
+        assert use_8bit_bodies(msg) is False
+
+    def test_long_lines_stay_encoded(self):
+        msg = MIMEText("á" * 2000, "plain", _charset="utf-8")
+        assert use_8bit_bodies(msg) is False
+        assert msg["Content-Transfer-Encoding"] == "base64"
+
+
+class TestBdat:
+    def test_chunks(self):
+        commands = list(bdat_commands(b"x" * 10, chunk_size=4))
+        assert [c for c, _ in commands] == [b"BDAT 4\r\n", b"BDAT 4\r\n", b"BDAT 2 LAST\r\n"]
+        assert all(isinstance(chunk, memoryview) for _, chunk in commands)
+
+    def test_empty_message(self):
+        assert [c for c, _ in bdat_commands(b"")] == [b"BDAT 0 LAST\r\n"]
+
+
+class TestSendBinary:
+    def _check_delivery(self, sink, eight_bit):
+        parsed = email.message_from_bytes(sink.messages[0][2])
+        body = parsed.get_payload()[0]
+        text = body.get_payload(decode=True).decode("utf-8")
+        assert text.replace("\r\n", "\n") == BODY
+        assert (body["Content-Transfer-Encoding"] == "8bit") is eight_bit
+
+    def test_bdat_and_8bitmime(self):
+        with SMTPSink(extensions=("AUTH PLAIN", "CHUNKING", "8BITMIME", "PIPELINING")) as sink:
+            assert send_email(_ready_options(sink, body=[BODY])) == 0
+        assert any(c.startswith("BDAT") for c in sink.commands)
+        assert any("BODY=8BITMIME" in c for c in sink.commands)
+        self._check_delivery(sink, eight_bit=True)
+
+    def test_8bitmime_with_data(self):
+        with SMTPSink(extensions=("AUTH PLAIN", "8BITMIME")) as sink:
+            assert send_email(_ready_options(sink, body=[BODY])) == 0
+        assert "data" in [c.lower() for c in sink.commands]
+        self._check_delivery(sink, eight_bit=True)
+
+    def test_plain_server(self):
+        with SMTPSink() as sink:
+            assert send_email(_ready_options(sink, body=[BODY])) == 0
+        assert not any("BODY=" in c for c in sink.commands)
+        self._check_delivery(sink, eight_bit=False)
+
+    def test_async_bdat(self):
+        async def _run(options):
+            async with AsyncMailer(options) as mailer:
+                return await mailer.send_many([{"to": "a@example.com"}])
+
+        with SMTPSink(extensions=("AUTH PLAIN", "CHUNKING", "8BITMIME")) as sink:
+            assert asyncio.run(_run(_ready_options(sink, body=[BODY]))) == [{}]
+        assert any(c.startswith("BDAT") for c in sink.commands)
+        self._check_delivery(sink, eight_bit=True)
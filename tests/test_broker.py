@@ -0,0 +1,180 @@
+import os
+import shutil
+import socket
+import stat
+import tempfile
+import threading
+import time
+
+import pytest
+
+from simplemail.broker import (
+    BrokerError,
+    BrokerUnavailable,
+    SMTPBroker,
+    broker_running,
+    run_broker,
+    send_via_broker,
+)
+from simplemail.cli import send_email
+from simplemail.sink import SMTPSink
+from tests.test_cli import _ready_options
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="Unix sockets required")
+
+
+@pytest.fixture
+def sock_path():
+    path = tempfile.mkdtemp()
+    yield os.path.join(path, "broker.sock")
+    shutil.rmtree(path)
+
+
+# ---------------------------------------------------------------------------
+# SMTPBroker / send_via_broker
+# ---------------------------------------------------------------------------
+class TestBroker:
+    def test_messages_share_one_connection(self, sock_path):
+        with SMTPSink() as sink:
+            opts = _ready_options(sink, broker_socket=sock_path)
+            with SMTPBroker(opts) as broker:
+                for rcpt in ("a@example.com", "b@example.com", "c@example.com"):
+                    send_via_broker(opts, "from@example.com", [rcpt], b"Subject: hi\r\n\r\nbody")
+                assert broker.sent == 3
+            assert sink.connections == 1
+            assert len(sink.messages) == 3
+
+    def test_socket_is_private(self, sock_path):
+        with SMTPSink() as sink:
+            with SMTPBroker(_ready_options(sink, broker_socket=sock_path)):
+                assert stat.S_IMODE(os.stat(sock_path).st_mode) & 0o077 == 0
+                assert broker_running(sock_path)
+        assert not os.path.exists(sock_path)
+
+    def test_refused_recipients(self, sock_path):
+        with SMTPSink() as sink:
+            opts = _ready_options(sink, broker_socket=sock_path)
+            with SMTPBroker(opts):
+                refused = send_via_broker(
+                    opts, "from@example.com", ["ok@example.com", "reject@example.com"], b"body"
+                )
+        assert list(refused) == ["reject@example.com"]
+        assert refused["reject@example.com"][0] == 550
+
+    def test_delivery_error(self, sock_path):
+        with SMTPSink() as sink:
+            opts = _ready_options(sink, broker_socket=sock_path)
+            with SMTPBroker(opts):
+                with pytest.raises(BrokerError):
+                    send_via_broker(opts, "from@example.com", ["reject@example.com"], b"body")
+
+    def test_other_server_is_unavailable(self, sock_path):
+        with SMTPSink() as sink:
+            with SMTPBroker(_ready_options(sink, broker_socket=sock_path)):
+                opts = _ready_options(
+                    smtp_server="127.0.0.1:1", ssl="false", broker_socket=sock_path
+                )
+                with pytest.raises(BrokerUnavailable):
+                    send_via_broker(opts, "from@example.com", ["a@example.com"], b"body")
+
+    @pytest.mark.parametrize(
+        "settings",
+        [{"max_recipients": 10}, {"messages_per_second": 5, "recipients_per_minute": 60}],
+    )
+    def test_other_settings_are_unavailable(self, sock_path, settings):
+        with SMTPSink() as sink:
+            with SMTPBroker(_ready_options(sink, broker_socket=sock_path)):
+                opts = _ready_options(sink, broker_socket=sock_path, **settings)
+                with pytest.raises(BrokerUnavailable):
+                    send_via_broker(opts, "from@example.com", ["a@example.com"], b"body")
+
+    def test_not_running(self, sock_path):
+        with pytest.raises(BrokerUnavailable):
+            send_via_broker(
+                _ready_options(smtp_server="127.0.0.1:1", ssl="false", broker_socket=sock_path),
+                "f",
+                ["t"],
+                b"body",
+            )
+
+    def test_stale_socket_is_replaced(self, sock_path):
+        open(sock_path, "w").close()
+        with SMTPSink() as sink:
+            with SMTPBroker(_ready_options(sink, broker_socket=sock_path)):
+                assert broker_running(sock_path)
+
+    def test_keepalive_connects(self, sock_path):
+        with SMTPSink() as sink:
+            with SMTPBroker(_ready_options(sink, broker_socket=sock_path)) as broker:
+                broker.keepalive()
+                broker.keepalive()
+            assert sink.connections == 1
+
+    def test_run_broker(self, sock_path):
+        stop = threading.Event()
+        with SMTPSink() as sink:
+            opts = _ready_options(sink, broker_socket=sock_path)
+            thread = threading.Thread(target=run_broker, args=(opts, stop))
+            thread.start()
+            try:
+                deadline = time.monotonic() + 5
+                while not broker_running(sock_path) and time.monotonic() < deadline:
+                    time.sleep(0.01)
+                send_via_broker(opts, "from@example.com", ["a@example.com"], b"body")
+            finally:
+                stop.set()
+                thread.join()
+            assert len(sink.messages) == 1
+        assert not os.path.exists(sock_path)
+
+
+# ---------------------------------------------------------------------------
+# send_email
+# ---------------------------------------------------------------------------
+class TestSendEmailWithBroker:
+    def test_uses_broker(self, sock_path):
+        with SMTPSink() as sink:
+            opts = _ready_options(sink, broker_socket=sock_path)
+            with SMTPBroker(opts) as broker:
+                assert send_email(opts) == 0
+                assert send_email(opts) == 0
+                assert broker.sent == 2
+            assert sink.connections == 1
+
+    def test_falls_back_without_broker(self, sock_path):
+        with SMTPSink() as sink:
+            assert send_email(_ready_options(sink, broker_socket=sock_path)) == 0
+            assert len(sink.messages) == 1
+
+    def test_signed_message_skips_plain_broker(self, sock_path, tmp_path):
+        pytest.importorskip("cryptography")
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import ed25519
+
+        key_file = tmp_path / "dkim.pem"
+        key_file.write_bytes(
+            ed25519.Ed25519PrivateKey.generate().private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+        with SMTPSink() as sink:
+            with SMTPBroker(_ready_options(sink, broker_socket=sock_path)) as broker:
+                opts = _ready_options(
+                    sink,
+                    broker_socket=sock_path,
+                    dkim_domain="example.com",
+                    dkim_selector="mail",
+                    dkim_key=str(key_file),
+                )
+                assert send_email(opts) == 0
+                assert broker.sent == 0
+        assert b"DKIM-Signature:" in sink.messages[0][2]
+
+    def test_broker_failure_is_not_retried(self, sock_path):
+        with SMTPSink() as sink:
+            opts = _ready_options(sink, broker_socket=sock_path, to=["reject@example.com"])
+            with SMTPBroker(opts):
+                assert send_email(opts) == 1
+            assert sink.connections == 1
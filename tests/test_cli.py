@@ -1,13 +1,16 @@
 import os
 import tempfile
 from argparse import Namespace
-from unittest.mock import MagicMock, patch
+from io import BytesIO, TextIOWrapper
+from unittest.mock import ANY, MagicMock, patch
 
 import pytest
 
+from simplemail import cli
 from simplemail.cli import (
     check_ports_mapping,
     load_configuration,
+    read_body,
     send_email,
     set_defaults,
 )
@@ -38,6 +41,13 @@ def _make_options(**overrides):
     return Namespace(**defaults)
 
 
+# The options as main() leaves them. With an SMTPSink, they send to it without SSL/TLS
+def _ready_options(sink=None, **overrides):
+    if sink is not None:
+        overrides = dict({"smtp_server": sink.address, "ssl": "false", "tls": "false"}, **overrides)
+    return set_defaults(_make_options(**overrides))
+
+
 # ---------------------------------------------------------------------------
 # check_ports_mapping
 # ---------------------------------------------------------------------------
@@ -187,6 +197,32 @@ class TestLoadConfiguration:
         finally:
             os.unlink(path)
 
+    def test_limits_section(self):
+        path = self._write_ini(
+            '[SMTP]\nHost = "smtp.test.com"\nPort = "25"\n'
+            '[LIMITS]\nMessagesPerSecond = "2.5"\nRecipientsPerMinute = 600\nMaxRecipients = 100\n'
+        )
+        try:
+            opts = load_configuration(_make_options(config_file=path, recipients_per_minute=60))
+            assert opts.messages_per_second == 2.5
+            assert opts.recipients_per_minute == 60
+            assert opts.max_recipients == 100
+        finally:
+            os.unlink(path)
+
+    def test_dkim_section(self):
+        path = self._write_ini(
+            '[SMTP]\nHost = "smtp.test.com"\nPort = "25"\n'
+            '[DKIM]\nDomain = "example.com"\nSelector = "mail"\nPrivateKey = "/etc/dkim.pem"\n'
+            'Headers = "From,Subject"\n'
+        )
+        try:
+            opts = load_configuration(_make_options(config_file=path, dkim_selector="cli"))
+            assert (opts.dkim_domain, opts.dkim_selector) == ("example.com", "cli")
+            assert (opts.dkim_key, opts.dkim_headers) == ("/etc/dkim.pem", "From,Subject")
+        finally:
+            os.unlink(path)
+
     def test_missing_smtp_section_exits(self):
         path = self._write_ini("[MESSAGE]\nContent = test\n")
         try:
@@ -201,15 +237,11 @@ class TestLoadConfiguration:
 # send_email
 # ---------------------------------------------------------------------------
 class TestSendEmail:
-    def _ready_options(self, **overrides):
-        opts = _make_options(**overrides)
-        return set_defaults(opts)
-
     @patch("simplemail.cli.smtplib.SMTP")
     def test_successful_send_returns_0(self, mock_smtp_cls):
         mock_server = MagicMock()
         mock_smtp_cls.return_value = mock_server
-        opts = self._ready_options()
+        opts = _ready_options()
         assert send_email(opts) == 0
         mock_server.login.assert_called_once()
         mock_server.sendmail.assert_called_once()
@@ -218,14 +250,14 @@ class TestSendEmail:
     @patch("simplemail.cli.smtplib.SMTP")
     def test_smtp_exception_returns_1(self, mock_smtp_cls):
         mock_smtp_cls.side_effect = Exception("connection refused")
-        opts = self._ready_options()
+        opts = _ready_options()
         assert send_email(opts) == 1
 
     @patch("simplemail.cli.smtplib.SMTP")
     def test_with_cc_and_bcc(self, mock_smtp_cls):
         mock_server = MagicMock()
         mock_smtp_cls.return_value = mock_server
-        opts = self._ready_options(
+        opts = _ready_options(
             cc=["cc@example.com"],
             bcc=["bcc@example.com"],
         )
@@ -243,7 +275,7 @@ class TestSendEmail:
             f.write(b"attachment content")
             attachment_path = f.name
         try:
-            opts = self._ready_options(file=[attachment_path])
+            opts = _ready_options(file=[attachment_path])
             assert send_email(opts) == 0
         finally:
             os.unlink(attachment_path)
@@ -256,7 +288,7 @@ class TestSendEmail:
             f.write("<h1>Hello</h1>")
             body_path = f.name
         try:
-            opts = self._ready_options(body=[body_path])
+            opts = _ready_options(body=[body_path])
             assert send_email(opts) == 0
         finally:
             os.unlink(body_path)
@@ -265,19 +297,19 @@ class TestSendEmail:
     def test_ssl_connection(self, mock_smtp_ssl_cls):
         mock_server = MagicMock()
         mock_smtp_ssl_cls.return_value = mock_server
-        opts = self._ready_options(
+        opts = _ready_options(
             smtp_server="mail.example.com:465",
             ssl="true",
             tls="false",
         )
         assert send_email(opts) == 0
-        mock_smtp_ssl_cls.assert_called_once_with("mail.example.com", "465")
+        mock_smtp_ssl_cls.assert_called_once_with("mail.example.com", "465", context=ANY)
 
     @patch("simplemail.cli.smtplib.SMTP")
     def test_tls_connection(self, mock_smtp_cls):
         mock_server = MagicMock()
         mock_smtp_cls.return_value = mock_server
-        opts = self._ready_options(
+        opts = _ready_options(
             smtp_server="mail.example.com:587",
             tls="true",
             ssl="false",
@@ -286,6 +318,25 @@ class TestSendEmail:
         mock_server.starttls.assert_called_once()
 
 
+# ---------------------------------------------------------------------------
+# read_body
+# ---------------------------------------------------------------------------
+class TestReadBody:
+    def test_body_file(self, tmp_path):
+        path = tmp_path / "body.html"
+        path.write_text("<p>line 1</p>\n<p>line 2</p>\n")
+        assert read_body(_make_options(body=[str(path)])) == "<p>line 1</p>\n<p>line 2</p>\n"
+
+    def test_body_from_stdin(self, monkeypatch):
+        monkeypatch.setattr(cli, "_stdin_body", None)
+        monkeypatch.setattr(cli, "STDIN_CHUNK_SIZE", 4)
+        monkeypatch.setattr("sys.stdin", TextIOWrapper(BytesIO("Olá, report!".encode("utf-8"))))
+        options = set_defaults(_make_options(body=["-"]))
+        assert read_body(options) == "Olá, report!"
+        # The input is read once
+        assert read_body(options) == "Olá, report!"
+
+
 # ---------------------------------------------------------------------------
 # main (argument parsing)
 # ---------------------------------------------------------------------------
@@ -306,3 +357,28 @@ class TestMain:
                 from simplemail.cli import main
 
                 main()
+
+    def test_stdin_body_with_processes_exits(self):
+        argv = ["simplemail", "--batch", "jobs.jsonl", "--processes", "2", "-m", "-"]
+        with patch("sys.argv", argv):
+            with pytest.raises(SystemExit):
+                from simplemail.cli import main
+
+                main()
+
+    @pytest.mark.parametrize("option", ["--to-file", "--bcc-file"])
+    def test_batch_with_address_file_exits(self, option):
+        argv = ["simplemail", "-f", "a@b.com", "--batch", "jobs.jsonl", option, "list.txt"]
+        with patch("sys.argv", argv):
+            with pytest.raises(SystemExit):
+                from simplemail.cli import main
+
+                main()
+
+    def test_stdin_read_twice_exits(self):
+        argv = ["simplemail", "-f", "a@b.com", "--jobs-from", "-", "-m", "-"]
+        with patch("sys.argv", argv):
+            with pytest.raises(SystemExit):
+                from simplemail.cli import main
+
+                main()
@@ -0,0 +1,142 @@
+import os
+import stat
+import threading
+from unittest.mock import patch
+
+import pytest
+
+from simplemail import config
+from simplemail.broker import SMTPBroker
+from simplemail.cli import load_configuration, set_defaults
+from simplemail.config import CACHE_SUFFIX, ConfigWatcher, read_configuration
+from simplemail.outbox import Outbox, run_daemon
+from simplemail.sink import SMTPSink
+from tests.test_cli import _make_options, _ready_options
+
+INI = '[SMTP]\nHost = "%s"\nPort = "%s"\nUsername = "user"\n'
+NO_TLS = 'UseSSL = "false"\nUseTLS = "false"\n'
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    config.clear_cache()
+    yield
+    config.clear_cache()
+
+
+def _write(path, host="smtp.test.com", port="25", extra=""):
+    path.write_text(INI % (host, port) + extra)
+    # Makes the change visible even within the resolution of the file system clock
+    st = os.stat(str(path))
+    os.utime(str(path), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    return str(path)
+
+
+# ---------------------------------------------------------------------------
+# read_configuration
+# ---------------------------------------------------------------------------
+class TestReadConfiguration:
+    def test_parsed_once(self, tmp_path):
+        path = _write(tmp_path / "config.ini")
+        with patch.object(config, "parse_configuration", wraps=config.parse_configuration) as p:
+            first = read_configuration(path)
+            assert read_configuration(path) is first
+        assert p.call_count == 1
+        assert first == {"SMTP": {"host": "smtp.test.com", "port": "25", "username": "user"}}
+
+    def test_changed_file_is_parsed_again(self, tmp_path):
+        path = _write(tmp_path / "config.ini")
+        read_configuration(path)
+        _write(tmp_path / "config.ini", host="other.test.com")
+        assert read_configuration(path)["SMTP"]["host"] == "other.test.com"
+
+    def test_missing_file_is_empty(self, tmp_path):
+        assert read_configuration(str(tmp_path / "missing.ini")) == {}
+
+    def test_cache_file(self, tmp_path):
+        path = _write(tmp_path / "config.ini")
+        sections = read_configuration(path, use_cache_file=True)
+        assert stat.S_IMODE(os.stat(path + CACHE_SUFFIX).st_mode) == 0o600
+
+        config.clear_cache()
+        with patch.object(config, "parse_configuration") as parse:
+            assert read_configuration(path, use_cache_file=True) == sections
+        parse.assert_not_called()
+
+    def test_outdated_cache_file_is_ignored(self, tmp_path):
+        path = _write(tmp_path / "config.ini")
+        read_configuration(path, use_cache_file=True)
+        config.clear_cache()
+        _write(tmp_path / "config.ini", port="587")
+        assert read_configuration(path, use_cache_file=True)["SMTP"]["port"] == "587"
+
+    def test_load_configuration_keeps_precedence(self, tmp_path):
+        path = _write(tmp_path / "config.ini")
+        for _ in range(2):
+            opts = load_configuration(_make_options(config_file=path, smtp_user="cli_user"))
+            assert opts.smtp_server == "smtp.test.com:25"
+            assert opts.smtp_user == "cli_user"
+
+
+# ---------------------------------------------------------------------------
+# ConfigWatcher
+# ---------------------------------------------------------------------------
+class TestConfigWatcher:
+    def test_poll(self, tmp_path):
+        path = _write(tmp_path / "config.ini")
+        watcher = ConfigWatcher(_make_options(config_file=path, smtp_user="cli_user"))
+        assert watcher.poll() is None
+
+        _write(tmp_path / "config.ini", host="other.test.com")
+        options = watcher.poll()
+        assert options.smtp_server == "other.test.com:25"
+        assert options.smtp_user == "cli_user"
+        assert options.subject == "(no subject)"
+        assert watcher.poll() is None
+
+    def test_broken_file_keeps_the_configuration(self, tmp_path, caplog):
+        path = _write(tmp_path / "config.ini")
+        watcher = ConfigWatcher(_make_options(config_file=path))
+        (tmp_path / "config.ini").write_text("[MESSAGE]\nContent = test\n")
+        assert watcher.poll() is None
+        assert "Failed to reload" in caplog.text
+
+    def test_daemon_reloads(self, tmp_path):
+        outbox = Outbox(str(tmp_path / "outbox"))
+        outbox.enqueue("from@example.com", ["to@example.com"], b"Subject: x\r\n\r\nfirst")
+        stop = threading.Event()
+        with SMTPSink() as first, SMTPSink() as second:
+            path = _write(tmp_path / "config.ini", *first.address.split(":"), extra=NO_TLS)
+            options = _make_options(config_file=path)
+            watcher = ConfigWatcher(options)
+            options = set_defaults(load_configuration(options))
+            options.config_watcher = watcher
+            # Reloaded after delivering the first message
+            _write(tmp_path / "config.ini", *second.address.split(":"), extra=NO_TLS)
+            thread = threading.Thread(target=run_daemon, args=(options, outbox, stop, 0.01))
+            thread.start()
+            try:
+                for _ in range(500):
+                    if first.messages:
+                        break
+                    stop.wait(0.01)
+                outbox.enqueue("from@example.com", ["to@example.com"], b"Subject: x\r\n\r\nnext")
+                for _ in range(500):
+                    if second.messages:
+                        break
+                    stop.wait(0.01)
+            finally:
+                stop.set()
+                thread.join()
+        assert len(first.messages) == 1
+        assert len(second.messages) == 1
+
+    def test_broker_reloads(self, tmp_path):
+        options = _make_options(smtp_server="127.0.0.1:1", broker_socket=str(tmp_path / "b.sock"))
+        broker = SMTPBroker(set_defaults(options))
+        previous = broker.pool
+        broker.reload(_ready_options(smtp_server="127.0.0.1:2"))
+        assert broker.options.smtp_server == "127.0.0.1:2"
+        assert broker.pool.options is broker.options
+        assert previous._closed
+        broker.pool.close()
@@ -0,0 +1,173 @@
+import json
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+import pytest
+
+from simplemail.direct import (
+    MXLookupError,
+    MXResolver,
+    deliver_direct,
+    dns_query,
+    encode_name,
+    group_by_domain,
+    parse_mx_reply,
+    send_direct,
+)
+from simplemail.sink import SMTPSink
+from tests.test_cli import _ready_options
+
+
+def _mx_reply(query, records, rcode=0, ttl=300):
+    # The answers point to the question name with a compression pointer (offset 12)
+    header = struct.pack("!HHHHHH", struct.unpack("!H", query[:2])[0], 0x8180 | rcode, 1, 0, 0, 0)
+    answers = b""
+    for preference, host in records:
+        rdata = struct.pack("!H", preference) + encode_name(host)
+        answers += b"\xc0\x0c" + struct.pack("!HHIH", 15, 1, ttl, len(rdata)) + rdata
+    header = header[:6] + struct.pack("!H", len(records)) + header[8:]
+    return header + query[12:] + answers
+
+
+class _StubResolver:
+    def __init__(self, records, ttl=300):
+        self.records = records
+        self.ttl = ttl
+        self.queries = 0
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.05)
+        self.stop = threading.Event()
+
+    @property
+    def address(self):
+        return "127.0.0.1:%d" % self.sock.getsockname()[1]
+
+    def _serve(self):
+        while not self.stop.is_set():
+            try:
+                query, peer = self.sock.recvfrom(512)
+            except socket.timeout:
+                continue
+            self.queries += 1
+            self.sock.sendto(_mx_reply(query, self.records, ttl=self.ttl), peer)
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self._serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.sock.close()
+
+
+# ---------------------------------------------------------------------------
+# DNS
+# ---------------------------------------------------------------------------
+class TestDNS:
+    def test_parse_mx_reply(self):
+        query = dns_query(1234, "example.com", 15)
+        reply = _mx_reply(query, [(20, "mx2.example.com"), (10, "mx1.example.com")], ttl=60)
+        records, ttl = parse_mx_reply(reply, "example.com")
+        assert records == [(20, "mx2.example.com"), (10, "mx1.example.com")]
+        assert ttl == 60
+
+    def test_nxdomain(self):
+        reply = _mx_reply(dns_query(1, "nowhere.invalid", 15), [], rcode=3)
+        with pytest.raises(MXLookupError):
+            parse_mx_reply(reply, "nowhere.invalid")
+
+    def test_resolver_cache_respects_ttl(self):
+        with _StubResolver([(10, "mx1.example.com"), (5, "mx0.example.com")]) as stub:
+            resolver = MXResolver(nameserver=stub.address)
+            hosts = resolver.resolve("Example.com")
+            assert hosts == [("mx0.example.com", 25), ("mx1.example.com", 25)]
+            assert resolver.resolve("example.com") == hosts
+            assert stub.queries == 1
+            stub.ttl = 0
+            resolver._cache.clear()
+            resolver.resolve("example.com")
+            resolver.resolve("example.com")
+            assert stub.queries == 3
+
+    def test_implicit_mx(self):
+        with _StubResolver([]) as stub:
+            assert MXResolver(nameserver=stub.address).resolve("example.com") == [
+                ("example.com", 25)
+            ]
+
+    def test_null_mx(self):
+        with _StubResolver([(0, ".")]) as stub:
+            with pytest.raises(MXLookupError):
+                MXResolver(nameserver=stub.address).resolve("example.com")
+
+    def test_static_map(self):
+        resolver = MXResolver(static={"Example.com": ["127.0.0.1:2525", "backup"]})
+        assert resolver.resolve("example.com") == [("127.0.0.1", 2525), ("backup", 25)]
+
+
+# ---------------------------------------------------------------------------
+# Delivery
+# ---------------------------------------------------------------------------
+class TestDirectDelivery:
+    def test_group_by_domain(self):
+        groups = group_by_domain(["a@One.com", "b@two.com", "<c@one.com>"])
+        assert groups == {"one.com": ["a@One.com", "<c@one.com>"], "two.com": ["b@two.com"]}
+
+    def test_domains_are_delivered_separately(self):
+        with SMTPSink() as one, SMTPSink() as two:
+            resolver = MXResolver(static={"one.com": [one.address], "two.com": [two.address]})
+            rcpts = ["a@one.com", "b@two.com", "c@one.com"]
+            assert deliver_direct(resolver, "from@example.com", rcpts, b"Subject: x\r\n\r\n") == {}
+            assert [m[1] for m in one.messages] == [["a@one.com", "c@one.com"]]
+            assert [m[1] for m in two.messages] == [["b@two.com"]]
+
+    def test_slow_domain_does_not_block_others(self):
+        with SMTPSink(latency=1.0) as slow, SMTPSink() as fast:
+            resolver = MXResolver(static={"slow.com": [slow.address], "fast.com": [fast.address]})
+            rcpts = ["a@slow.com", "b@fast.com"]
+            thread = threading.Thread(
+                target=deliver_direct, args=(resolver, "from@example.com", rcpts, b"body")
+            )
+            thread.start()
+            deadline = time.monotonic() + 0.8
+            while not fast.messages and time.monotonic() < deadline:
+                time.sleep(0.01)
+            # The fast domain is done while the slow one is still receiving the message
+            assert len(fast.messages) == 1
+            assert len(slow.messages) == 0
+            thread.join()
+            assert len(slow.messages) == 1
+
+    def test_refused_and_failed_recipients(self):
+        with SMTPSink() as sink:
+            resolver = MXResolver(static={"one.com": [sink.address], "down.com": ["127.0.0.1:1"]})
+            failed = deliver_direct(
+                resolver, "from@example.com", ["reject@one.com", "ok@one.com", "x@down.com"], b"b"
+            )
+        assert set(failed) == {"reject@one.com", "x@down.com"}
+        assert failed["reject@one.com"][0] == 550
+
+    def test_next_exchanger_on_failure(self):
+        with SMTPSink() as sink:
+            resolver = MXResolver(static={"one.com": ["127.0.0.1:1", sink.address]})
+            assert deliver_direct(resolver, "from@example.com", ["a@one.com"], b"body") == {}
+            assert len(sink.messages) == 1
+
+    def test_send_direct(self):
+        with SMTPSink() as sink:
+            f = tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False)
+            json.dump({"example.com": [sink.address]}, f)
+            f.close()
+            try:
+                opts = _ready_options(mx_map=f.name, bcc=["hidden@example.com"])
+                assert send_direct(opts) == 0
+            finally:
+                os.unlink(f.name)
+            assert sink.messages[0][1] == ["to@example.com", "hidden@example.com"]
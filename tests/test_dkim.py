@@ -0,0 +1,232 @@
+import asyncio
+import base64
+import hashlib
+import os
+import re
+import tempfile
+from unittest.mock import patch
+
+import pytest
+
+pytest.importorskip("cryptography")
+
+from cryptography.hazmat.primitives import hashes, serialization  # noqa: E402
+from cryptography.hazmat.primitives.asymmetric import ed25519, padding, rsa  # noqa: E402
+
+from simplemail import dkim  # noqa: E402
+from simplemail.aio import AsyncMailer  # noqa: E402
+from simplemail.cli import build_message, send_email  # noqa: E402
+from simplemail.dkim import BodyHash, DKIMSigner  # noqa: E402
+from simplemail.render import render_email  # noqa: E402
+from simplemail.sink import SMTPSink  # noqa: E402
+from simplemail.streaming import StreamingMessage  # noqa: E402
+from tests.test_cli import _make_options, _ready_options  # noqa: E402
+
+RSA_KEY = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+ED25519_KEY = ed25519.Ed25519PrivateKey.generate()
+
+MESSAGE = (
+    b"From: Sender <from@example.com>\r\n"
+    b"To: to@example.com\r\n"
+    b"Subject:  A  folded\r\n\tsubject \r\n"
+    b"Bcc: hidden@example.com\r\n"
+    b"\r\n"
+    b"Hello  \t world \r\n"
+    b"..second line\r\n"
+    b"\r\n"
+    b"\r\n"
+)
+
+
+@pytest.fixture
+def key_file():
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".pem") as f:
+        f.write(
+            ED25519_KEY.private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption(),
+            )
+        )
+    yield f.name
+    os.unlink(f.name)
+    dkim.clear_cache()
+
+
+# Reference canonicalization over the whole message (RFC 6376, 3.4)
+def _relaxed_body(body):
+    lines = [re.sub(rb"[ \t]+", b" ", line).rstrip(b" ") for line in body.split(b"\r\n")]
+    body = b"\r\n".join(lines).rstrip(b"\r\n")
+    return body + b"\r\n" if body else b""
+
+
+def _simple_body(body):
+    return body.rstrip(b"\r\n") + b"\r\n"
+
+
+def _verify(data, public_key):
+    headers, _, body = data.partition(b"\r\n\r\n")
+    fields = re.split(rb"\r\n(?![ \t])", headers)
+    signature = fields.pop(0)
+    assert signature.startswith(b"DKIM-Signature:")
+    tags = dict(
+        tag.strip().split(b"=", 1)
+        for tag in re.sub(rb"\s+", b"", signature.split(b":", 1)[1]).split(b";")
+        if tag
+    )
+    header_c, body_c = tags[b"c"].split(b"/")
+    canonical = _relaxed_body(body) if body_c == b"relaxed" else _simple_body(body)
+    assert base64.b64decode(tags[b"bh"]) == hashlib.sha256(canonical).digest()
+
+    def canonical_header(field):
+        if header_c == b"simple":
+            return field
+        name, _, value = field.partition(b":")
+        value = re.sub(rb"[ \t]+", b" ", value.replace(b"\r\n", b"")).strip(b" ")
+        return name.strip().lower() + b":" + value
+
+    by_name = {}
+    for field in fields:
+        by_name.setdefault(field.split(b":", 1)[0].lower(), []).append(field)
+    signed = b"".join(
+        canonical_header(by_name[name].pop()) + b"\r\n" for name in tags[b"h"].split(b":")
+    )
+    signed += canonical_header(re.sub(rb"(b=)[^;]*$", rb"\1", signature))
+    b = base64.b64decode(tags[b"b"])
+    if tags[b"a"] == b"ed25519-sha256":
+        public_key.verify(b, hashlib.sha256(signed).digest())
+    else:
+        public_key.verify(b, signed, padding.PKCS1v15(), hashes.SHA256())
+    return tags
+
+
+# ---------------------------------------------------------------------------
+# Body hash
+# ---------------------------------------------------------------------------
+class TestBodyHash:
+    @pytest.mark.parametrize("relaxed", [True, False])
+    @pytest.mark.parametrize(
+        "body",
+        [b"", b"\r\n\r\n", b"one", b"a  b \r\n\r\n\r\nc\t\r\n\r\n", b"x \r\n \r\ny", b"\r\nz"],
+    )
+    def test_chunks_match_the_whole_body(self, relaxed, body):
+        expected = hashlib.sha256(_relaxed_body(body) if relaxed else _simple_body(body)).digest()
+        for size in (1, 2, 3, len(body) or 1):
+            body_hash = BodyHash(relaxed)
+            for offset in range(0, len(body), size):
+                end = offset + size
+                body_hash.update(body[offset:end])
+            assert body_hash.digest() == expected, size
+
+
+# ---------------------------------------------------------------------------
+# Signing
+# ---------------------------------------------------------------------------
+class TestDKIMSigner:
+    @pytest.mark.parametrize("key", [RSA_KEY, ED25519_KEY], ids=["rsa", "ed25519"])
+    @pytest.mark.parametrize("canonicalization", ["relaxed/relaxed", "simple/simple"])
+    def test_signature_verifies(self, key, canonicalization):
+        signer = DKIMSigner("example.com", "mail", key, canonicalization=canonicalization)
+        header = signer.signature(MESSAGE)
+        assert header.startswith(b"DKIM-Signature: ") and header.endswith(b"\r\n")
+        tags = _verify(header + MESSAGE, key.public_key())
+        assert tags[b"h"] == b"from:to:subject"
+        assert tags[b"a"] == signer.algorithm.encode("ascii")
+
+    def test_invalid_settings(self):
+        with pytest.raises(ValueError):
+            DKIMSigner("example.com", "mail", ED25519_KEY, canonicalization="loose/simple")
+        with pytest.raises(ValueError):
+            DKIMSigner("example.com", "mail", ED25519_KEY).signature(b"To: a@example.com\r\n\r\n")
+
+    def test_key_loaded_once(self, key_file):
+        options = _ready_options(dkim_domain="example.com", dkim_selector="mail", dkim_key=key_file)
+        with patch("simplemail.dkim.load_key", wraps=dkim.load_key) as load_key:
+            signer = dkim.signer(options)
+            assert dkim.signer(options) is signer
+            assert load_key.call_count == 1
+            os.utime(key_file, ns=(0, 0))
+            assert dkim.signer(options) is not signer
+        assert dkim.signer(_make_options()) is None
+
+
+# ---------------------------------------------------------------------------
+# Sending
+# ---------------------------------------------------------------------------
+class TestSendSigned:
+    @pytest.mark.parametrize(
+        "extensions",
+        [("AUTH PLAIN", "8BITMIME", "CHUNKING"), ("AUTH PLAIN", "PIPELINING"), ("AUTH PLAIN",)],
+    )
+    def test_send_email(self, key_file, extensions):
+        with SMTPSink(extensions=extensions) as sink:
+            options = _ready_options(
+                sink,
+                body=["Olá!\n.dot"],
+                dkim_domain="example.com",
+                dkim_selector="mail",
+                dkim_key=key_file,
+            )
+            assert send_email(options) == 0
+        _verify(sink.messages[0][2], ED25519_KEY.public_key())
+
+    @pytest.mark.parametrize("extensions", [("AUTH PLAIN", "CHUNKING"), ("AUTH PLAIN",)])
+    def test_async_mailer(self, key_file, extensions):
+        async def _run(options):
+            async with AsyncMailer(options) as mailer:
+                return await mailer.send_many([{"to": "a@example.com"}, {"to": "b@example.com"}])
+
+        with SMTPSink(extensions=extensions) as sink:
+            options = _ready_options(
+                sink,
+                dkim_domain="example.com",
+                dkim_selector="mail",
+                dkim_key=key_file,
+            )
+            assert asyncio.run(_run(options)) == [{}, {}]
+        for _, _, data in sink.messages:
+            assert data.startswith(b"DKIM-Signature: ")
+            _verify(data, ED25519_KEY.public_key())
+
+    def test_streaming_message(self, key_file):
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".bin") as f:
+            f.write(os.urandom(300001))
+        try:
+            with SMTPSink() as sink:
+                options = _ready_options(
+                    sink,
+                    body=[".dot"],
+                    file=[f.name],
+                    stream=True,
+                    dkim_domain="example.com",
+                    dkim_selector="mail",
+                    dkim_key=key_file,
+                )
+                assert send_email(options) == 0
+        finally:
+            os.unlink(f.name)
+        _verify(sink.messages[0][2], ED25519_KEY.public_key())
+
+    def test_stdin_body_is_not_signed(self):
+        signer = DKIMSigner("example.com", "mail", ED25519_KEY)
+        msg = StreamingMessage(_ready_options(body=["-"]))
+        with pytest.raises(ValueError):
+            msg.signature(signer)
+
+    def test_prepared_bytes(self):
+        signer = DKIMSigner("example.com", "mail", RSA_KEY, headers=["From", "Subject"])
+        msg = build_message(_ready_options(subject="Hi"))
+        data = msg.as_bytes().replace(b"\n", b"\r\n")
+        signed = signer.signature(data) + data
+        assert _verify(signed, RSA_KEY.public_key())[b"h"] == b"from:subject"
+
+    def test_rendered_eml(self, key_file, tmp_path):
+        options = _ready_options(
+            output="eml-dir:%s" % tmp_path,
+            dkim_domain="example.com",
+            dkim_selector="mail",
+            dkim_key=key_file,
+        )
+        assert render_email(options) == 0
+        [name] = os.listdir(tmp_path)
+        _verify((tmp_path / name).read_bytes(), ED25519_KEY.public_key())
@@ -0,0 +1,95 @@
+import smtplib
+from unittest.mock import patch
+
+import pytest
+
+from simplemail import envelope
+from simplemail.cli import build_message, send_email
+from simplemail.envelope import EnvelopeSplitter, SerializedMessage, split_recipients
+from simplemail.session import SMTPSession
+from simplemail.sink import SMTPSink
+from tests.test_cli import _ready_options
+
+RECIPIENTS = ["user%02d@example.com" % i for i in range(25)]
+
+
+# ---------------------------------------------------------------------------
+# Splitting
+# ---------------------------------------------------------------------------
+class TestSplitRecipients:
+    def test_split(self):
+        assert split_recipients(["a", "b", "c"], 2) == [["a", "b"], ["c"]]
+        assert split_recipients(["a", "b", "c"], 0) == [["a", "b", "c"]]
+
+    def test_serialized_once(self):
+        msg = SerializedMessage(build_message(_ready_options(body=["Olá!"])))
+        with patch("simplemail.envelope.message_bytes", wraps=envelope.message_bytes) as gen:
+            data = msg.as_bytes()
+            assert msg.as_bytes() is data
+            assert msg.has_8bit()
+            assert "Olá!".encode("utf-8") in msg.as_bytes(eight_bit=True)
+        assert gen.call_count == 2
+
+
+class TestEnvelopeSplitter:
+    def test_failed_envelope_is_reported(self):
+        def sendmail(from_addr, to_addrs, msg):
+            if "b@example.com" in to_addrs:
+                raise smtplib.SMTPDataError(554, b"rejected")
+            return {}
+
+        splitter = EnvelopeSplitter(max_recipients=1)
+        refused = splitter.sendmail(
+            sendmail, "f@example.com", ["a@example.com", "b@example.com"], b""
+        )
+        assert refused == {"b@example.com": (554, b"rejected")}
+
+    def test_all_envelopes_failed(self):
+        def sendmail(from_addr, to_addrs, msg):
+            raise smtplib.SMTPDataError(554, b"rejected")
+
+        with pytest.raises(smtplib.SMTPDataError):
+            EnvelopeSplitter(1).sendmail(sendmail, "f@example.com", ["a@x.com", "b@x.com"], b"")
+
+
+# ---------------------------------------------------------------------------
+# Sending
+# ---------------------------------------------------------------------------
+class TestSendEnvelopes:
+    @pytest.mark.parametrize(
+        "extensions",
+        [("AUTH PLAIN", "PIPELINING"), ("AUTH PLAIN", "CHUNKING"), ("AUTH PLAIN",)],
+    )
+    def test_limit_learnt_from_the_server(self, extensions):
+        with SMTPSink(extensions=extensions, max_recipients=10) as sink:
+            options = _ready_options(sink)
+            msg = build_message(_ready_options(to=RECIPIENTS))
+            with SMTPSession(options) as session:
+                assert session.sendmail("from@example.com", RECIPIENTS, msg) == {}
+                assert session.envelopes.max_recipients == 10
+                session.sendmail("from@example.com", RECIPIENTS[:15], msg)
+            assert sink.connections == 1
+        assert [len(rcpts) for _, rcpts, _ in sink.messages] == [10, 10, 5, 10, 5]
+        assert sorted(sum((rcpts for _, rcpts, _ in sink.messages[:3]), [])) == RECIPIENTS
+        # The same message in every envelope
+        assert len(set(data for _, _, data in sink.messages[:3])) == 1
+        if "CHUNKING" in extensions:
+            # Without PIPELINING, no RCPT TO is sent after the first 452
+            rcpts = [c for c in sink.commands if c.upper().startswith("RCPT")]
+            assert len(rcpts) == 11 + 10 + 5 + 10 + 5
+
+    def test_refused_recipients(self):
+        to = RECIPIENTS[:12] + ["reject@example.com"]
+        with SMTPSink(max_recipients=5) as sink:
+            with SMTPSession(_ready_options(sink, max_recipients=5)) as session:
+                refused = session.sendmail("from@example.com", to, b"Subject: hi\r\n\r\nHi")
+        assert list(refused) == ["reject@example.com"]
+        assert [len(rcpts) for _, rcpts, _ in sink.messages] == [5, 5, 2]
+
+    def test_send_email_in_parallel(self):
+        with SMTPSink(max_recipients=10) as sink:
+            options = _ready_options(sink, bcc=RECIPIENTS, workers=3, max_recipients=10)
+            assert send_email(options) == 0
+        delivered = sum((rcpts for _, rcpts, _ in sink.messages), [])
+        assert sorted(delivered) == sorted(["to@example.com"] + RECIPIENTS)
+        assert len(sink.messages) == 3
@@ -0,0 +1,111 @@
+import base64
+import json
+import logging
+import os
+import tempfile
+
+import pytest
+
+from simplemail import logs, smtpdebug
+from simplemail.cli import send_email
+from simplemail.sink import SMTPSink
+from tests.test_cli import _ready_options
+
+
+@pytest.fixture
+def log_file():
+    root = logging.getLogger()
+    level = root.level
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".log") as f:
+        pass
+    yield f.name
+    logs.stop_logging()
+    root.removeHandler(logs._handler)
+    logs._handler = None
+    root.setLevel(level)
+    logging.getLogger(smtpdebug.SMTP_LOGGER).setLevel(logging.NOTSET)
+    os.unlink(f.name)
+
+
+def _records(path):
+    logs.stop_logging()
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+class _Counted:
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "counted"
+
+
+# ---------------------------------------------------------------------------
+# setup_logging
+# ---------------------------------------------------------------------------
+class TestSetupLogging:
+    def test_json_lines_with_message_ids(self, log_file):
+        logs.setup_logging(logging.INFO, log_file=log_file, log_format="json")
+        logging.info("before")
+        with logs.message_context("m1"):
+            logging.info("sending %s", "Olá")
+            logs.with_message_id(logging.warning)("from another thread")
+        records = _records(log_file)
+        assert [r["message"] for r in records] == ["before", "sending Olá", "from another thread"]
+        assert [r.get("message_id") for r in records] == [None, "m1", "m1"]
+        assert records[2]["level"] == "WARNING"
+
+    def test_debug_records_are_not_formatted(self, log_file):
+        logs.setup_logging(logging.INFO, log_file=log_file)
+        debug, info = _Counted(), _Counted()
+        logging.debug("value: %s", debug)
+        logging.info("value: %s", info)
+        logs.stop_logging()
+        assert debug.formatted == 0 and info.formatted > 0
+        with open(log_file) as f:
+            assert f.read().endswith("[INFO]: value: counted\n")
+
+    def test_credentials_are_redacted(self, log_file):
+        logs.setup_logging(logging.DEBUG, log_file=log_file, log_format="json", password="s3cret!")
+        logging.info("password: %s", "s3cret!")
+        logging.info("send: 'AUTH PLAIN AHVzZXIAczNjcmV0IQ==' (AUTH PLAIN LOGIN)")
+        logging.info("send: %r", base64.b64encode(b"s3cret!").decode("ascii"))
+        messages = [r["message"] for r in _records(log_file)]
+        assert messages == [
+            "password: ***",
+            "send: 'AUTH PLAIN ***' (AUTH PLAIN LOGIN)",
+            "send: '***'",
+        ]
+
+    def test_unknown_format(self):
+        with pytest.raises(ValueError):
+            logs.setup_logging(logging.INFO, log_format="xml")
+
+
+# ---------------------------------------------------------------------------
+# Sending
+# ---------------------------------------------------------------------------
+class TestSendLogging:
+    def test_smtp_debug_is_logged_and_redacted(self, log_file):
+        logs.setup_logging(logging.INFO, log_file=log_file, log_format="json")
+        with SMTPSink() as sink:
+            options = _ready_options(
+                sink,
+                smtp_user="user",
+                smtp_password="pa55word",
+                smtp_debug="true",
+            )
+            assert send_email(options) == 0
+        records = _records(log_file)
+        text = "\n".join(r["message"] for r in records)
+        # Logged at DEBUG, although the root logger is at INFO
+        assert {r["level"] for r in records if r["message"].startswith("SMTP ")} == {"DEBUG"}
+        assert "SMTP send: 'mail FROM:<from@example.com>" in text
+        assert "AUTH PLAIN ***" in text
+        assert "pa55word" not in text
+        assert base64.b64encode(b"\0user\0pa55word").decode("ascii") not in text
+        # All the records of the message carry its ID
+        assert len(set(r.get("message_id") for r in records)) == 1
+        assert records[-1]["message"] == 'Email sent to: "to@example.com"'
@@ -0,0 +1,96 @@
+from email import message_from_bytes
+from unittest.mock import patch
+
+import simplemail
+from simplemail.binary import message_bytes
+from simplemail.cli import build_message, connect
+from simplemail.mailer import Mailer, PreparedMessage
+from simplemail.sink import SMTPSink
+from tests.test_cli import _make_options, _ready_options
+
+PIPELINING = ("AUTH PLAIN LOGIN", "PIPELINING", "8BITMIME")
+
+
+def _prepared(**overrides):
+    fields = dict(sender="from@example.com", to="to@example.com", subject="Hi", body="Olá!")
+    fields.update(overrides)
+    return PreparedMessage(**fields)
+
+
+# ---------------------------------------------------------------------------
+# PreparedMessage
+# ---------------------------------------------------------------------------
+class TestPreparedMessage:
+    def test_same_bytes_as_build_message(self):
+        prepared = _prepared(cc=["cc@example.com"])
+        options = _make_options(to=["to@example.com"], cc=["cc@example.com"], subject="Hi")
+        options.body, options.content_type, options.charset = ["Olá!"], "text/html", "utf-8"
+        data = prepared.as_bytes()
+        msg = build_message(options)
+        msg.replace_header("Date", prepared.message["Date"])
+        msg.set_boundary(prepared.message.get_boundary())
+        assert data == bytes(message_bytes(msg))
+
+    def test_with_recipients_reuses_the_parts(self):
+        prepared = _prepared(bcc="audit@example.com")
+        first = prepared.as_bytes()
+        with patch("simplemail.mailer.message_bytes") as generate:
+            other = prepared.with_recipients(to=["a@example.com", "b@example.com"])
+            data = other.as_bytes()
+        generate.assert_not_called()
+        assert other.recipients == ["a@example.com", "b@example.com", "audit@example.com"]
+        assert prepared.recipients == ["to@example.com", "audit@example.com"]
+        parsed = message_from_bytes(data)
+        assert parsed["To"] == "a@example.com, b@example.com"
+        assert parsed.get_payload()[0].get_payload(decode=True) == "Olá!".encode("utf-8")
+        assert data.split(b"\r\n\r\n", 1)[1] == first.split(b"\r\n\r\n", 1)[1]
+
+    def test_8bit(self):
+        prepared = _prepared()
+        assert prepared.has_8bit()
+        assert "Olá!".encode("utf-8") in prepared.as_bytes(eight_bit=True)
+        assert "Olá!".encode("utf-8") not in prepared.as_bytes()
+
+    def test_from_options(self):
+        options = _ready_options(cc=["cc@example.com"])
+        prepared = PreparedMessage.from_options(options)
+        assert prepared.recipients == ["to@example.com", "cc@example.com"]
+        assert prepared.message["Subject"] == "(no subject)"
+
+
+# ---------------------------------------------------------------------------
+# Mailer
+# ---------------------------------------------------------------------------
+class TestMailer:
+    def test_settings_resolved_once(self):
+        mailer = Mailer("smtp.example.com:465", tls=False)
+        assert (mailer.host, mailer.port, mailer.use_tls, mailer.use_ssl) == (
+            "smtp.example.com",
+            "465",
+            False,
+            True,
+        )
+
+    def test_send_over_one_session(self):
+        prepared = _prepared()
+        with SMTPSink(extensions=PIPELINING) as sink:
+            with Mailer(sink.address, ssl=False, tls=False) as mailer:
+                mailer.send(prepared, to="a@example.com")
+                refused = mailer.send(prepared, to=["b@example.com", "reject@example.com"])
+            assert list(refused) == ["reject@example.com"]
+            assert sink.connections == 1
+            assert len(sink.messages) == 2
+            assert b"To: b@example.com, reject@example.com" in sink.messages[1][2]
+            assert b"BODY=8BITMIME" in b"".join(c.encode() for c in sink.commands)
+
+    def test_options_reuse_the_mailer(self):
+        with SMTPSink() as sink:
+            options = _ready_options(smtp_server=sink.address, ssl="false")
+            mailer = Mailer.from_options(options)
+            with patch("simplemail.mailer.parse_server") as parse:
+                connect(mailer.options).quit()
+            parse.assert_not_called()
+
+    def test_package_exports(self):
+        assert simplemail.Mailer is Mailer
+        assert simplemail.PreparedMessage is PreparedMessage
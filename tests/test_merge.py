@@ -0,0 +1,132 @@
+import json
+import os
+import tempfile
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from simplemail.merge import (
+    CompiledTemplate,
+    MergeStats,
+    compile_template,
+    merge_jobs,
+    read_rows,
+    send_merge,
+)
+from tests.test_cli import _ready_options
+
+
+def _write_data(content, suffix):
+    f = tempfile.NamedTemporaryFile(mode="w", suffix=suffix, delete=False, newline="")
+    f.write(content)
+    f.close()
+    return f.name
+
+
+# ---------------------------------------------------------------------------
+# CompiledTemplate
+# ---------------------------------------------------------------------------
+class TestCompiledTemplate:
+    def test_render_named_and_braced(self):
+        template = CompiledTemplate("Hi $name, ${count}x items")
+        assert template.render({"name": "Ann", "count": 3}) == "Hi Ann, 3x items"
+
+    def test_escaped_dollar(self):
+        assert CompiledTemplate("Cost: $$$price").render({"price": "5"}) == "Cost: $5"
+
+    def test_literal_parts_are_kept(self):
+        template = CompiledTemplate("<p>$a</p>")
+        assert template.parts == ["<p>", None, "</p>"]
+        assert template.names == ["a"]
+
+    def test_missing_variable(self):
+        with pytest.raises(ValueError, match='"name"'):
+            CompiledTemplate("Hi $name").render({})
+
+    def test_invalid_placeholder(self):
+        with pytest.raises(ValueError, match="position 3$"):
+            CompiledTemplate("Hi $ there")
+
+    def test_compiled_once(self):
+        assert compile_template("Hi $name") is compile_template("Hi $name")
+
+
+# ---------------------------------------------------------------------------
+# read_rows / merge_jobs
+# ---------------------------------------------------------------------------
+class TestRows:
+    def test_csv(self):
+        path = _write_data("email,name\r\na@example.com,Ann\r\nb@example.com,Bob\r\n", ".csv")
+        try:
+            rows = list(read_rows(path))
+        finally:
+            os.unlink(path)
+        assert rows == [
+            {"email": "a@example.com", "name": "Ann"},
+            {"email": "b@example.com", "name": "Bob"},
+        ]
+
+    def test_jsonl(self):
+        path = _write_data('{"to": "a@example.com"}\n\n["not", "an", "object"]\n', ".jsonl")
+        try:
+            rows = read_rows(path)
+            assert next(rows) == {"to": "a@example.com"}
+            with pytest.raises(ValueError):
+                next(rows)
+        finally:
+            os.unlink(path)
+
+    def test_merge_jobs(self):
+        opts = _ready_options(subject="Hello $name", body=["Dear $name"])
+        rows = [{"email": "a@example.com", "name": "Ann", "bcc": "audit@example.com"}]
+        stats = MergeStats()
+        assert list(merge_jobs(opts, rows, stats)) == [
+            {
+                "to": "a@example.com",
+                "subject": "Hello Ann",
+                "message": "Dear Ann",
+                "bcc": "audit@example.com",
+            }
+        ]
+        assert stats.rendered == 1
+
+    def test_invalid_rows_are_skipped(self):
+        opts = _ready_options(subject="Hello", body=["Dear $name"])
+        rows = [{"name": "Ann"}, {"to": "b@example.com"}, {"to": "c@example.com", "name": "Cy"}]
+        stats = MergeStats()
+        jobs = list(merge_jobs(opts, rows, stats))
+        assert [job["to"] for job in jobs] == ["c@example.com"]
+        assert (stats.rendered, stats.failed) == (1, 2)
+
+
+# ---------------------------------------------------------------------------
+# send_merge
+# ---------------------------------------------------------------------------
+class TestSendMerge:
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_sends_one_message_per_row(self, mock_smtp_cls):
+        mock_server = MagicMock()
+        mock_smtp_cls.return_value = mock_server
+        rows = [{"to": "%s@example.com" % name, "name": name} for name in ("ann", "bob")]
+        path = _write_data("".join(json.dumps(row) + "\n" for row in rows), ".jsonl")
+        try:
+            opts = _ready_options(to=None, subject="For $name", body=["Hello $name"])
+            assert send_merge(opts, path) == 0
+        finally:
+            os.unlink(path)
+        assert mock_smtp_cls.call_count == 1
+        calls = mock_server.sendmail.call_args_list
+        assert [c[0][1] for c in calls] == [["ann@example.com"], ["bob@example.com"]]
+        assert b"Subject: For bob" in bytes(calls[1][0][2])
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_render_failure_returns_1(self, mock_smtp_cls):
+        mock_smtp_cls.return_value = MagicMock()
+        path = _write_data("to\r\na@example.com\r\n", ".csv")
+        try:
+            assert send_merge(_ready_options(body=["Hello $name"]), path) == 1
+        finally:
+            os.unlink(path)
+
+    def test_missing_data_file(self):
+        assert send_merge(_ready_options(), "/nonexistent/rows.csv") == 1
@@ -0,0 +1,133 @@
+import os
+import shutil
+import smtplib
+import tempfile
+import threading
+
+import pytest
+
+from simplemail.outbox import Outbox, deliver, enqueue_email, is_permanent, run_daemon
+from simplemail.session import SMTPSession
+from simplemail.sink import SMTPSink
+from tests.test_cli import _ready_options
+
+
+@pytest.fixture
+def outbox():
+    path = tempfile.mkdtemp()
+    yield Outbox(path)
+    shutil.rmtree(path)
+
+
+class TestOutbox:
+    def test_enqueue_is_atomic(self, outbox):
+        name = outbox.enqueue("from@example.com", ["to@example.com"], b"data")
+        assert os.listdir(os.path.join(outbox.path, "tmp")) == []
+        assert outbox.due() == [name]
+        entry = outbox.claim(name)
+        assert entry.sender == "from@example.com"
+        assert entry.recipients == ["to@example.com"]
+        assert entry.data == b"data"
+
+    def test_claim_only_once(self, outbox):
+        name = outbox.enqueue("from@example.com", ["to@example.com"], b"data")
+        assert outbox.claim(name) is not None
+        assert outbox.claim(name) is None
+
+    def test_recover_interrupted_delivery(self, outbox):
+        name = outbox.enqueue("from@example.com", ["to@example.com"], b"data")
+        outbox.claim(name)
+        assert outbox.due() == []
+        assert outbox.recover() == 1
+        assert outbox.due() == [name]
+
+    def test_retry_is_scheduled(self, outbox):
+        name = outbox.enqueue("from@example.com", ["to@example.com"], b"data")
+        outbox.retry(outbox.claim(name), "boom", delay=3600)
+        assert outbox.due() == []
+        assert len(outbox) == 1
+        assert outbox.due(now=float("inf")) == [name]
+        entry = outbox.claim(name)
+        assert entry.attempts == 1
+        assert entry.envelope["last_error"] == "boom"
+
+    def test_enqueue_email(self, outbox):
+        assert enqueue_email(_ready_options(cc=["cc@example.com"]), outbox) == 0
+        entry = outbox.claim(outbox.due()[0])
+        assert entry.recipients == ["to@example.com", "cc@example.com"]
+        assert b"Subject: (no subject)" in entry.data
+
+
+class TestDeliver:
+    def test_delivers_over_one_connection(self, outbox):
+        for i in range(3):
+            outbox.enqueue("from@example.com", ["user%d@example.com" % i], b"Subject: x\r\n\r\nhi")
+        with SMTPSink() as sink:
+            with SMTPSession(_ready_options(sink)) as session:
+                assert deliver(outbox, session) == (3, 0, 0)
+        assert len(sink.messages) == 3
+        assert sink.connections == 1
+        assert len(outbox) == 0
+        assert os.listdir(os.path.join(outbox.path, "cur")) == []
+
+    def test_backoff_then_dead_letter(self, outbox):
+        outbox.enqueue("from@example.com", ["to@example.com"], b"data")
+        session = SMTPSession(_ready_options(smtp_server="127.0.0.1:1", ssl="false"))
+        assert deliver(outbox, session, max_attempts=2, retry_delay=0) == (0, 1, 0)
+        assert deliver(outbox, session, max_attempts=2, retry_delay=0) == (0, 0, 1)
+        assert len(outbox) == 0
+        assert len(os.listdir(os.path.join(outbox.path, "failed"))) == 1
+
+    def test_permanent_error_is_dead_lettered(self, outbox):
+        outbox.enqueue("from@example.com", ["reject@example.com"], b"data")
+        with SMTPSink() as sink:
+            with SMTPSession(_ready_options(sink)) as session:
+                assert deliver(outbox, session) == (0, 0, 1)
+
+    def test_refused_recipients_are_retried_or_dead_lettered(self, outbox):
+        recipients = ["to@example.com", "defer@example.com", "reject@example.com"]
+        outbox.enqueue("from@example.com", recipients, b"Subject: x\r\n\r\nhi")
+        failed = os.path.join(outbox.path, "failed")
+        with SMTPSink() as sink:
+            with SMTPSession(_ready_options(sink)) as session:
+                assert deliver(outbox, session, max_attempts=2, retry_delay=0) == (0, 1, 1)
+                assert sink.messages[0][1] == ["to@example.com"]
+                [name] = os.listdir(failed)
+                assert outbox._read("failed", name).recipients == ["reject@example.com"]
+                [name] = outbox.due()
+                entry = outbox._read("new", name)
+                assert entry.recipients == ["defer@example.com"] and entry.attempts == 1
+                assert "451" in entry.envelope["last_error"]
+                # The last attempt dead-letters the recipients still refused
+                assert deliver(outbox, session, max_attempts=2, retry_delay=0) == (0, 0, 1)
+        assert len(sink.messages) == 1
+        assert len(outbox) == 0
+        assert os.listdir(os.path.join(outbox.path, "cur")) == []
+        entries = [outbox._read("failed", name) for name in sorted(os.listdir(failed))]
+        assert [entry.recipients for entry in entries] == [
+            ["defer@example.com"],
+            ["reject@example.com"],
+        ]
+
+    def test_is_permanent(self):
+        assert is_permanent(smtplib.SMTPDataError(554, b""))
+        assert not is_permanent(smtplib.SMTPDataError(451, b""))
+        assert not is_permanent(ConnectionRefusedError())
+
+
+class TestRunDaemon:
+    def test_daemon_drains_queue(self, outbox):
+        outbox.enqueue("from@example.com", ["to@example.com"], b"Subject: x\r\n\r\nhi")
+        stop = threading.Event()
+        with SMTPSink() as sink:
+            options = _ready_options(sink)
+            thread = threading.Thread(target=run_daemon, args=(options, outbox, stop, 0.01))
+            thread.start()
+            for _ in range(500):
+                if sink.messages:
+                    break
+                stop.wait(0.01)
+            stop.set()
+            thread.join()
+        assert len(sink.messages) == 1
+        assert len(outbox) == 0
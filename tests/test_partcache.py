@@ -0,0 +1,113 @@
+import os
+import tempfile
+from unittest.mock import MagicMock, patch
+
+from simplemail.batch import send_batch
+from simplemail.binary import message_bytes
+from simplemail.cli import build_message
+from simplemail.partcache import PartCache, with_part_cache
+from tests.test_cli import _ready_options
+
+
+def _write_file(data):
+    f = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+    f.write(data)
+    f.close()
+    return f.name
+
+
+# ---------------------------------------------------------------------------
+# PartCache
+# ---------------------------------------------------------------------------
+class TestPartCache:
+    def setup_method(self):
+        self.path = _write_file(os.urandom(1000))
+
+    def teardown_method(self):
+        os.unlink(self.path)
+
+    def test_hit_after_miss(self):
+        cache = PartCache()
+        first = cache.attachment(self.path)
+        second = cache.attachment(self.path)
+        assert first is not second
+        assert first.get_payload() is second.get_payload()
+        assert (cache.hits, cache.misses, cache.bytes_saved) == (1, 1, 1000)
+
+    def test_cached_part_matches_encoded_part(self):
+        cache = PartCache()
+        first, second = cache.attachment(self.path), cache.attachment(self.path)
+        assert first.as_bytes() == second.as_bytes()
+
+    def test_changed_file_is_encoded_again(self):
+        cache = PartCache()
+        cache.attachment(self.path)
+        with open(self.path, "ab") as f:
+            f.write(b"more")
+        assert cache.attachment(self.path).get_payload(decode=True).endswith(b"more")
+        assert cache.misses == 2
+
+    def test_lru_eviction_by_size(self):
+        other = _write_file(os.urandom(1000))
+        try:
+            # Each encoded payload takes 1352 bytes
+            cache = PartCache(max_bytes=3000)
+            cache.attachment(self.path)
+            cache.attachment(other)
+            cache.attachment(self.path)
+            third = _write_file(os.urandom(1000))
+            try:
+                cache.attachment(third)
+            finally:
+                os.unlink(third)
+            assert cache.size <= 3000
+            cache.attachment(self.path)
+            cache.attachment(other)
+            assert (cache.hits, cache.misses) == (2, 4)
+        finally:
+            os.unlink(other)
+
+    def test_too_big_is_not_cached(self):
+        cache = PartCache(max_bytes=100)
+        cache.attachment(self.path)
+        cache.attachment(self.path)
+        assert (cache.hits, cache.misses, cache.size) == (0, 2, 0)
+
+    def test_with_part_cache(self):
+        opts = _ready_options()
+        cached = with_part_cache(opts)
+        assert isinstance(cached.part_cache, PartCache)
+        assert not hasattr(opts, "part_cache")
+        assert with_part_cache(cached) is cached
+        disabled = with_part_cache(_ready_options(attachment_cache_size=0))
+        assert getattr(disabled, "part_cache", None) is None
+
+
+# ---------------------------------------------------------------------------
+# build_message / send_batch
+# ---------------------------------------------------------------------------
+class TestSharedAttachments:
+    def setup_method(self):
+        self.path = _write_file(os.urandom(5000))
+
+    def teardown_method(self):
+        os.unlink(self.path)
+
+    def test_same_message_with_and_without_cache(self):
+        opts = _ready_options(file=[self.path])
+        cached = with_part_cache(opts)
+        build_message(cached)
+        plain = build_message(opts)
+        msg = build_message(cached)
+        for m in (plain, msg):
+            m.replace_header("Date", "date")
+            m.set_boundary("b")
+        assert bytes(message_bytes(msg)) == bytes(message_bytes(plain))
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_batch_encodes_attachment_once(self, mock_smtp_cls):
+        mock_smtp_cls.return_value = MagicMock()
+        opts = with_part_cache(_ready_options(file=[self.path]))
+        assert send_batch(opts, [{"to": "a@example.com"}] * 4) == 0
+        assert (opts.part_cache.hits, opts.part_cache.misses) == (3, 1)
+        assert opts.part_cache.bytes_saved == 15000
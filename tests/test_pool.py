@@ -0,0 +1,99 @@
+import json
+import os
+import tempfile
+import threading
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from simplemail.batch import send_batch_file
+from simplemail.pool import SMTPConnectionPool, send_pooled
+from tests.test_cli import _ready_options
+
+
+def _healthy_server(*args):
+    server = MagicMock()
+    server.noop.return_value = (250, b"OK")
+    return server
+
+
+class TestSMTPConnectionPool:
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_session_is_reused(self, mock_smtp_cls):
+        mock_smtp_cls.side_effect = _healthy_server
+        with SMTPConnectionPool(_ready_options(), max_size=2) as pool:
+            for _ in range(3):
+                pool.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert mock_smtp_cls.call_count == 1
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_unhealthy_session_is_replaced(self, mock_smtp_cls):
+        mock_smtp_cls.side_effect = _healthy_server
+        with SMTPConnectionPool(_ready_options()) as pool:
+            pool.sendmail("from@example.com", ["to@example.com"], "msg")
+            with pool.session() as session:
+                session.server.noop.side_effect = OSError("broken pipe")
+            pool.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert mock_smtp_cls.call_count == 2
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_idle_session_is_closed(self, mock_smtp_cls):
+        mock_smtp_cls.side_effect = _healthy_server
+        with SMTPConnectionPool(_ready_options(), idle_timeout=0) as pool:
+            pool.sendmail("from@example.com", ["to@example.com"], "msg")
+            pool.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert mock_smtp_cls.call_count == 2
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_message_cap_per_connection(self, mock_smtp_cls):
+        mock_smtp_cls.side_effect = _healthy_server
+        with SMTPConnectionPool(_ready_options(), max_messages=2) as pool:
+            for _ in range(4):
+                pool.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert mock_smtp_cls.call_count == 2
+
+    def test_acquire_timeout_when_exhausted(self):
+        with SMTPConnectionPool(_ready_options(), max_size=1) as pool:
+            pool.acquire()
+            with pytest.raises(TimeoutError):
+                pool.acquire(timeout=0.01)
+
+    def test_invalid_size(self):
+        with pytest.raises(ValueError):
+            SMTPConnectionPool(_ready_options(), max_size=0)
+
+
+class TestSendPooled:
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_concurrent_sessions_bounded_by_workers(self, mock_smtp_cls):
+        lock = threading.Lock()
+        servers = []
+
+        def _factory(*args):
+            server = _healthy_server()
+            with lock:
+                servers.append(server)
+            return server
+
+        mock_smtp_cls.side_effect = _factory
+        jobs = [{"to": "user%d@example.com" % i} for i in range(20)]
+        assert send_pooled(_ready_options(), jobs, workers=3) == 0
+        assert 1 <= len(servers) <= 3
+        assert sum(s.sendmail.call_count for s in servers) == 20
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_failures_are_reported(self, mock_smtp_cls):
+        mock_smtp_cls.side_effect = _healthy_server
+        jobs = [{"to": "a@example.com"}, {"bogus": True}]
+        assert send_pooled(_ready_options(), jobs, workers=2) == 1
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_batch_file_with_workers(self, mock_smtp_cls):
+        mock_smtp_cls.side_effect = _healthy_server
+        with tempfile.NamedTemporaryFile(mode="w", suffix=".jsonl", delete=False) as f:
+            for i in range(5):
+                f.write(json.dumps({"to": "user%d@example.com" % i}) + "\n")
+        try:
+            assert send_batch_file(_ready_options(workers=2), f.name) == 0
+        finally:
+            os.unlink(f.name)
@@ -0,0 +1,88 @@
+import json
+import os
+import threading
+
+import pytest
+
+from simplemail import processes
+from simplemail.batch import send_batch_file
+from simplemail.processes import BuiltMessage, portable_options, send_multiprocess
+from simplemail.sink import SMTPSink
+from tests.test_cli import _make_options, _ready_options
+
+
+def _die(job):
+    os._exit(1)
+
+
+class TestBuiltMessage:
+    def test_small_message_is_pickled(self):
+        built = BuiltMessage("f@example.com", ["t@example.com"], "t@example.com", b"data", 0.1)
+        assert built.shm_name is None
+        assert built.take() == b"data"
+
+    @pytest.mark.skipif(processes.shared_memory is None, reason="requires shared_memory")
+    def test_big_message_uses_shared_memory(self):
+        data = os.urandom(processes.SHARED_MEMORY_THRESHOLD)
+        built = BuiltMessage("f@example.com", ["t@example.com"], "t@example.com", data, 0.1)
+        name = built.shm_name
+        assert name is not None and built.data is None
+        assert built.take() == data
+        with pytest.raises(FileNotFoundError):
+            processes.shared_memory.SharedMemory(name=name)
+
+    @pytest.mark.skipif(processes.shared_memory is None, reason="requires shared_memory")
+    def test_release(self):
+        data = os.urandom(processes.SHARED_MEMORY_THRESHOLD)
+        built = BuiltMessage("f@example.com", ["t@example.com"], "t@example.com", data, 0.1)
+        name = built.shm_name
+        built.release()
+        built.release()
+        with pytest.raises(FileNotFoundError):
+            processes.shared_memory.SharedMemory(name=name)
+
+    def test_portable_options(self):
+        options = _make_options(workers=2, rate_limiter=threading.Lock())
+        portable = portable_options(options)
+        assert portable.workers == 2
+        assert not hasattr(portable, "rate_limiter")
+        assert hasattr(options, "rate_limiter")
+
+
+class TestSendMultiprocess:
+    def test_sends_all_jobs(self, tmp_path):
+        attachment = tmp_path / "big.bin"
+        attachment.write_bytes(os.urandom(processes.SHARED_MEMORY_THRESHOLD))
+        jobs = [
+            {"to": "user%d@example.com" % i, "attachments": [str(attachment)]} for i in range(6)
+        ]
+        jobs.append({"to": "small@example.com"})
+        with SMTPSink() as sink:
+            assert send_multiprocess(_ready_options(sink), jobs, processes=2, workers=2) == 0
+        assert sorted(rcpts[0] for _, rcpts, _ in sink.messages) == sorted(
+            job["to"] for job in jobs
+        )
+        big = [
+            data for _, _, data in sink.messages if len(data) > processes.SHARED_MEMORY_THRESHOLD
+        ]
+        assert len(big) == 6
+
+    def test_failed_jobs(self, tmp_path):
+        jobs = [{"to": "a@example.com"}, {"unknown": 1}, {"to": "b@example.com", "message": "x"}]
+        with SMTPSink() as sink:
+            assert send_multiprocess(_ready_options(sink), jobs, processes=2) == 1
+            assert len(sink.messages) == 2
+
+    def test_dead_worker_fails_the_batch(self, monkeypatch):
+        monkeypatch.setattr(processes, "build_job", _die)
+        jobs = [{"to": "u%d@example.com" % i} for i in range(20)]
+        with SMTPSink() as sink:
+            assert send_multiprocess(_ready_options(sink), jobs, processes=2) == 1
+            assert sink.messages == []
+
+    def test_batch_file(self, tmp_path):
+        path = tmp_path / "jobs.jsonl"
+        path.write_text("\n".join(json.dumps({"to": "u%d@example.com" % i}) for i in range(3)))
+        with SMTPSink() as sink:
+            assert send_batch_file(_ready_options(sink, processes=2), str(path)) == 0
+            assert len(sink.messages) == 3
@@ -0,0 +1,76 @@
+import smtplib
+from unittest.mock import patch
+
+import pytest
+
+from simplemail.protocol import check_envelope_replies, envelope_commands, quote_data, sendmail
+from simplemail.sink import SMTPSink
+
+_original_send = smtplib.SMTP.send
+
+
+def _connect(sink):
+    host, port = sink.address.split(":")
+    server = smtplib.SMTP(host, int(port))
+    server.ehlo()
+    return server
+
+
+class TestQuoteData:
+    def test_dot_stuffing_and_terminator(self):
+        assert quote_data(b"a\n.b\r\n..c") == b"a\r\n..b\r\n...c\r\n.\r\n"
+
+    def test_keeps_final_crlf(self):
+        assert quote_data(b"a\r\n") == b"a\r\n.\r\n"
+
+
+class TestEnvelope:
+    def test_envelope_commands(self):
+        assert envelope_commands("f@x.com", ["a@x.com", "b@x.com"], ["size=10"]) == (
+            b"MAIL FROM:<f@x.com> size=10\r\nRCPT TO:<a@x.com>\r\nRCPT TO:<b@x.com>\r\nDATA\r\n"
+        )
+
+    def test_sender_refused(self):
+        with pytest.raises(smtplib.SMTPSenderRefused):
+            check_envelope_replies("f@x.com", ["a@x.com"], [(550, b""), (503, b""), (503, b"")])
+
+    def test_partial_refusal(self):
+        replies = [(250, b""), (550, b"no"), (250, b""), (354, b"")]
+        refused = check_envelope_replies("f@x.com", ["a@x.com", "b@x.com"], replies)
+        assert refused == {"a@x.com": (550, b"no")}
+
+    def test_all_refused(self):
+        replies = [(250, b""), (550, b"no"), (554, b"")]
+        with pytest.raises(smtplib.SMTPRecipientsRefused):
+            check_envelope_replies("f@x.com", ["a@x.com"], replies)
+
+
+class TestSendmail:
+    def test_pipelined_envelope_is_one_write(self):
+        rcpts = ["user%d@example.com" % i for i in range(50)] + ["reject@example.com"]
+        with SMTPSink(extensions=("PIPELINING", "SIZE")) as sink:
+            server = _connect(sink)
+            with patch.object(smtplib.SMTP, "send", autospec=True, side_effect=_original_send) as m:
+                refused = sendmail(server, "from@example.com", rcpts, "Subject: hi\n\nbody\n")
+            server.quit()
+        # One write for the envelope and one for the content
+        assert m.call_count == 2
+        assert list(refused) == ["reject@example.com"]
+        assert sink.messages[0][1] == rcpts[:-1]
+
+    def test_fallback_without_pipelining(self):
+        with SMTPSink(extensions=("SIZE",)) as sink:
+            server = _connect(sink)
+            refused = sendmail(server, "from@example.com", ["a@example.com"], "body")
+            server.quit()
+        assert refused == {}
+        assert len(sink.messages) == 1
+
+    def test_pipelined_all_refused_keeps_connection_usable(self):
+        with SMTPSink(extensions=("PIPELINING",)) as sink:
+            server = _connect(sink)
+            with pytest.raises(smtplib.SMTPRecipientsRefused):
+                sendmail(server, "from@example.com", ["reject@example.com"], "body")
+            sendmail(server, "from@example.com", ["a@example.com"], "body")
+            server.quit()
+        assert len(sink.messages) == 1
@@ -0,0 +1,138 @@
+import smtplib
+from unittest.mock import MagicMock, patch
+
+import pytest
+
+from simplemail.ratelimit import RateLimiter, TokenBucket, is_throttled, with_rate_limiter
+from simplemail.session import SMTPSession
+from tests.test_cli import _ready_options
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def _limited_options(limiter, **overrides):
+    opts = _ready_options(**overrides)
+    opts.rate_limiter = limiter
+    return opts
+
+
+# ---------------------------------------------------------------------------
+# TokenBucket
+# ---------------------------------------------------------------------------
+class TestTokenBucket:
+    def test_burst_then_rate(self):
+        clock = _Clock()
+        bucket = TokenBucket(2, clock=clock)
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == pytest.approx(0.5)
+        assert bucket.reserve() == pytest.approx(1.0)
+        clock.now = 1.0
+        assert bucket.reserve() == pytest.approx(0.5)
+
+    def test_bigger_than_capacity(self):
+        bucket = TokenBucket(10, clock=_Clock())
+        assert bucket.reserve(30) == pytest.approx(2.0)
+
+    def test_refill_is_capped(self):
+        clock = _Clock()
+        bucket = TokenBucket(1, capacity=3, clock=clock)
+        clock.now = 100
+        for _ in range(3):
+            assert bucket.reserve() == 0
+        assert bucket.reserve() == pytest.approx(1.0)
+
+
+# ---------------------------------------------------------------------------
+# RateLimiter
+# ---------------------------------------------------------------------------
+class TestRateLimiter:
+    def test_messages_and_recipients(self):
+        clock = _Clock()
+        limiter = RateLimiter(100, 60, clock=clock, sleep=clock.sleep)
+        limiter.wait(1)
+        assert clock.now == 0
+        # 60 recipients per minute: 1 token per second
+        limiter.wait(3)
+        assert clock.now == pytest.approx(3.0)
+
+    def test_throttle_and_recover(self):
+        clock = _Clock()
+        limiter = RateLimiter(8, clock=clock, sleep=clock.sleep)
+        limiter.throttle()
+        assert limiter.messages.rate == 4
+        # The bucket is drained, so the next message waits for the reduced rate
+        assert limiter.reserve() == pytest.approx(0.25)
+        limiter.throttle()
+        assert limiter.messages.rate == 2
+        for _ in range(100):
+            limiter.accepted()
+        assert limiter.factor == 1.0
+        assert limiter.messages.rate == 8
+
+    def test_is_throttled(self):
+        assert is_throttled(smtplib.SMTPDataError(451, b"slow down"))
+        assert is_throttled(smtplib.SMTPSenderRefused(421, b"busy", "f"))
+        assert is_throttled(smtplib.SMTPRecipientsRefused({"a": (452, b"too many")}))
+        assert not is_throttled(smtplib.SMTPRecipientsRefused({"a": (452, b""), "b": (550, b"")}))
+        assert not is_throttled(smtplib.SMTPDataError(554, b"rejected"))
+        assert not is_throttled(OSError())
+
+    def test_with_rate_limiter(self):
+        opts = _ready_options()
+        assert with_rate_limiter(opts) is opts
+        opts.messages_per_second = 5
+        limited = with_rate_limiter(opts)
+        assert limited.rate_limiter.messages.rate == 5
+        assert with_rate_limiter(limited) is limited
+
+
+# ---------------------------------------------------------------------------
+# SMTPSession
+# ---------------------------------------------------------------------------
+class TestThrottledSession:
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_retries_temporary_errors_more_slowly(self, mock_smtp_cls):
+        mock_server = MagicMock()
+        mock_server.sendmail.side_effect = [smtplib.SMTPDataError(451, b"rate limited"), {}]
+        mock_smtp_cls.return_value = mock_server
+        clock = _Clock()
+        limiter = RateLimiter(10, clock=clock, sleep=clock.sleep)
+        with SMTPSession(_limited_options(limiter)) as session:
+            session.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert mock_server.sendmail.call_count == 2
+        assert limiter.throttled == 1
+        assert clock.now == pytest.approx(0.2)
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_gives_up_after_max_retries(self, mock_smtp_cls):
+        mock_server = MagicMock()
+        mock_server.sendmail.side_effect = smtplib.SMTPDataError(451, b"rate limited")
+        mock_smtp_cls.return_value = mock_server
+        clock = _Clock()
+        limiter = RateLimiter(10, max_retries=2, clock=clock, sleep=clock.sleep)
+        with SMTPSession(_limited_options(limiter)) as session:
+            with pytest.raises(smtplib.SMTPDataError):
+                session.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert mock_server.sendmail.call_count == 3
+
+    @patch("simplemail.cli.smtplib.SMTP")
+    def test_permanent_errors_are_not_retried(self, mock_smtp_cls):
+        mock_server = MagicMock()
+        mock_server.sendmail.side_effect = smtplib.SMTPDataError(554, b"rejected")
+        mock_smtp_cls.return_value = mock_server
+        limiter = RateLimiter(10, sleep=lambda seconds: None)
+        with SMTPSession(_limited_options(limiter)) as session:
+            with pytest.raises(smtplib.SMTPDataError):
+                session.sendmail("from@example.com", ["to@example.com"], "msg")
+        assert mock_server.sendmail.call_count == 1
+        assert limiter.throttled == 0
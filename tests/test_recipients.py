@@ -0,0 +1,79 @@
+from argparse import Namespace
+
+import pytest
+
+from simplemail.batch import job_options
+from simplemail.recipients import RecipientSet, address_key, process_recipients
+from tests.test_cli import _ready_options
+
+
+# ---------------------------------------------------------------------------
+# address_key
+# ---------------------------------------------------------------------------
+class TestAddressKey:
+    @pytest.mark.parametrize(
+        "address, key",
+        [
+            ("user@example.com", "user@example.com"),
+            ("First.Last+tag@Example.COM", "first.last+tag@example.com"),
+            ("Ann Smith <Ann@example.com>", "ann@example.com"),
+            ('"john doe"@example.com', '"john doe"@example.com'),
+            ("user@[192.0.2.1]", "user@[192.0.2.1]"),
+            ("postmaster@localhost", "postmaster@localhost"),
+        ],
+    )
+    def test_valid(self, address, key):
+        assert address_key(address) == key
+
+    @pytest.mark.parametrize(
+        "address",
+        [
+            "user.example.com",
+            "user@",
+            "@example.com",
+            "us er@example.com",
+            "user..name@example.com",
+            "user@-example.com",
+            "user@exa_mple.com",
+            "usér@example.com",
+            "Ann <ann@example.com",
+            "%s@example.com" % ("a" * 65),
+        ],
+    )
+    def test_invalid(self, address):
+        assert address_key(address) is None
+
+    def test_lowercase_address_is_not_copied(self):
+        address = "user@example.com"
+        assert address_key(address) is address
+
+
+# ---------------------------------------------------------------------------
+# RecipientSet / process_recipients
+# ---------------------------------------------------------------------------
+class TestRecipients:
+    def test_duplicates_and_invalid(self):
+        recipients = RecipientSet()
+        recipients.update(["a@example.com", " A@Example.com ", "bad", "b@example.com"])
+        assert recipients.to == ["a@example.com", "b@example.com"]
+        assert (len(recipients), recipients.duplicates, recipients.invalid) == (2, 1, 1)
+
+    def test_first_kind_wins(self, tmp_path):
+        path = tmp_path / "bcc.txt"
+        path.write_text("# subscribers\nc@example.com\n\nA@example.com\n  d@example.com  \n")
+        options = Namespace(
+            to=["a@example.com"], cc=["c@example.com", "a@example.com"], bcc=None, bcc_file=path
+        )
+        recipients = process_recipients(options)
+        assert options.to == ["a@example.com"]
+        assert options.cc == ["c@example.com"]
+        assert options.bcc == ["d@example.com"]
+        assert recipients.duplicates == 3
+
+    def test_job_recipients(self):
+        options = _ready_options()
+        job = {"to": ["x@example.com", "X@example.com"], "bcc": ["x@example.com", "y@example.com"]}
+        job_opts = job_options(options, job)
+        assert (job_opts.to, job_opts.bcc) == (["x@example.com"], ["y@example.com"])
+        with pytest.raises(ValueError):
+            job_options(options, {"to": "not-an-address"})
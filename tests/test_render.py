@@ -0,0 +1,122 @@
+import email
+import json
+import mailbox
+import os
+
+import pytest
+
+from simplemail import render
+from simplemail.batch import send_batch_file
+from simplemail.merge import send_merge
+from simplemail.render import (
+    MboxWriter,
+    parse_output,
+    render_email,
+    render_jobs,
+)
+from tests.test_cli import _ready_options
+
+
+def _read(paths):
+    return [email.message_from_bytes(open(path, "rb").read()) for path in sorted(paths)]
+
+
+# ---------------------------------------------------------------------------
+# parse_output
+# ---------------------------------------------------------------------------
+class TestParseOutput:
+    def test_targets(self):
+        assert parse_output("maildir:/tmp/mail") == ("maildir", "/tmp/mail")
+        assert parse_output("mbox:C:/mail.mbox") == ("mbox", "C:/mail.mbox")
+
+    @pytest.mark.parametrize("target", ["/tmp/mail", "mbox:", "pst:/tmp/mail.pst"])
+    def test_invalid(self, target):
+        with pytest.raises(ValueError):
+            parse_output(target)
+
+
+# ---------------------------------------------------------------------------
+# Writers
+# ---------------------------------------------------------------------------
+class TestWriters:
+    def test_maildir(self, tmp_path):
+        path = tmp_path / "Maildir"
+        assert render_email(_ready_options(output="maildir:%s" % path, subject="Olá")) == 0
+        assert os.listdir(path / "tmp") == []
+        box = mailbox.Maildir(str(path), factory=None)
+        [msg] = list(box)
+        assert msg["Subject"] == "=?utf-8?q?Ol=C3=A1?=" and msg["To"] == "to@example.com"
+        assert b"\r\n" not in open(path / "new" / os.listdir(path / "new")[0], "rb").read()
+
+    def test_mbox(self, tmp_path):
+        path = tmp_path / "mail.mbox"
+        for _ in range(2):
+            assert render_email(_ready_options(output="mbox:%s" % path)) == 0
+        messages = list(mailbox.mbox(str(path)))
+        assert len(messages) == 2
+        assert messages[1].get_from().startswith("from@example.com ")
+        assert messages[1].get_payload(0).get_payload(decode=True) == b"Hello"
+
+    def test_mbox_quotes_from_lines(self, tmp_path):
+        with MboxWriter(str(tmp_path / "mail.mbox")) as writer:
+            writer.write("Sender <from@example.com>", b"Subject: x\r\n\r\nFrom a\r\n>From b")
+        data = open(tmp_path / "mail.mbox", "rb").read()
+        assert data.startswith(b"From from@example.com ")
+        assert data.endswith(b"\nSubject: x\n\n>From a\n>>From b\n\n")
+
+    def test_eml_dir_sync_batches(self, tmp_path, monkeypatch):
+        synced = []
+        monkeypatch.setattr(render.os, "fsync", lambda fd: synced.append(fd))
+        jobs = [{"to": "user%d@example.com" % i} for i in range(5)]
+        options = _ready_options(output="eml-dir:%s" % tmp_path, output_sync=2)
+        assert render_jobs(options, jobs) == 0
+        names = sorted(os.listdir(tmp_path))
+        assert [msg["To"] for msg in _read(tmp_path / name for name in names)] == [
+            job["to"] for job in jobs
+        ]
+        assert open(tmp_path / names[0], "rb").read().count(b"\r\n") > 0
+        # 3 syncs (2 + 2 + 1 files) of the files and of the directory
+        assert len(synced) == 5 + 3
+
+    def test_writers_implement_write(self):
+        with pytest.raises(TypeError):
+            render.OutputWriter("out")
+
+    def test_no_sync(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(render.os, "fsync", pytest.fail)
+        with MboxWriter(str(tmp_path / "mail.mbox"), sync_every=0) as writer:
+            writer.write("Sender <from@example.com>", b"Subject: x\r\n\r\nbody\r\n")
+        assert open(tmp_path / "mail.mbox", "rb").read().endswith(b"\n\nbody\n\n")
+
+
+# ---------------------------------------------------------------------------
+# Batch and mail merge
+# ---------------------------------------------------------------------------
+class TestRenderJobs:
+    def test_failed_jobs(self, tmp_path):
+        jobs = [{"to": "a@example.com"}, {"unknown": 1}, {"to": "b@example.com"}]
+        assert render_jobs(_ready_options(output="maildir:%s" % tmp_path), jobs) == 1
+        assert len(os.listdir(tmp_path / "new")) == 2
+
+    def test_processes_keep_the_order(self, tmp_path):
+        path = tmp_path / "jobs.jsonl"
+        jobs = [{"to": "u%d@example.com" % i, "subject": str(i)} for i in range(7)]
+        path.write_text("\n".join(json.dumps(job) for job in jobs))
+        output = tmp_path / "out"
+        options = _ready_options(output="eml-dir:%s" % output, processes=2)
+        assert send_batch_file(options, str(path)) == 0
+        messages = _read(output / name for name in os.listdir(output))
+        assert [msg["Subject"] for msg in messages] == [job["subject"] for job in jobs]
+
+    def test_merge(self, tmp_path):
+        data = tmp_path / "data.csv"
+        data.write_text("email,name\na@example.com,Ana\nb@example.com,Bruno\n")
+        options = _ready_options(
+            output="mbox:%s" % (tmp_path / "merge.mbox"),
+            sender="from@example.com",
+            body=["Hi $name"],
+        )
+        assert send_merge(options, str(data)) == 0
+        messages = list(mailbox.mbox(str(tmp_path / "merge.mbox")))
+        payloads = [msg.get_payload(0).get_payload(decode=True) for msg in messages]
+        assert payloads == [b"Hi Ana", b"Hi Bruno"]
@@ -0,0 +1,39 @@
+import smtplib
+
+import pytest
+
+from simplemail.cli import connect
+from simplemail.sink import SMTPSink
+from tests.test_cli import _ready_options
+
+
+# ---------------------------------------------------------------------------
+# SMTPSink
+# ---------------------------------------------------------------------------
+class TestSink:
+    def test_starttls(self):
+        with SMTPSink(tls="starttls") as sink:
+            server = connect(_ready_options(sink, tls="true"))
+            assert server.sock.version() is not None
+            server.sendmail("from@example.com", ["to@example.com"], b"body")
+            server.quit()
+        assert sink.messages[0][1] == ["to@example.com"]
+        assert [c.split(" ")[0].lower() for c in sink.commands[:3]] == ["ehlo", "starttls", "ehlo"]
+
+    def test_implicit_tls(self):
+        with SMTPSink(tls="ssl") as sink:
+            server = connect(_ready_options(sink, ssl="true"))
+            server.sendmail("from@example.com", ["to@example.com"], b"body")
+            server.quit()
+        assert len(sink.messages) == 1
+
+    def test_count_only(self):
+        with SMTPSink(keep_messages=False) as sink:
+            server = smtplib.SMTP(*sink.address.split(":"))
+            server.sendmail("from@example.com", ["to@example.com"], b"body")
+            server.quit()
+        assert (sink.received, sink.messages) == (1, [])
+
+    def test_unknown_tls_mode(self):
+        with pytest.raises(ValueError):
+            SMTPSink(tls="tls")
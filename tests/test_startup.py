@@ -0,0 +1,117 @@
+import os
+import subprocess
+import sys
+
+import simplemail
+
+# Budget for the cumulative import time of "simplemail.cli", in microseconds
+IMPORT_BUDGET_US = int(os.environ.get("SIMPLEMAIL_IMPORT_BUDGET_US", 50000))
+# Budget for the total import time of a plain send through main(), in microseconds
+SEND_IMPORT_BUDGET_US = int(os.environ.get("SIMPLEMAIL_SEND_IMPORT_BUDGET_US", 150000))
+HEAVY_MODULES = ["smtplib", "ssl", "socket", "configparser", "email.mime.multipart"]
+# The modules of the batch, daemon and broker modes, which a single message doesn't need
+BULK_MODULES = [
+    "concurrent.futures",
+    "configparser",
+    "email.mime.application",
+    "json",
+    "logging.handlers",
+    "queue",
+    "socketserver",
+    "simplemail.broker",
+    "simplemail.smtpdebug",
+]
+# A plain message to a closed port: main() goes up to the connect and fails there
+PLAIN_SEND = ["-f", "a@example.com", "-t", "b@example.com", "-m", "Hi", "-s", "127.0.0.1:1"]
+
+
+def _importtime(*args, home=None):
+    env = dict(os.environ)
+    if home is not None:
+        # No configuration file nor broker socket
+        env["HOME"] = str(home)
+    src = os.path.dirname(os.path.dirname(os.path.abspath(simplemail.__file__)))
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [src, env.get("PYTHONPATH")]))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime"] + list(args),
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    # Lines: "import time: <self us> | <cumulative us> | <indented module name>"
+    modules = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            modules[name.strip()] = int(cumulative)
+    return proc, modules
+
+
+# The total import time, i.e. the sum of the cumulative time of the top level imports
+def _total_us(proc):
+    total = 0
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit() and not name.startswith("  "):
+            total += int(cumulative)
+    return total
+
+
+# ---------------------------------------------------------------------------
+# Import time
+# ---------------------------------------------------------------------------
+class TestStartup:
+    def test_cli_import_is_light(self):
+        _, modules = _importtime("-c", "import simplemail.cli")
+        assert "simplemail.cli" in modules
+        assert [m for m in HEAVY_MODULES if m in modules] == []
+
+    def test_help_is_light(self):
+        proc, modules = _importtime("-m", "simplemail", "--help")
+        assert proc.returncode == 0
+        assert "usage:" in proc.stdout
+        assert [m for m in HEAVY_MODULES if m in modules] == []
+
+    def test_plain_message_skips_attachment_modules(self):
+        script = (
+            "import sys\n"
+            "from argparse import Namespace\n"
+            "from simplemail.cli import build_message\n"
+            "build_message(Namespace(sender='a@example.com', to=['b@example.com'], cc=None,\n"
+            "    bcc=None, subject='Hi', body=['Hello'], file=None, content_type='text/plain',\n"
+            "    charset='utf-8'))\n"
+            "print('email.mime.application' in sys.modules)\n"
+        )
+        proc, _ = _importtime("-c", script)
+        assert proc.stdout.strip() == "False", proc.stderr[-500:]
+
+    def test_import_time_budget(self):
+        # The best of a few runs, so a busy machine doesn't fail the test
+        runs = [_importtime("-c", "import simplemail.cli")[1] for _ in range(3)]
+        best = min(modules["simplemail.cli"] for modules in runs)
+        assert best < IMPORT_BUDGET_US
+
+    def test_plain_send_skips_bulk_modules(self, tmp_path):
+        script = (
+            "import sys\n"
+            "from simplemail.cli import main\n"
+            "sys.argv = ['simplemail'] + %r\n"
+            "try:\n"
+            "    main()\n"
+            "except SystemExit:\n"
+            "    pass\n"
+            "print('smtplib' in sys.modules)\n"
+            "print(sorted(m for m in %r if m in sys.modules))\n" % (PLAIN_SEND, BULK_MODULES)
+        )
+        proc, _ = _importtime("-c", script, home=tmp_path)
+        assert proc.stdout.split("\n")[:2] == ["True", "[]"], proc.stderr[-500:]
+
+    def test_plain_send_import_time_budget(self, tmp_path):
+        runs = [_importtime("-m", "simplemail", *PLAIN_SEND, home=tmp_path) for _ in range(3)]
+        # It failed at the connect, after importing everything a send needs
+        assert all("smtplib" in modules for _, modules in runs)
+        assert min(_total_us(proc) for proc, _ in runs) < SEND_IMPORT_BUDGET_US
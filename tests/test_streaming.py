@@ -0,0 +1,129 @@
+import base64
+import email
+import io
+import os
+import tempfile
+import tracemalloc
+from argparse import Namespace
+
+import pytest
+
+from simplemail.cli import send_email
+from simplemail.sink import SMTPSink
+from simplemail.streaming import (
+    StreamingMessage,
+    encoded_size,
+    iter_base64,
+    iter_base64_stream,
+)
+from tests.test_cli import _ready_options
+
+
+@pytest.fixture
+def attachment():
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".bin") as f:
+        f.write(os.urandom(1000003))
+    yield f.name
+    os.unlink(f.name)
+
+
+def _unstuff(data):
+    assert data.endswith(b"\r\n.\r\n")
+    lines = data[:-3].split(b"\r\n")
+    return b"\r\n".join(line[1:] if line.startswith(b".") else line for line in lines)
+
+
+class TestIterBase64:
+    @pytest.mark.parametrize("use_mmap", [False, True])
+    def test_encoded_size_matches(self, attachment, use_mmap):
+        encoded = b"".join(iter_base64(attachment, chunk_size=1000, use_mmap=use_mmap))
+        assert len(encoded) == encoded_size(os.path.getsize(attachment))
+        assert all(len(line) <= 76 for line in encoded.split(b"\r\n"))
+
+    def test_empty_file(self):
+        with tempfile.NamedTemporaryFile(delete=False) as f:
+            pass
+        try:
+            assert list(iter_base64(f.name, use_mmap=True)) == []
+            assert encoded_size(0) == 0
+        finally:
+            os.unlink(f.name)
+
+
+class _Pipe(io.BytesIO):
+    # A pipe returns less bytes than requested
+    def read(self, size=-1):
+        return super().read(min(size, 1000))
+
+
+class TestIterBase64Stream:
+    def test_short_reads(self, attachment):
+        with open(attachment, "rb") as f:
+            data = f.read()
+        encoded = b"".join(iter_base64_stream(_Pipe(data), chunk_size=57 * 100))
+        assert encoded == b"".join(iter_base64(attachment))
+        assert base64.b64decode(encoded) == data
+
+
+class TestStreamingMessage:
+    @pytest.mark.parametrize("use_mmap", [False, True])
+    def test_round_trip(self, attachment, use_mmap):
+        opts = _ready_options(body=[".leading dot"], file=[attachment])
+        msg = StreamingMessage(opts, use_mmap=use_mmap)
+        content = b"".join(msg.iter_chunks())
+        assert len(content) - 3 == msg.size()
+        parsed = email.message_from_bytes(_unstuff(content))
+        assert parsed["From"] == "from@example.com"
+        body, part = parsed.get_payload()
+        assert body.get_payload(decode=True) == b".leading dot"
+        assert part.get_filename() == os.path.basename(attachment)
+        with open(attachment, "rb") as f:
+            assert part.get_payload(decode=True) == f.read()
+
+    def test_body_from_stdin(self, attachment, monkeypatch):
+        body = os.urandom(200000)
+        monkeypatch.setattr("sys.stdin", Namespace(buffer=_Pipe(body)))
+        opts = _ready_options(body=["-"], file=[attachment])
+        msg = StreamingMessage(opts)
+        assert msg.size() is None
+        parsed = email.message_from_bytes(_unstuff(b"".join(msg.iter_chunks())))
+        text, part = parsed.get_payload()
+        assert text.get_content_type() == "text/html"
+        assert text.get_content_charset() == "utf-8"
+        assert text.get_payload(decode=True) == body
+        with open(attachment, "rb") as f:
+            assert part.get_payload(decode=True) == f.read()
+
+    def test_memory_is_bounded(self, attachment):
+        opts = _ready_options(file=[attachment] * 8)
+        msg = StreamingMessage(opts, chunk_size=57 * 256)
+        tracemalloc.start()
+        try:
+            for _ in msg.iter_chunks():
+                pass
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        assert peak < 1000003
+
+
+class TestSendStreaming:
+    @pytest.mark.parametrize("extensions", [("AUTH PLAIN", "SIZE"), ("AUTH PLAIN", "PIPELINING")])
+    def test_send_email_streaming(self, attachment, extensions):
+        with SMTPSink(extensions=extensions) as sink:
+            opts = _ready_options(sink, file=[attachment])
+            opts.stream = True
+            assert send_email(opts) == 0
+        parsed = email.message_from_bytes(sink.messages[0][2])
+        with open(attachment, "rb") as f:
+            assert parsed.get_payload()[1].get_payload(decode=True) == f.read()
+
+    def test_send_body_from_stdin(self, monkeypatch):
+        monkeypatch.setattr("sys.stdin", Namespace(buffer=_Pipe(b"<p>report</p>" * 10000)))
+        with SMTPSink(extensions=("AUTH PLAIN", "SIZE")) as sink:
+            opts = _ready_options(sink, body=["-"])
+            opts.stream = True
+            assert send_email(opts) == 0
+            assert not any("SIZE=" in c.upper() for c in sink.commands)
+        parsed = email.message_from_bytes(sink.messages[0][2])
+        assert parsed.get_payload()[0].get_payload(decode=True) == b"<p>report</p>" * 10000
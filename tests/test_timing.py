@@ -0,0 +1,170 @@
+import asyncio
+import logging
+import socket
+import ssl
+
+import pytest
+
+from simplemail import timing
+from simplemail.aio import AsyncMailer
+from simplemail.batch import send_batch
+from simplemail.cli import send_email
+from simplemail.sink import SMTPSink, sink_certificate
+from simplemail.timing import PrometheusExporter, StatsDExporter, Timings
+from tests.test_cli import _ready_options
+
+PIPELINING = ("AUTH PLAIN LOGIN", "PIPELINING")
+
+
+@pytest.fixture
+def recorded():
+    records = []
+    hook = timing.add_hook(records.append)
+    yield records
+    timing.remove_hook(hook)
+
+
+def _timings(phases, ok=True, total=0.02, size=100, recipients=1):
+    timings = Timings()
+    timings.phases = dict(phases)
+    timings.ok = ok
+    timings.total = total
+    timings.bytes = size
+    timings.recipients = recipients
+    return timings
+
+
+# ---------------------------------------------------------------------------
+# measure / phase
+# ---------------------------------------------------------------------------
+class TestMeasure:
+    def test_disabled_without_hooks(self):
+        level = logging.root.level
+        logging.root.setLevel(logging.WARNING)
+        try:
+            with timing.measure() as timings:
+                with timing.phase("build"):
+                    pass
+            assert timings is None
+        finally:
+            logging.root.setLevel(level)
+
+    def test_phases_accumulate_and_nest(self, recorded):
+        with timing.measure() as timings:
+            with timing.measure() as nested:
+                for _ in range(2):
+                    with timing.phase("data"):
+                        pass
+            timing.count(10, 2)
+        assert nested is None
+        assert recorded == [timings]
+        assert list(timings.phases) == ["data"]
+        assert (timings.bytes, timings.recipients, timings.ok) == (10, 2, True)
+
+    def test_failure(self, recorded):
+        with pytest.raises(ValueError):
+            with timing.measure():
+                raise ValueError("boom")
+        assert (recorded[0].ok, recorded[0].error) == (False, "boom")
+
+    def test_broken_hook_is_logged(self, recorded, caplog):
+        def _broken(timings):
+            raise RuntimeError("broken")
+
+        timing.add_hook(_broken)
+        try:
+            with timing.measure():
+                pass
+        finally:
+            timing.remove_hook(_broken)
+        assert len(recorded) == 1
+        assert "broken" in caplog.text
+
+
+# ---------------------------------------------------------------------------
+# Instrumented deliveries
+# ---------------------------------------------------------------------------
+class TestDeliveries:
+    def test_send_email(self, recorded):
+        with SMTPSink(extensions=PIPELINING, tls="starttls") as sink:
+            assert send_email(_ready_options(sink, tls="true")) == 0
+        assert len(recorded) == 1
+        phases = list(recorded[0].phases)
+        assert phases == ["build", "connect", "tls", "auth", "envelope", "data", "quit"]
+        assert recorded[0].bytes > 0
+        assert recorded[0].recipients == 1
+
+    def test_envelope_within_data_without_pipelining(self, recorded):
+        with SMTPSink() as sink:
+            assert send_email(_ready_options(sink)) == 0
+        assert "envelope" not in recorded[0].phases
+        assert "data" in recorded[0].phases
+
+    def test_batch_reuses_the_connection(self, recorded):
+        with SMTPSink() as sink:
+            jobs = [{"to": "a@example.com"}, {"to": ["b@example.com", "reject@example.com"]}]
+            assert send_batch(_ready_options(sink), jobs) == 0
+        assert len(recorded) == 2
+        assert "connect" in recorded[0].phases
+        assert "connect" not in recorded[1].phases
+        assert "rset" in recorded[1].phases
+        assert recorded[1].recipients == 1
+
+    def test_failed_delivery(self, recorded):
+        with SMTPSink(extensions=PIPELINING) as sink:
+            options = _ready_options(sink, to=["reject@example.com"])
+            assert send_email(options) == 1
+        assert recorded[0].ok is False
+        assert "envelope" in recorded[0].phases
+
+    def test_async(self, recorded):
+        async def _run(options):
+            context = ssl.create_default_context(cafile=sink_certificate())
+            async with AsyncMailer(options, ssl_context=context) as mailer:
+                await mailer.send_options(options)
+
+        with SMTPSink(tls="starttls") as sink:
+            asyncio.run(_run(_ready_options(sink, tls="true")))
+        assert list(recorded[0].phases) == ["build", "connect", "tls", "auth", "envelope", "data"]
+        assert recorded[0].recipients == 1
+
+
+# ---------------------------------------------------------------------------
+# Exporters
+# ---------------------------------------------------------------------------
+class TestExporters:
+    def test_prometheus(self, tmp_path):
+        path = tmp_path / "simplemail.prom"
+        exporter = PrometheusExporter(str(path), interval=3600)
+        exporter(_timings({"connect": 0.01, "data": 0.002}))
+        exporter(_timings({"data": 0.004}, ok=False, total=2.0))
+        exporter.flush()
+        text = path.read_text()
+        assert 'simplemail_phase_seconds_sum{phase="data"} 0.006000' in text
+        assert 'simplemail_phase_seconds_count{phase="connect"} 1' in text
+        assert 'simplemail_delivery_seconds_bucket{le="0.025"} 1' in text
+        assert 'simplemail_delivery_seconds_bucket{le="+Inf"} 2' in text
+        assert 'simplemail_messages_total{result="failed"} 1' in text
+        assert "simplemail_bytes_total 200" in text
+        assert list(tmp_path.iterdir()) == [path]
+
+    def test_statsd(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as server:
+            server.bind(("127.0.0.1", 0))
+            server.settimeout(5)
+            exporter = StatsDExporter("127.0.0.1:%d" % server.getsockname()[1], prefix="sm")
+            exporter(_timings({"connect": 0.0015}))
+            lines = server.recv(65535).decode().split("\n")
+        assert "sm.phase.connect:1.500|ms" in lines
+        assert "sm.messages.sent:1|c" in lines
+        assert "sm.bytes:100|c" in lines
+
+    def test_install_exporters(self, tmp_path):
+        options = _ready_options(metrics_file=str(tmp_path / "m.prom"))
+        exporters = timing.install_exporters(options)
+        try:
+            assert [type(e) for e in exporters] == [PrometheusExporter]
+            assert exporters[0] in timing.HOOKS
+        finally:
+            for exporter in exporters:
+                timing.remove_hook(exporter)
@@ -0,0 +1,84 @@
+import ssl
+
+import pytest
+
+from simplemail import tls
+from simplemail.cli import apply_configuration, connect
+from simplemail.direct import MXResolver, deliver_to_domain
+from simplemail.sink import SMTPSink, sink_certificate
+from tests.test_cli import _make_options, _ready_options
+
+
+@pytest.fixture(autouse=True)
+def _clear_cache():
+    tls.clear_cache()
+    yield
+    tls.clear_cache()
+
+
+def _tls_options(sink, mode, **overrides):
+    return _ready_options(
+        sink,
+        tls="true" if mode == "starttls" else "false",
+        ssl="true" if mode == "ssl" else "false",
+        **overrides,
+    )
+
+
+# ---------------------------------------------------------------------------
+# SSL contexts
+# ---------------------------------------------------------------------------
+class TestSSLContext:
+    def test_shared_per_settings(self):
+        options = _make_options()
+        assert tls.ssl_context(options) is tls.ssl_context(_make_options())
+        assert tls.ssl_context(options) is not tls.ssl_context(options, verify=True)
+        assert tls.ssl_context(options).verify_mode == ssl.CERT_NONE
+
+    def test_settings(self):
+        cert = sink_certificate()
+        options = _make_options(ca_file=cert, client_cert=cert, tls_min_version="1.2")
+        context = tls.ssl_context(options)
+        assert context.verify_mode == ssl.CERT_REQUIRED
+        assert context.check_hostname
+        assert context.minimum_version == ssl.TLSVersion.TLSv1_2
+
+    def test_invalid_version(self):
+        with pytest.raises(ValueError):
+            tls.ssl_context(_make_options(tls_min_version="2.0"))
+
+    def test_configuration_file(self):
+        config = {"SMTP": {"host": "h", "port": "25", "cafile": "ca.pem", "tlsminversion": "1.3"}}
+        options = apply_configuration(_make_options(ca_file="cli.pem"), config)
+        assert (options.ca_file, options.tls_min_version) == ("cli.pem", "1.3")
+
+
+# ---------------------------------------------------------------------------
+# Session resumption
+# ---------------------------------------------------------------------------
+class TestResumption:
+    @pytest.mark.parametrize("mode", ["starttls", "ssl"])
+    def test_reconnection_resumes_the_session(self, mode):
+        with SMTPSink(tls=mode) as sink:
+            options = _tls_options(sink, mode)
+            reused = []
+            for _ in range(3):
+                server = connect(options)
+                reused.append(server.sock.session_reused)
+                server.quit()
+        assert reused == [False, True, True]
+
+    def test_verified_connection(self):
+        with SMTPSink(tls="starttls") as sink:
+            options = _tls_options(sink, "starttls", ca_file=sink_certificate())
+            server = connect(options)
+            assert server.sock.getpeercert()["subjectAltName"]
+            server.quit()
+
+    def test_direct_delivery(self):
+        with SMTPSink(tls="starttls") as sink:
+            resolver = MXResolver(static={"example.com": [sink.address]})
+            for _ in range(2):
+                deliver_to_domain(resolver, "example.com", "f@x.com", ["a@example.com"], b"hi")
+            assert len(sink.messages) == 2
+        assert len(tls._sessions) == 1